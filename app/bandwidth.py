@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+import heapq
+import itertools
+import threading
+import time
+import typing as ty
+
+
+class TokenBucket:
+    """
+    Limit a rate of bytes : each byte sent takes a token, the tokens come back at rate_bytes_s up to burst_bytes.
+    When several threads wait, the tokens are given in priority order (the lowest number first), then in arrival order.
+    """
+
+    def __init__(self, rate_bytes_s: float, burst_bytes: float):
+        self.rate_bytes_s = rate_bytes_s
+        self.burst_bytes = burst_bytes
+        self.tokens = burst_bytes
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        self.waiters: ty.List[ty.Tuple[int, int]] = []
+        self.counter = itertools.count()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst_bytes, self.tokens + (now - self.updated) * self.rate_bytes_s)
+        self.updated = now
+
+    def consume(self, size_bytes: int, priority: int = 0) -> None:
+        """
+        Wait until size_bytes can be sent. A request bigger than the burst only waits for a full bucket, and the debt
+        is paid by the next ones.
+        """
+        ticket = (priority, next(self.counter))
+        with self.condition:
+            heapq.heappush(self.waiters, ticket)
+            while True:
+                self._refill()
+                needed_bytes = min(size_bytes, self.burst_bytes)
+                if self.waiters[0] == ticket and self.tokens >= needed_bytes:
+                    break
+                # Only the first waiter knows when it will be served, the others are woken up when it is
+                self.condition.wait((needed_bytes - self.tokens) / self.rate_bytes_s if self.waiters[0] == ticket else None)
+            heapq.heappop(self.waiters)
+            self.tokens -= size_bytes
+            self.condition.notify_all()
+
+
+class MemoryBudget:
+    """
+    Limit the bytes of the parts and chunks held in memory at the same time by all the uploads.
+    Like TokenBucket, the waiting uploads are served in priority order.
+    A part bigger than the whole budget is accepted once nothing else is held.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.condition = threading.Condition()
+        self.waiters: ty.List[ty.Tuple[int, int]] = []
+        self.counter = itertools.count()
+
+    def acquire(self, size_bytes: int, priority: int = 0) -> None:
+        ticket = (priority, next(self.counter))
+        with self.condition:
+            heapq.heappush(self.waiters, ticket)
+            while self.waiters[0] != ticket or (self.used_bytes and self.used_bytes + size_bytes > self.max_bytes):
+                self.condition.wait()
+            heapq.heappop(self.waiters)
+            self.used_bytes += size_bytes
+            self.condition.notify_all()
+
+    def release(self, size_bytes: int) -> None:
+        with self.condition:
+            self.used_bytes -= size_bytes
+            self.condition.notify_all()
+
+
+class ThrottledReader:
+    """
+    File-like object whose reads wait for the throttle of their destination, so the HTTP clients reading it
+    (requests, botocore) send it at the allowed rate. Everything else is done by the wrapped file.
+    """
+
+    def __init__(self, file: ty.BinaryIO, throttle: "DestinationThrottle"):
+        self.file = file
+        self.throttle = throttle
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.throttle.consume(len(data))
+        return data
+
+    def __getattr__(self, name: str) -> ty.Any:
+        return getattr(self.file, name)
+
+
+class DestinationThrottle:
+    """
+    Rate limits and memory budget applied to the uploads of one destination : its own token bucket,
+    then the overall one shared with the other destinations, at the priority of the destination.
+    """
+
+    def __init__(self, priority: int = 0, bucket: TokenBucket | None = None, total_bucket: TokenBucket | None = None,
+                 memory_budget: MemoryBudget | None = None):
+        self.priority = priority
+        self.buckets = [bucket for bucket in (bucket, total_bucket) if bucket is not None]
+        self.memory_budget = memory_budget
+
+    def consume(self, size_bytes: int) -> None:
+        """
+        Wait until size_bytes can be sent. Negative sizes (bytes sent again after a retry rewinds) are ignored.
+        """
+        if size_bytes > 0:
+            for bucket in self.buckets:
+                bucket.consume(size_bytes, self.priority)
+
+    def wrap(self, file: ty.BinaryIO) -> ty.BinaryIO:
+        """
+        Return the file read at the allowed rate, or the file itself without rate limit.
+        """
+        return ThrottledReader(file, self) if self.buckets else file
+
+    def acquire_memory(self, size_bytes: int) -> None:
+        if self.memory_budget is not None:
+            self.memory_budget.acquire(size_bytes, self.priority)
+
+    def release_memory(self, size_bytes: int) -> None:
+        if self.memory_budget is not None:
+            self.memory_budget.release(size_bytes)
+
+    @contextmanager
+    def reserve_memory(self, size_bytes: int) -> ty.Iterator[None]:
+        """
+        Hold size_bytes of the memory budget while a part or a chunk is read and sent.
+        """
+        self.acquire_memory(size_bytes)
+        try:
+            yield
+        finally:
+            self.release_memory(size_bytes)
+
+
+# Used by the uploads done outside of an upload pipeline
+UNLIMITED = DestinationThrottle()
+
+
+class TransferScheduler:
+    """
+    Shares the uplink between the destinations of a run : a token bucket for each destination with a rate limit,
+    an overall one, and one memory budget for the parts and chunks of all the uploads.
+    On the overall bucket and the memory budget, a destination with a lower priority number is always served first,
+    so the others only use what it leaves (for example the Nextcloud uploads first, the archival S3 ones in the background).
+    Each bucket allows bursts of one second of its rate.
+    """
+
+    def __init__(self, rates_bytes_s: ty.Dict[str, float | None] | None = None, priorities: ty.Dict[str, int] | None = None,
+                 total_rate_bytes_s: float | None = None, memory_budget_bytes: int | None = None):
+        self.priorities = priorities or {}
+        self.buckets = {name: TokenBucket(rate, rate) for name, rate in (rates_bytes_s or {}).items() if rate}
+        self.total_bucket = TokenBucket(total_rate_bytes_s, total_rate_bytes_s) if total_rate_bytes_s else None
+        self.memory_budget = MemoryBudget(memory_budget_bytes) if memory_budget_bytes else None
+
+    def for_destination(self, name: str) -> DestinationThrottle:
+        return DestinationThrottle(self.priorities.get(name, 0), self.buckets.get(name), self.total_bucket, self.memory_budget)
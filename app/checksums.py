@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import threading
+import typing as ty
+import zlib
+
+# Internal files
+from definitions import FileDigests
+from staging import get_io_block_size
+
+
+class Adler32:
+    """
+    hashlib like wrapper around zlib.adler32, one of the checksums stored by Nextcloud.
+    """
+
+    def __init__(self):
+        self.value = 1
+
+    def update(self, data: bytes) -> None:
+        self.value = zlib.adler32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f"{self.value:08x}"
+
+
+def new_hash(algorithm: str) -> ty.Any:
+    """
+    Return a new hash object for the given algorithm (md5, sha1, sha256, adler32...).
+    """
+    if algorithm.lower() == "adler32":
+        return Adler32()
+    return hashlib.new(algorithm.lower())
+
+
+def file_digest(file_path: str, algorithm: str) -> str:
+    """
+    Return the hex digest of a file, read by big blocks.
+    """
+    file_hash = new_hash(algorithm)
+    with open(file_path, 'rb') as file:
+        while block := file.read(get_io_block_size()):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def s3_multipart_etag(file_path: str, part_size: int) -> str:
+    """
+    Return the ETag S3 gives to a file uploaded in parts of part_size : the MD5 of the MD5s of the parts, followed by the number of parts.
+    """
+    part_digests = []
+    with open(file_path, 'rb') as file:
+        while part := file.read(part_size):
+            part_digests.append(hashlib.md5(part).digest())
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+class FileDigester:
+    """
+    Compute all the digests needed by the destinations from the blocks of a file, in the order they are read :
+    the MD5 of the whole file and, if s3_part_size is given, the MD5 of each part of an S3 multipart upload.
+    While a file is hashed by one thread, the uploads of other threads can wait for the MD5 of a part or for all the digests.
+    """
+
+    def __init__(self, s3_part_size: int | None = None):
+        self.s3_part_size = s3_part_size
+        self.file_hash = hashlib.md5()
+        self.part_md5s: ty.List[str] = []
+        self.part_hash = hashlib.md5()
+        self.part_remaining = s3_part_size
+        self.size_bytes = 0
+        self.result: FileDigests | None = None
+        self.aborted = False
+        self.condition = threading.Condition()
+
+    def update(self, block: bytes) -> None:
+        self.size_bytes += len(block)
+        self.file_hash.update(block)
+        if self.s3_part_size is None:
+            return
+        # Split the block between the current part and the next ones
+        view = memoryview(block)
+        while view:
+            self.part_hash.update(view[:self.part_remaining])
+            consumed = min(self.part_remaining, len(view))
+            view = view[consumed:]
+            self.part_remaining -= consumed
+            if self.part_remaining == 0:
+                with self.condition:
+                    self.part_md5s.append(self.part_hash.hexdigest())
+                    self.condition.notify_all()
+                self.part_hash = hashlib.md5()
+                self.part_remaining = self.s3_part_size
+
+    def digests(self) -> FileDigests:
+        """
+        Return the digests, once every block of the file has been given.
+        """
+        part_md5s = list(self.part_md5s)
+        if self.s3_part_size is not None and (self.part_remaining != self.s3_part_size or not part_md5s):
+            part_md5s.append(self.part_hash.hexdigest())
+        with self.condition:
+            self.result = FileDigests(size_bytes=self.size_bytes, md5=self.file_hash.hexdigest(), s3_part_size=self.s3_part_size, s3_part_md5s=part_md5s)
+            self.condition.notify_all()
+        return self.result
+
+    def abort(self) -> None:
+        """
+        Stop the waits for the digests, when the file could not be read entirely.
+        """
+        with self.condition:
+            self.aborted = True
+            self.condition.notify_all()
+
+    def wait_digests(self) -> FileDigests:
+        """
+        Wait for the digests of the whole file (see digests).
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.result is not None or self.aborted)
+            if self.result is None:
+                raise ValueError("The digests of the file could not be computed")
+            return self.result
+
+    def wait_part_md5(self, part_number: int) -> str:
+        """
+        Wait for the MD5 of a part of the S3 multipart upload (numbered from 1), known once its last block is hashed.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.part_md5s) >= part_number or self.result is not None or self.aborted)
+            part_md5s = self.result.s3_part_md5s if self.result is not None else self.part_md5s
+            if len(part_md5s) < part_number:
+                raise ValueError(f"The MD5 of part {part_number} of the file could not be computed")
+            return part_md5s[part_number - 1]
+
+
+def compute_file_digests(file_path: str, s3_part_size: int | None = None) -> FileDigests:
+    """
+    Read a file once and return all the digests needed by the destinations (see FileDigester).
+    """
+    digester = FileDigester(s3_part_size)
+    with open(file_path, 'rb') as file:
+        while block := file.read(get_io_block_size()):
+            digester.update(block)
+    return digester.digests()
+
+
+def md5_base64(hex_digest: str) -> str:
+    """
+    Convert an MD5 hex digest into the base64 form expected by the Content-MD5 header.
+    """
+    return base64.b64encode(bytes.fromhex(hex_digest)).decode()
+
+
+def s3_etag_from_digests(digests: FileDigests, multipart: bool) -> str | None:
+    """
+    Return the ETag S3 gives to the file, from its digests. None if the part MD5s are not known.
+    """
+    if not multipart:
+        return digests.md5
+    if not digests.s3_part_md5s:
+        return None
+    return f"{hashlib.md5(b''.join(bytes.fromhex(part_md5) for part_md5 in digests.s3_part_md5s)).hexdigest()}-{len(digests.s3_part_md5s)}"
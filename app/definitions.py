@@ -1,5 +1,7 @@
+from datetime import datetime
 from enum import Enum
 from typing import Any
+import typing as ty
 from pydantic import BaseModel,  validator, root_validator
 
 
@@ -7,6 +9,42 @@ class PowershellCommandParameter(Enum):
     LIST_VIDEOS = "list_videos"
     COPY_FILES = "copy_files"
     DELETE_FILES = "delete_files"
+    SESSION = "session"
+    CHECK_DEVICE = "check_device"
+
+
+class DeviceEventType(Enum):
+    # One JSON line written by timeframe_archivist.ps1 for each of these events
+    LISTED = "listed"
+    LISTING_DONE = "listing_done"
+    COPY_STARTED = "copy_started"
+    COPIED = "copied"
+    DELETED = "deleted"
+    ERROR = "error"
+    DONE = "done" # Last event of a request
+
+
+class DeviceBackend(Enum):
+    POWERSHELL = "powershell"
+    LOCAL = "local"
+
+
+class JournalStage(Enum):
+    LISTED = "listed"
+    COPIED = "copied"
+    RENAMED = "renamed"
+    UPLOADED = "uploaded" # One entry per destination
+    SHARED = "shared"
+    NOTIFIED = "notified"
+    DELETED = "deleted"
+
+
+class NotificationType(Enum):
+    # The notifications coalesced in one Telegram message are grouped in this order
+    SHARE_READY = "share_ready"
+    ARCHIVED = "archived"
+    RUN_FAILED = "run_failed"
+    MESSAGE = "message"
 
 
 class Event(BaseModel):
@@ -21,12 +59,37 @@ class Event(BaseModel):
     validation_videos_found: bool
     S3_upload: bool
     S3_storage_class: str | None
+    S3_multipart_threshold_mb: int = 64 # Files above this size are sent in several parts
+    S3_multipart_chunksize_mb: int = 64 # Size of each part
+    S3_max_concurrency: int = 10 # Number of parts of one file uploaded at the same time
     S3_bucket: str | None
     S3_folder: str | None
+    S3_upload_workers: int = 1 # Number of files uploaded at the same time to S3
     nextcloud_upload: bool
     nextcloud_folder: str | None
+    nextcloud_upload_workers: int = 1 # Number of files uploaded at the same time to Nextcloud
+    nextcloud_chunked_upload: bool = False # Upload big files in chunks, which can be resumed
+    nextcloud_chunk_size_mb: int = 64 # Size of each chunk (Nextcloud accepts 5 MB to 5 GB)
+    nextcloud_chunk_workers: int = 4 # Number of chunks of one file uploaded at the same time
     nextcloud_public_share : bool | None
+    nextcloud_share_event_folder: bool = False # Share the whole nextcloud_folder with one link instead of one link per file
+    nextcloud_share_workers: int = 4 # Number of shares created at the same time
     nextcloud_telegram_notification: bool | None
+    telegram_archive_notification: bool = False # Also notify each video archived on S3
+    telegram_failure_notification: bool = True # Notify when the archive of the event fails
+    streaming_upload: bool = False # Read each video once and give the same blocks to the local copy and the uploads
+    streaming_block_size_mb: int = 8 # Size of the blocks read
+    streaming_buffered_blocks: int = 4 # Blocks waiting for a slow destination before the reading pauses
+    upload_max_rate_mb_s: float | None = None # Upload rate limit of all the destinations together
+    upload_memory_budget_mb: int | None = None # Size of the parts and chunks held in memory by all the uploads
+    S3_max_rate_mb_s: float | None = None # Upload rate limit of S3
+    S3_priority: int = 1 # The destinations with the lowest number are served first by upload_max_rate_mb_s and upload_memory_budget_mb
+    nextcloud_max_rate_mb_s: float | None = None # Upload rate limit of Nextcloud
+    nextcloud_priority: int = 0
+    nextcloud_rendition: bool = False # Upload a lighter copy made by ffmpeg to Nextcloud, S3 keeps the original
+    nextcloud_rendition_max_height: int | None = 1080 # Higher videos are scaled down
+    nextcloud_rendition_video_bitrate_kbps: int | None = 6000 # Without a height and a bitrate, the video is only remuxed
+    nextcloud_rendition_workers: int = 2 # Number of videos transcoded at the same time
     
     
     @validator('complex_name_format_helper', always=True, pre=True)
@@ -89,15 +152,76 @@ class VideoBasicInfos(BaseModel):
     size_mb: int
     creation_date: str
     original_name: str
+    device_id: str # Stable id of the video on the device (month folder / file name)
+    size_bytes: int | None = None # Exact size, when the device gives it
+    creation_date_utc: str | None = None # YYYY-MM-DD HH:MM:SS, when the device gives it
+    duration_s: float | None = None # The next ones are read from the container of the video (mp4_metadata.py), when it can be read
+    width: int | None = None # As displayed, the rotation of the video applied
+    height: int | None = None
+    codec: str | None = None # Sample entry of the video track (hvc1, avc1...)
+    
+class ContainerMetadata(BaseModel):
+    creation_date_utc: str | None = None # YYYY-MM-DD HH:MM:SS
+    duration_s: float | None = None
+    width: int | None = None
+    height: int | None = None
+    codec: str | None = None
+    
+class FileDigests(BaseModel):
+    size_bytes: int
+    md5: str
+    s3_part_size: int | None # Size of the parts used for s3_part_md5s
+    s3_part_md5s: ty.List[str] # MD5 of each part of an S3 multipart upload
     
+class DeviceEvent(BaseModel):
+    event: DeviceEventType
+    id: str | None = None # Id of the video in the device manifest
+    video: ty.Dict[str, ty.Any] | None = None # Raw listing of the video, for LISTED
+    size_bytes: int | None = None
+    seconds: float | None = None # Duration of the copy, for COPIED
+    message: str | None = None # For ERROR
+
+
+class RenditionSettings(BaseModel):
+    max_height: int | None
+    video_bitrate_kbps: int | None
+
+class Rendition(BaseModel):
+    path: str
+    digests: FileDigests
+    duration_s: float # Time taken by ffmpeg
+
 class VideoInfosWrapper(BaseModel):
     video_basic_infos: VideoBasicInfos
     new_name: str
     wsl_full_path: str 
+    digests: FileDigests | None = None # Computed once after the copy, set on the copy of the video given to each destination
+    rendition: Rendition | None = None # Lighter copy uploaded instead of wsl_full_path to the destinations using renditions
+    
+class EventWindow(BaseModel):
+    event: Event
+    day: str
+    start_utc: datetime
+    stop_utc: datetime
+    
+class UploadResult(BaseModel):
+    video_name: str
+    destination: str
+    location: str | None # Path of the file on the destination, None if the upload failed
+    error: str | None
+    size_bytes: int = 0
+    skipped: bool = False # The file was already present on the destination
+    rendition_size_bytes: int | None = None # Size of the lighter copy uploaded instead of the file
+    
+class RemoteFile(BaseModel):
+    name: str
+    size_bytes: int
+    checksum: str | None # S3 ETag, or Nextcloud checksums ("SHA1:... MD5:...") when the server has some
     
 class NextCloudInfos(BaseModel):
     user: str
     password: str
     base_url: str
     webdav_url: str
+    uploads_url: str
     ocs_url: str
\ No newline at end of file
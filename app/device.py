@@ -0,0 +1,266 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+import os
+import typing as ty
+
+import typer
+
+# Internal files
+from definitions import ContainerMetadata, Inputs, VideoBasicInfos, DeviceBackend
+from event_windows import build_event_window, select_videos_in_window
+from kernel_copy import copy_file
+from metrics import METRICS
+from mp4_metadata import read_container_metadata
+from timezones import format_local_date, parse_utc_date
+from utils import windows_to_wsl2_path
+
+
+VIDEO_EXTENSIONS = (".mp4", ".mov")
+
+
+class DeviceSession(ABC):
+    """
+    A connection to the phone that lives for a whole archive run.
+    The device is enumerated only once : the matched videos are kept in a manifest indexed by
+    their stable device id, and copies and deletions are driven from that manifest.
+    With a date_range (first and last day, DD/MM/YYYY), every video of the range is listed with its UTC creation date,
+    whatever the event, so the videos of several events and days can be archived from a single listing.
+    """
+
+    def __init__(self, inputs_result: Inputs | None, date_range: ty.Tuple[str, str] | None = None):
+        self.inputs_result = inputs_result
+        self.date_range = date_range
+        self.manifest: ty.Dict[str, VideoBasicInfos] | None = None
+
+    def __enter__(self) -> "DeviceSession":
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """
+        Connect to the device. Nothing to do by default.
+        """
+
+    def close(self) -> None:
+        """
+        Release the device. Nothing to do by default.
+        """
+
+    def list_videos(self) -> ty.List[VideoBasicInfos]:
+        """
+        Return the videos matching the event window (or every video of the date range), sorted by creation date.
+        The device is only walked on the first call, the next calls are served from the manifest.
+        """
+        if self.manifest is None:
+            videos = self._enumerate_videos()
+            if self.date_range is None:
+                videos = select_videos_in_window(videos, build_event_window(self.inputs_result.event, self.inputs_result.day))
+            else:
+                videos = sorted(videos, key=lambda video: video.creation_date_utc)
+            self.manifest = {video.device_id: video for video in videos}
+        return list(self.manifest.values())
+
+    def listing_range(self) -> ty.Tuple[str, str]:
+        """
+        Return the first and last day of the videos to list from the device.
+        """
+        return self.date_range or (self.inputs_result.day, self.inputs_result.day)
+
+    def copy_videos(self, videos: ty.List[VideoBasicInfos]) -> ty.Iterator[VideoBasicInfos]:
+        """
+        Copy the given videos of the manifest to the destination folder.
+        Each video is yielded as soon as its copy is done, while the next ones are still being copied.
+        """
+        ids = self._manifest_ids(videos)
+        if not ids:
+            return
+        for device_id in self._copy_items(ids):
+            yield self.manifest[device_id]
+
+    def delete_videos(self, videos: ty.List[VideoBasicInfos]) -> None:
+        """
+        Delete the given videos of the manifest from the device.
+        """
+        self._delete_items(self._manifest_ids(videos))
+
+    def source_path(self, video: VideoBasicInfos) -> str | None:
+        """
+        Return the path the video can be read from directly, to stream it while it is copied.
+        None by default : the video has to be copied with copy_videos first.
+        """
+        return None
+
+    def _manifest_ids(self, videos: ty.List[VideoBasicInfos]) -> ty.List[str]:
+        if self.manifest is None:
+            raise ValueError("The device has to be listed before copying or deleting videos")
+        ids = []
+        for video in videos:
+            if video.device_id not in self.manifest:
+                raise ValueError(f"Video {video.original_name} is not part of the device manifest")
+            ids.append(video.device_id)
+        return ids
+
+    @abstractmethod
+    def _enumerate_videos(self) -> ty.List[VideoBasicInfos]:
+        """
+        Return the raw listing of the videos around listing_range, with their UTC creation date.
+        """
+
+    @abstractmethod
+    def _copy_items(self, ids: ty.List[str]) -> ty.Iterator[str]:
+        """
+        Copy the videos, and yield the id of each video once copied.
+        """
+
+    @abstractmethod
+    def _delete_items(self, ids: ty.List[str]) -> None:
+        ...
+
+
+class LocalDirectoryDeviceSession(DeviceSession):
+    """
+    Native device session for a phone storage mounted as a folder (gvfs MTP mount, ifuse...) or any folder laid out
+    like it (one sub folder per month, videos inside), which allows to run the whole archive flow on Linux without PowerShell.
+    The creation date, duration, resolution and codec of the videos are read from their container, without reading their media.
+    Videos are copied in parallel by copy_workers threads, with the kernel copies of kernel_copy.py.
+    """
+
+    def __init__(self, inputs_result: Inputs | None, source_folder: str, destination_folder: str | None = None,
+                 date_range: ty.Tuple[str, str] | None = None, copy_workers: int = 4):
+        super().__init__(inputs_result, date_range)
+        self.source_folder = source_folder
+        self.destination_folder = destination_folder or windows_to_wsl2_path(os.getenv("WINDOWS_DESTINATION_FOLDER"))
+        self.copy_workers = copy_workers
+
+    def _enumerate_videos(self) -> ty.List[VideoBasicInfos]:
+        if not os.path.isdir(self.source_folder):
+            raise ValueError(f"Device folder {self.source_folder} not found.")
+        range_start, range_stop = self.listing_range()
+        # One more day on each side, as the PowerShell listing, so the events late or early in the day in any timezone are kept
+        start_utc = datetime.strptime(range_start, "%d/%m/%Y").replace(tzinfo=timezone.utc) - timedelta(days=1)
+        stop_utc = datetime.strptime(range_stop, "%d/%m/%Y").replace(tzinfo=timezone.utc) + timedelta(days=2)
+        entries = list(self._walk_videos(self.source_folder, start_utc, stop_utc))
+        # Each read waits for the device, they are made by several threads
+        with ThreadPoolExecutor(max_workers=self.copy_workers, thread_name_prefix="device-listing") as executor:
+            videos = list(executor.map(self._read_video_infos, entries))
+        return [video for video in videos if start_utc <= parse_utc_date(video.creation_date_utc) < stop_utc]
+
+    def _read_video_infos(self, entry: os.DirEntry) -> VideoBasicInfos:
+        """
+        Return the infos of a video file, from the moov box of its container (mp4_metadata.py).
+        The modification time is used as creation date when the container has none or can't be read.
+        """
+        stat = entry.stat()
+        try:
+            metadata = read_container_metadata(entry.path) or ContainerMetadata()
+        except (OSError, ValueError) as e:
+            typer.echo(f"Metadata of {entry.name} not read, its modification time is used as creation date : {e}")
+            metadata = ContainerMetadata()
+        creation_date_utc = metadata.creation_date_utc or datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        return VideoBasicInfos(
+            size_mb=round(stat.st_size / (1024 * 1024)),
+            creation_date=format_local_date(parse_utc_date(creation_date_utc), "UTC"),
+            original_name=entry.name,
+            device_id=os.path.relpath(entry.path, self.source_folder).replace(os.sep, "/"),
+            size_bytes=stat.st_size,
+            creation_date_utc=creation_date_utc,
+            duration_s=metadata.duration_s,
+            width=metadata.width,
+            height=metadata.height,
+            codec=metadata.codec,
+        )
+
+    def _walk_videos(self, folder: str, start_utc: datetime, stop_utc: datetime) -> ty.Iterator[os.DirEntry]:
+        """
+        Yield the video files of the folder and its sub folders. The month folders of the phone (named YYYYMM...)
+        outside of the range are not opened, as each directory listing is slow on a MTP mount.
+        """
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    month = entry.name[:6]
+                    if month.isdigit() and not start_utc.strftime("%Y%m") <= month <= stop_utc.strftime("%Y%m"):
+                        continue
+                    yield from self._walk_videos(entry.path, start_utc, stop_utc)
+                elif entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    yield entry
+
+    def source_path(self, video: VideoBasicInfos) -> str | None:
+        return os.path.join(self.source_folder, self._manifest_ids([video])[0])
+
+    def _copy_items(self, ids: ty.List[str]) -> ty.Iterator[str]:
+        os.makedirs(self.destination_folder, exist_ok=True)
+        for device_id in ids:
+            video = self.manifest[device_id]
+            target_path = os.path.join(self.destination_folder, video.original_name)
+            if os.path.exists(target_path):
+                raise ValueError(f"Destination file exists - file {video.original_name} not moved to : {target_path}")
+        executor = ThreadPoolExecutor(max_workers=self.copy_workers, thread_name_prefix="device-copy")
+        try:
+            futures = {executor.submit(self._copy_item, device_id): device_id for device_id in ids}
+            # Each video is given back as soon as it is copied, whatever its order
+            for future in as_completed(futures):
+                future.result()
+                yield futures[future]
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _copy_item(self, device_id: str) -> None:
+        # The file only appears under its name once complete
+        video = self.manifest[device_id]
+        target_path = os.path.join(self.destination_folder, video.original_name)
+        partial_path = f"{target_path}.part"
+        try:
+            with METRICS.transfer(f"{video.original_name} ← device", video.size_bytes or 0) as transfer, \
+                    METRICS.measure("copy", video.size_bytes or 0, video.original_name):
+                transfer.advance(copy_file(os.path.join(self.source_folder, device_id), partial_path))
+        except OSError as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise ValueError(f"Failed to copy {device_id} to {target_path}: {e}")
+        os.replace(partial_path, target_path)
+
+    def _delete_items(self, ids: ty.List[str]) -> None:
+        for device_id in ids:
+            os.remove(os.path.join(self.source_folder, device_id))
+
+
+def is_device_connected() -> bool:
+    """
+    Return True if the device of the DEVICE_BACKEND env variable is available : the phone is plugged in Windows,
+    or LOCAL_DEVICE_FOLDER exists and is not empty (a mount point stays empty until the phone is mounted).
+    """
+    backend = DeviceBackend(os.getenv("DEVICE_BACKEND", DeviceBackend.POWERSHELL.value))
+    if backend == DeviceBackend.LOCAL:
+        source_folder = os.getenv("LOCAL_DEVICE_FOLDER")
+        if not source_folder:
+            raise ValueError("LOCAL_DEVICE_FOLDER is mandatory when DEVICE_BACKEND is local")
+        try:
+            with os.scandir(source_folder) as entries:
+                return any(True for _ in entries)
+        except OSError:
+            return False
+
+    from powershell_calls import is_powershell_device_connected
+    return is_powershell_device_connected()
+
+
+def open_device_session(inputs_result: Inputs | None, date_range: ty.Tuple[str, str] | None = None) -> DeviceSession:
+    """
+    Return the device session selected by the DEVICE_BACKEND env variable (powershell by default).
+    It lists the videos of the event of inputs_result, or every video of date_range when it is given.
+    """
+    backend = DeviceBackend(os.getenv("DEVICE_BACKEND", DeviceBackend.POWERSHELL.value))
+    if backend == DeviceBackend.LOCAL:
+        source_folder = os.getenv("LOCAL_DEVICE_FOLDER")
+        if not source_folder:
+            raise ValueError("LOCAL_DEVICE_FOLDER is mandatory when DEVICE_BACKEND is local")
+        return LocalDirectoryDeviceSession(inputs_result, source_folder, date_range=date_range,
+                                           copy_workers=int(os.getenv("DEVICE_COPY_WORKERS") or 4))
+
+    from powershell_calls import PowershellDeviceSession
+    return PowershellDeviceSession(inputs_result, date_range)
@@ -0,0 +1,57 @@
+import json
+import typing as ty
+
+from pydantic import ValidationError
+
+# Internal files
+from definitions import DeviceEvent, VideoBasicInfos
+from timezones import parse_utc_date, format_local_date
+
+
+# Protocol spoken by timeframe_archivist.ps1 on its stdout : one JSON object per line (NDJSON), one per event.
+#   {"event": "listed", "video": {"id": ..., "original_name": ..., "size_bytes": ..., "creation_date_utc": ...}}
+#   {"event": "listing_done"}                                   after the last listed video
+#   {"event": "copy_started", "id": ..., "size_bytes": ...}
+#   {"event": "copied", "id": ..., "size_bytes": ..., "seconds": ...}
+#   {"event": "deleted", "id": ...}
+#   {"event": "error", "id": ..., "message": ...}               id is missing when the error is not about one video
+#   {"event": "done"}                                           after the last event of a copy or delete request,
+#                                                               or alone when check_device finds the phone
+# Any other line (warnings printed by PowerShell...) is ignored.
+
+
+def parse_device_event(line: str) -> DeviceEvent | None:
+    """
+    Return the event written on a line of the script output, None if the line is not an event.
+    """
+    try:
+        message = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(message, dict) or "event" not in message:
+        return None
+    try:
+        return DeviceEvent(**message)
+    except ValidationError:
+        raise ValueError(f"Malformed event from the device script: {line.strip()}")
+
+
+def read_device_events(lines: ty.Iterable[str]) -> ty.Iterator[DeviceEvent]:
+    """
+    Yield the events of the script output as soon as each line is written.
+    """
+    for line in lines:
+        event = parse_device_event(line)
+        if event is not None:
+            yield event
+
+
+def video_from_listing(video: ty.Dict[str, ty.Any]) -> VideoBasicInfos:
+    """
+    Convert the raw listing of a video to its VideoBasicInfos. The creation date is kept in UTC,
+    the event window is applied later.
+    """
+    creation_date_utc = parse_utc_date(video["creation_date_utc"])
+    return VideoBasicInfos(size_mb=round(video["size_bytes"] / (1024 * 1024)), creation_date=format_local_date(creation_date_utc, "UTC"),
+                           original_name=video["original_name"], device_id=video["id"], size_bytes=video["size_bytes"],
+                           creation_date_utc=video["creation_date_utc"])
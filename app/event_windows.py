@@ -0,0 +1,131 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+import typer
+import typing as ty
+
+# Internal files
+from definitions import Event, EventWindow, VideoBasicInfos
+from timezones import local_to_utc, parse_utc_date, format_local_date
+
+
+class EventWindowIndex:
+    """
+    The windows of all the events on all the days of a date range, sorted by start.
+    A video is assigned with a binary search on the starts instead of a scan of every event and day.
+    Events of events.yml can overlap : all the windows containing a moment are returned.
+    """
+
+    def __init__(self, windows: ty.List[EventWindow]):
+        self.windows = sorted(windows, key=lambda window: window.start_utc)
+        self.starts = [window.start_utc for window in self.windows]
+        self.longest_window = max((window.stop_utc - window.start_utc for window in self.windows), default=timedelta(0))
+
+    def find_all(self, moment: datetime) -> ty.List[EventWindow]:
+        """
+        Return the windows containing the given UTC moment, by start.
+        """
+        windows = []
+        position = bisect_right(self.starts, moment)
+        # Only the windows started less than longest_window before the moment can still be open
+        while position > 0:
+            position -= 1
+            window = self.windows[position]
+            if window.start_utc < moment - self.longest_window:
+                break
+            if moment <= window.stop_utc:
+                windows.append(window)
+        return windows[::-1]
+
+
+def build_event_window(event: Event, day: str) -> EventWindow:
+    """
+    Return the window of the event on the given day (DD/MM/YYYY), in UTC.
+    An event stopping before it starts ends on the next day.
+    """
+    start_utc = local_to_utc(day, event.event_start, event.event_timezone)
+    stop_utc = local_to_utc(day, event.event_stop, event.event_timezone)
+    if stop_utc <= start_utc:
+        stop_utc += timedelta(days=1)
+    return EventWindow(event=event, day=day, start_utc=start_utc, stop_utc=stop_utc)
+
+
+def build_event_windows(events: ty.List[Event], range_start: str, range_stop: str) -> ty.List[EventWindow]:
+    """
+    Return the window of every event on every day between range_start and range_stop (DD/MM/YYYY, included).
+    """
+    first_day = datetime.strptime(range_start, "%d/%m/%Y")
+    last_day = datetime.strptime(range_stop, "%d/%m/%Y")
+    if last_day < first_day:
+        raise ValueError(f"The end of the date range ({range_stop}) is before its start ({range_start})")
+
+    windows = []
+    for day_number in range((last_day - first_day).days + 1):
+        day = (first_day + timedelta(days=day_number)).strftime("%d/%m/%Y")
+        for event in events:
+            windows.append(build_event_window(event, day))
+    return windows
+
+
+def select_videos_in_window(videos: ty.List[VideoBasicInfos], window: EventWindow) -> ty.List[VideoBasicInfos]:
+    """
+    Return the videos created during the window, sorted by creation date, with their creation date
+    set in the timezone of the event.
+    """
+    selected_videos = []
+    for video in videos:
+        creation_date_utc = get_creation_date_utc(video)
+        if window.start_utc <= creation_date_utc <= window.stop_utc:
+            video.creation_date = format_local_date(creation_date_utc, window.event.event_timezone)
+            selected_videos.append(video)
+    return sorted(selected_videos, key=lambda video: video.creation_date_utc)
+
+
+def get_creation_date_utc(video: VideoBasicInfos) -> datetime:
+    if video.creation_date_utc is None:
+        raise ValueError(f"The device did not give the UTC creation date of {video.original_name}")
+    return parse_utc_date(video.creation_date_utc)
+
+
+def group_videos_by_event_window(videos: ty.List[VideoBasicInfos], index: EventWindowIndex) -> ty.List[ty.Tuple[EventWindow, ty.List[VideoBasicInfos]]]:
+    """
+    Assign each video to the event window it was created in, and return the windows having videos in chronological order,
+    each with its videos sorted by creation date. The creation date of the videos is set in the timezone of their event.
+    The videos outside of every window are left aside, and so are the videos created during the windows of several events :
+    they would be renamed, uploaded and deleted under an event they may not belong to.
+    """
+    groups: ty.Dict[int, ty.List[VideoBasicInfos]] = {}
+    windows_by_id: ty.Dict[int, EventWindow] = {}
+    unassigned_videos = 0
+    ambiguous_videos = []
+    for video in videos:
+        creation_date_utc = get_creation_date_utc(video)
+        windows = index.find_all(creation_date_utc)
+        if not windows:
+            unassigned_videos += 1
+            continue
+        if len(windows) > 1:
+            ambiguous_videos.append((video, windows))
+            continue
+        window, = windows
+        video.creation_date = format_local_date(creation_date_utc, window.event.event_timezone)
+        groups.setdefault(id(window), []).append(video)
+        windows_by_id[id(window)] = window
+
+    if unassigned_videos:
+        typer.echo(f"{unassigned_videos} video(s) created outside of every event window, left on the device")
+    if ambiguous_videos:
+        typer.echo(f"{len(ambiguous_videos)} video(s) created during the windows of several events, left on the device to be archived with their event :")
+        for video, windows in ambiguous_videos:
+            events = ", ".join(f"{window.event.video_title.strip()} on {window.day}" for window in windows)
+            typer.echo(f"  {video.original_name} ({format_local_date(get_creation_date_utc(video), windows[0].event.event_timezone)}) : {events}")
+    return [(windows_by_id[window_id], sorted(group, key=lambda video: video.creation_date_utc))
+            for window_id, group in sorted(groups.items(), key=lambda item: windows_by_id[item[0]].start_utc)]
+
+
+def assign_videos_to_events(videos: ty.List[VideoBasicInfos], events: ty.List[Event], range_start: str,
+                            range_stop: str) -> ty.List[ty.Tuple[EventWindow, ty.List[VideoBasicInfos]]]:
+    """
+    Group the videos of a single device listing by event and day, for every event of events.yml over the date range.
+    """
+    index = EventWindowIndex(build_event_windows(events, range_start, range_stop))
+    return group_videos_by_event_window(videos, index)
@@ -9,14 +9,40 @@ from utils import windows_to_wsl2_path, get_extension
 
 def check_files_correctly_copied(available_videos: ty.List[VideoBasicInfos]) -> None:
     """
-    This function checks if the files copied with powershell script are present on Windows
+    This function checks if the files copied with powershell script are present on Windows,
+    with the size given by the device (exact size when known, else the size in Mb).
+    The content itself is hashed afterwards by the upload pipeline, and checked by the destinations.
     """
     for video in available_videos:
         wsl2_path: str = windows_to_wsl2_path(os.getenv("WINDOWS_DESTINATION_FOLDER"))
-        file_exists: bool = os.path.exists(wsl2_path + "/" + video.original_name)
+        file_path = wsl2_path + "/" + video.original_name
+        file_exists: bool = os.path.exists(file_path)
         if not file_exists:
             raise ValueError(f"File {video.original_name} has not been correctly copied to {os.getenv('WINDOWS_DESTINATION_FOLDER')}\\{video.original_name}")
+        size_bytes = os.path.getsize(file_path)
+        if video.size_bytes is not None:
+            size_ok = size_bytes == video.size_bytes
+        else:
+            size_ok = round(size_bytes / (1024 * 1024)) == video.size_mb
+        if not size_ok:
+            raise ValueError(f"File {video.original_name} has not been correctly copied : its size ({size_bytes} bytes) differs from the one on the device ({video.size_mb} Mb)")
         
+
+
+def get_copied_video_path(video: VideoBasicInfos) -> str:
+    """
+    Return the path of a video copied from the device, before it is renamed.
+    """
+    return windows_to_wsl2_path(os.getenv("WINDOWS_DESTINATION_FOLDER")) + "/" + video.original_name
+
+
+def remove_partial_copy(video: VideoBasicInfos) -> None:
+    """
+    This function removes what is left of a copy interrupted by a previous run, so the video can be copied again.
+    """
+    copied_video_path = get_copied_video_path(video)
+    if os.path.exists(copied_video_path):
+        os.remove(copied_video_path)
     
     
 # TODO Check complex name is windows
@@ -24,10 +50,11 @@ def check_files_correctly_copied(available_videos: ty.List[VideoBasicInfos]) ->
 def wrapp_data_to_videos(inputs_result: Inputs, videos : ty.List[VideoBasicInfos]) -> ty.List[VideoInfosWrapper]:
     """
     This function create the title and wsl full path of each videos
-    and return an object wrapping them
+    and return an object wrapping them. The parts are numbered in the order the videos were created,
+    from their exact creation date (read from their container when the device allows it).
     """   
     
-    
+    videos = sorted(videos, key=lambda video: video.creation_date_utc or "")
     video_title = inputs_result.event.video_title
     wsl2_path = windows_to_wsl2_path(os.getenv("WINDOWS_DESTINATION_FOLDER"))
     if inputs_result.event.complex_naming:
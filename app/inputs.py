@@ -9,6 +9,16 @@ from definitions import Event, Inputs,VideoBasicInfos
 
 from utils import validate_date_format
 
+# Optional settings of an event : when they are absent from events.yml, the defaults of Event are used
+OPTIONAL_EVENT_KEYS = ["S3_multipart_threshold_mb", "S3_multipart_chunksize_mb", "S3_max_concurrency",
+                       "S3_upload_workers", "nextcloud_upload_workers", "nextcloud_chunked_upload", "nextcloud_chunk_size_mb",
+                       "nextcloud_chunk_workers", "nextcloud_share_event_folder", "nextcloud_share_workers",
+                       "telegram_archive_notification", "telegram_failure_notification",
+                       "streaming_upload", "streaming_block_size_mb", "streaming_buffered_blocks",
+                       "upload_max_rate_mb_s", "upload_memory_budget_mb", "S3_max_rate_mb_s", "S3_priority",
+                       "nextcloud_max_rate_mb_s", "nextcloud_priority", "nextcloud_rendition", "nextcloud_rendition_max_height",
+                       "nextcloud_rendition_video_bitrate_kbps", "nextcloud_rendition_workers"]
+
 
 def prompt_validation_videos_found(videos_infos: ty.List[VideoBasicInfos]) -> bool:
     """
@@ -20,7 +30,13 @@ def prompt_validation_videos_found(videos_infos: ty.List[VideoBasicInfos]) -> bo
     typer.echo("Video(s) found on the device : ")
     for video in videos_infos:
         video : VideoBasicInfos = video
-        typer.echo(f"Size : {video.size_mb} Mb - Date created : {video.creation_date} - Name : {video.original_name}")
+        details = ""
+        if video.duration_s is not None:
+            minutes, seconds = divmod(round(video.duration_s), 60)
+            details += f" - Duration : {minutes}:{seconds:02d}"
+        if video.width and video.height:
+            details += f" - {video.width}x{video.height} {video.codec or ''}".rstrip()
+        typer.echo(f"Size : {video.size_mb} Mb - Date created : {video.creation_date}{details} - Name : {video.original_name}")
         
     user_satisfied = typer.confirm("Do you want to continue ? ", default=True)
     
@@ -48,26 +64,7 @@ def prompt_options(events: ty.List[Event]) -> Inputs:
     
     typer.echo(f"You picked: {chosen_number} - {chosen_event.video_title}")
     
-    # If the event has a complex title, display the helper and ask to complete the title
-    if chosen_event.complex_naming:
-        while True:
-            typer.echo("Your event has a complex naming (you need to complete it). The beginning of the title is :")
-            typer.echo(f"{chosen_event.video_title}")
-            typer.echo("It has to follow this format : ")
-            typer.echo(f"{chosen_event.complex_name_format_helper}")
-            complex_title_end = str(typer.prompt("Please complete the title", type=str))
-            complete_title = f"{chosen_event.video_title}{complex_title_end}"
-            typer.echo(f"Complete title : {complete_title}")
-
-            # Ask the user if they are satisfied with the title
-            user_satisfied = typer.confirm("Are you happy with this title?", default=True)
-
-            if user_satisfied:
-                break  # Exit the loop if the user is satisfied
-            else:
-                typer.echo("Let's try completing the title again.") 
-    else:
-        complex_title_end = None
+    complex_title_end = prompt_complex_title_end(chosen_event)
         
     # Pick day when the even occured
     days = ["Today", "Yesterday", "Another day"]
@@ -98,6 +95,30 @@ def prompt_options(events: ty.List[Event]) -> Inputs:
             
     return inputs
 
+def prompt_complex_title_end(event: Event) -> str | None:
+    """
+    If the event has a complex title, this function displays the helper and asks the user to complete the title.
+    It returns the end of the title, or None if the event has a simple title.
+    """
+    if not event.complex_naming:
+        return None
+    while True:
+        typer.echo("Your event has a complex naming (you need to complete it). The beginning of the title is :")
+        typer.echo(f"{event.video_title}")
+        typer.echo("It has to follow this format : ")
+        typer.echo(f"{event.complex_name_format_helper}")
+        complex_title_end = str(typer.prompt("Please complete the title", type=str))
+        complete_title = f"{event.video_title}{complex_title_end}"
+        typer.echo(f"Complete title : {complete_title}")
+
+        # Ask the user if they are satisfied with the title
+        user_satisfied = typer.confirm("Are you happy with this title?", default=True)
+
+        if user_satisfied:
+            return complex_title_end
+        typer.echo("Let's try completing the title again.") 
+
+
 def generic_prompt(number_start: int, number_end: int) -> int:
     valid_choice = False
     while not valid_choice:
@@ -138,12 +159,16 @@ def yaml_data_to_events(
                           title_end_with_date=yaml_data["events"][event]["title_end_with_date"],
                           event_timezone=yaml_data["events"][event]["event_timezone"],
                           validation_videos_found=yaml_data["events"][event]["validation_videos_found"],
+                          delete_videos_from_iphone=yaml_data["events"][event]["delete_videos_from_iphone"],
                           S3_upload=yaml_data["events"][event]["S3_upload"],
                           S3_storage_class=yaml_data["events"][event]["S3_storage_class"],
+                          S3_bucket=yaml_data["events"][event]["S3_bucket"],
+                          S3_folder=yaml_data["events"][event]["S3_folder"],
                           nextcloud_upload=yaml_data["events"][event]["nextcloud_upload"],
                           nextcloud_folder=yaml_data["events"][event]["nextcloud_folder"],
                           nextcloud_public_share=yaml_data["events"][event]["nextcloud_public_share"],
-                          nextcloud_telegram_notification=yaml_data["events"][event]["nextcloud_telegram_notification"])
+                          nextcloud_telegram_notification=yaml_data["events"][event]["nextcloud_telegram_notification"],
+                          **{key: value for key, value in yaml_data["events"][event].items() if key in OPTIONAL_EVENT_KEYS})
                         )
     except KeyError as e:
         raise KeyError(f"Missing expected key in the YAML config file: {e}")
@@ -0,0 +1,88 @@
+from datetime import datetime
+import sqlite3
+import typing as ty
+
+# Internal files
+from definitions import Inputs, JournalStage, VideoBasicInfos
+from utils import get_state_path
+
+
+JOURNAL_FILE_NAME = "journal.sqlite3"
+NO_DESTINATION = ""
+
+
+class StageJournal:
+    """
+    Record, for each video of an archive run, the stages it went through (listed, copied, renamed,
+    uploaded per destination, shared, notified, deleted), in a SQLite file of the state folder.
+    A run is identified by its event title and day : when the same run is started again after a failure,
+    the stages already done are read back and skipped.
+    """
+
+    def __init__(self, inputs_result: Inputs, database_path: str | None = None):
+        self.run_key = get_run_key(inputs_result)
+        self.connection = sqlite3.connect(database_path or get_state_path(JOURNAL_FILE_NAME))
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS stages (
+                run_key TEXT NOT NULL,
+                device_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                value TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (run_key, device_id, stage, destination)
+            )""")
+        self.connection.commit()
+
+    def __enter__(self) -> "StageJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def record(self, video: VideoBasicInfos, stage: JournalStage, destination: str = NO_DESTINATION, value: str | None = None) -> None:
+        """
+        Mark a stage as done for the video. value keeps what is needed to resume (location on a destination, share link...).
+        """
+        self.record_many([video], stage, destination, [value])
+
+    def record_many(self, videos: ty.List[VideoBasicInfos], stage: JournalStage, destination: str = NO_DESTINATION,
+                    values: ty.List[str | None] | None = None) -> None:
+        """
+        Mark a stage as done for several videos, in one transaction.
+        """
+        values = values or [None] * len(videos)
+        updated_at = datetime.now().isoformat(timespec="seconds")
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO stages (run_key, device_id, stage, destination, value, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.run_key, video.device_id, stage.value, destination, value, updated_at) for video, value in zip(videos, values)])
+
+    def is_done(self, video: VideoBasicInfos, stage: JournalStage, destination: str = NO_DESTINATION) -> bool:
+        return self._get(video, stage, destination) is not None
+
+    def value(self, video: VideoBasicInfos, stage: JournalStage, destination: str = NO_DESTINATION) -> str | None:
+        row = self._get(video, stage, destination)
+        return row[0] if row else None
+
+    def done_destinations(self, video: VideoBasicInfos) -> ty.Dict[str, str]:
+        """
+        Return the location of the video on each destination it has already been uploaded to.
+        """
+        rows = self.connection.execute("SELECT destination, value FROM stages WHERE run_key = ? AND device_id = ? AND stage = ?",
+                                       (self.run_key, video.device_id, JournalStage.UPLOADED.value)).fetchall()
+        return dict(rows)
+
+    def _get(self, video: VideoBasicInfos, stage: JournalStage, destination: str) -> ty.Tuple[str | None] | None:
+        return self.connection.execute("SELECT value FROM stages WHERE run_key = ? AND device_id = ? AND stage = ? AND destination = ?",
+                                       (self.run_key, video.device_id, stage.value, destination)).fetchone()
+
+
+def get_run_key(inputs_result: Inputs) -> str:
+    """
+    Return the identifier of an archive run : the complete title of the event and its day.
+    """
+    return f"{inputs_result.event.video_title}{inputs_result.complex_title_end or ''}|{inputs_result.day}"
@@ -0,0 +1,58 @@
+import errno
+import os
+import shutil
+
+
+# Bytes asked to the kernel at once, it may copy less
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errors meaning the kernel copy is not supported between these two files (other file systems, FUSE mounts...)
+UNSUPPORTED_COPY_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.ETXTBSY}
+
+
+def _copy_with(copy_function, source_fd: int, target_fd: int, size: int) -> None:
+    """
+    Copy from the current position of source_fd until size, or until the end of the file.
+    """
+    position = os.lseek(source_fd, 0, os.SEEK_CUR)
+    while position < size:
+        sent = copy_function(source_fd, target_fd, min(COPY_CHUNK_SIZE, size - position))
+        if sent == 0:
+            break
+        position += sent
+
+
+def copy_file(source_path: str, target_path: str) -> int:
+    """
+    Copy a file without passing its content through Python, and return the number of bytes copied.
+    os.copy_file_range lets the kernel (or the file system, with reflinks or server side copies) copy the data,
+    os.sendfile is tried when it is not supported, then a plain buffered copy.
+    The modification time is kept, it is used as the creation date of the videos of a mounted device.
+    """
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        size = os.fstat(source.fileno()).st_size
+        copied = 0
+        copy_functions = []
+        if hasattr(os, "copy_file_range"):
+            copy_functions.append(lambda source_fd, target_fd, count: os.copy_file_range(source_fd, target_fd, count))
+        if hasattr(os, "sendfile"):
+            copy_functions.append(lambda source_fd, target_fd, count: os.sendfile(target_fd, source_fd, None, count))
+        for copy_function in copy_functions:
+            try:
+                _copy_with(copy_function, source.fileno(), target.fileno(), size)
+                copied = os.lseek(target.fileno(), 0, os.SEEK_CUR)
+                break
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_COPY_ERRNOS:
+                    raise
+            # The next way goes on from what was already copied
+            copied = os.lseek(target.fileno(), 0, os.SEEK_CUR)
+            os.lseek(source.fileno(), copied, os.SEEK_SET)
+        if copied < size:
+            # Not supported, or the file grew while it was copied
+            source.seek(copied)
+            target.seek(copied)
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            copied = target.tell()
+    shutil.copystat(source_path, target_path)
+    return copied
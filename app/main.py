@@ -1,27 +1,30 @@
-from ast import Dict
-import asyncio
-from datetime import datetime, timedelta
-from xmlrpc.client import boolean
+from concurrent.futures import Future
 from dotenv import load_dotenv
-from enum import Enum
 import logging
-from logging import Logger
+import os
 from pathlib import Path
-from pydantic import BaseModel, Field, validator, ValidationError, root_validator
-import re
 from rich.console import Console
 import typer
 import typing as ty
 
 
 # Internal files
-from files import check_files_correctly_copied, rename_videos_for_windows, wrapp_data_to_videos
+from files import check_files_correctly_copied, rename_videos_for_windows, wrapp_data_to_videos, get_copied_video_path, remove_partial_copy
 from powershell_calls import check_available_videos, copy_videos_to_windows,delete_videos
-from definitions import Event, Inputs,VideoBasicInfos, VideoInfosWrapper
-from inputs import yaml_data_to_events, prompt_options, prompt_validation_videos_found
-from telegram_bot import send_message_to_telegram_conversation, format_links_message
-from s3 import upload_videos_to_s3
-from nextcloud import upload_file_to_nextcloud, create_public_shares
+from device import open_device_session, DeviceSession
+from event_windows import assign_videos_to_events
+from definitions import Event, Inputs,VideoBasicInfos, VideoInfosWrapper, JournalStage, UploadResult, NotificationType
+from journal import StageJournal
+from inputs import yaml_data_to_events, prompt_options, prompt_validation_videos_found, prompt_complex_title_end
+from utils import validate_date_format
+from pipeline import create_upload_pipeline, report_renditions, report_skipped_uploads, report_upload_errors
+from plugins import is_plugin_enabled, load_plugin, NEXTCLOUD_DESTINATION, S3_DESTINATION, TELEGRAM_NOTIFIER
+from metrics import METRICS, configure_logging
+from watch import ArchiveDaemon, EventsConfig
+
+if ty.TYPE_CHECKING:
+    # The telegram plugin is only imported when an event enables it
+    from telegram_bot import NotificationDispatcher
 
 # Load environment variables from the .env file
 load_dotenv(override=True) # Erase WSL2 env variable that were conflicting
@@ -35,14 +38,280 @@ EVENTS_YAML_PATH = Path("../events.yml")
 #TODO log level in env
 #TODO S3 upload, gemeral review of the code
 
+def record_uploads(journal: StageJournal, upload_results: ty.List[UploadResult], videos_by_name: ty.Dict[str, VideoBasicInfos]) -> None:
+    for result in upload_results:
+        if result.error is None:
+            journal.record(videos_by_name[result.video_name], JournalStage.UPLOADED, result.destination, result.location)
+
+
+def share_and_notify(journal: StageJournal, inputs_result: Inputs, upload_results: ty.List[UploadResult], videos_by_name: ty.Dict[str, VideoBasicInfos],
+                     dispatcher: "NotificationDispatcher | None") -> ty.List[ty.Tuple[VideoBasicInfos, Future]]:
+    """
+    Create the public shares of the videos uploaded to Nextcloud and queue their links on Telegram, unless the journal
+    shows it was already done.
+    It returns the videos notified, with the future of their notification.
+    """
+    uploaded_results = [result for result in upload_results if result.destination == NEXTCLOUD_DESTINATION and result.error is None]
+    shared_videos = [videos_by_name[result.video_name] for result in uploaded_results]
+    if not all(journal.is_done(video, JournalStage.SHARED) for video in shared_videos):
+        with METRICS.measure("share", destination=NEXTCLOUD_DESTINATION):
+            links = load_plugin(NEXTCLOUD_DESTINATION).create_event_public_shares(inputs_result, [result.location for result in uploaded_results])
+        missing_links = [result.video_name for result in uploaded_results if result.location not in links]
+        if missing_links:
+            raise ValueError(f"No public share link returned by Nextcloud for {', '.join(missing_links)}")
+        journal.record_many(shared_videos, JournalStage.SHARED, values=[links[result.location] for result in uploaded_results])
+    notifications = []
+    if dispatcher is not None and inputs_result.event.nextcloud_telegram_notification:
+        futures_by_link: ty.Dict[str, Future] = {}
+        for video in shared_videos:
+            if not journal.is_done(video, JournalStage.NOTIFIED):
+                link = journal.value(video, JournalStage.SHARED)
+                if link not in futures_by_link:
+                    futures_by_link[link] = dispatcher.notify(NotificationType.SHARE_READY, link)
+                notifications.append((video, futures_by_link[link]))
+    return notifications
+
+
+def wait_for_notifications(journal: StageJournal, share_notifications: ty.List[ty.Tuple[VideoBasicInfos, Future]], archived_notifications: ty.List[Future]) -> None:
+    """
+    Wait until the notifications queued during the archive are sent, and record the videos whose link was sent.
+    An error is raised if a link could not be sent, a failed notification of the S3 archive is only displayed.
+    """
+    for future in archived_notifications:
+        try:
+            future.result()
+        except ValueError as e:
+            typer.echo(f"Failed to notify the S3 archive on Telegram: {e}")
+    error = None
+    for video, future in share_notifications:
+        try:
+            future.result()
+            journal.record(video, JournalStage.NOTIFIED)
+        except ValueError as e:
+            error = e
+    if error:
+        raise error
+
+
+def get_notification_dispatcher(event: Event) -> "NotificationDispatcher | None":
+    """
+    Return the dispatcher sending the notifications on Telegram (see telegram_bot.py), None if the event does not enable them.
+    The failure notification is enabled by default : without TELEGRAM_BOT_TOKEN, it alone does not need a bot.
+    """
+    if not is_plugin_enabled(event, TELEGRAM_NOTIFIER):
+        return None
+    if not (os.getenv("TELEGRAM_BOT_TOKEN") or event.nextcloud_telegram_notification or event.telegram_archive_notification):
+        return None
+    return load_plugin(TELEGRAM_NOTIFIER).get_dispatcher()
+
+
+def notify_failure(dispatcher: "NotificationDispatcher", inputs_result: Inputs, error: Exception) -> None:
+    """
+    Send the failure of an archive on Telegram, and wait for it as the run is about to stop.
+    Any error of the notification is only displayed, so it never hides the error of the archive.
+    """
+    try:
+        future = dispatcher.notify(NotificationType.RUN_FAILED, f"Failed to archive {inputs_result.event.video_title.strip()} on {inputs_result.day}: {error}")
+        future.result(timeout=60)
+    except Exception as e:
+        typer.echo(f"Failed to notify the failure on Telegram: {e}")
+
+
+def archive_videos(device_session: DeviceSession, inputs_result: Inputs, available_videos: ty.List[VideoBasicInfos]) -> None:
+    """
+    Copy, rename, upload, share and delete the videos of one event on one day.
+    The journal records the stages done for each video, a new run of the same event and day resumes from it.
+    The share links (nextcloud_telegram_notification), the videos archived on S3 (telegram_archive_notification) and
+    the failure of the archive (telegram_failure_notification) are notified on Telegram in the background while the uploads go on,
+    for the events with or without Nextcloud.
+    """
+    dispatcher = get_notification_dispatcher(inputs_result.event)
+    try:
+        archive_event_videos(device_session, inputs_result, available_videos, dispatcher)
+    except Exception as e:
+        if dispatcher is not None and inputs_result.event.telegram_failure_notification:
+            notify_failure(dispatcher, inputs_result, e)
+        raise
+
+
+def archive_event_videos(device_session: DeviceSession, inputs_result: Inputs, available_videos: ty.List[VideoBasicInfos], dispatcher: "NotificationDispatcher | None") -> None:
+    """
+    Run the stages of archive_videos, the notifications being queued on the dispatcher.
+    """
+    share_notifications: ty.List[ty.Tuple[VideoBasicInfos, Future]] = []
+    archived_notifications: ty.List[Future] = []
+
+    def notify_archived(result: UploadResult) -> None:
+        # Called by the upload workers, the notification is only queued
+        if result.destination == S3_DESTINATION and result.error is None and not result.skipped:
+            archived_notifications.append(dispatcher.notify(NotificationType.ARCHIVED, f"{result.video_name} archived on S3 ({inputs_result.event.S3_storage_class})"))
+
+    with StageJournal(inputs_result) as journal:
+        journal.record_many(available_videos, JournalStage.LISTED)
+        videos_with_wrapped_data: ty.List[VideoInfosWrapper] = wrapp_data_to_videos(inputs_result, available_videos)
+        videos_by_name = {video.new_name: video.video_basic_infos for video in videos_with_wrapped_data}
+        # Each video is uploaded as soon as it is copied and renamed, while the next one is copied
+        on_result = notify_archived if dispatcher is not None and inputs_result.event.telegram_archive_notification else None
+        with create_upload_pipeline(inputs_result, on_result, len(videos_with_wrapped_data)) as upload_pipeline:
+            streamed_videos: ty.List[VideoInfosWrapper] = []
+            videos_to_copy: ty.List[VideoInfosWrapper] = []
+            for video in videos_with_wrapped_data:
+                basic_infos = video.video_basic_infos
+                source_path = None
+                if not (journal.is_done(basic_infos, JournalStage.RENAMED) and os.path.exists(video.wsl_full_path)):
+                    if inputs_result.event.streaming_upload:
+                        source_path = device_session.source_path(basic_infos)
+                    # The video is then copied, under its new name, while it is uploaded
+                    if source_path:
+                        streamed_videos.append(video)
+                    elif journal.is_done(basic_infos, JournalStage.COPIED) and os.path.exists(get_copied_video_path(basic_infos)):
+                        with METRICS.measure("rename", video=video.new_name):
+                            rename_videos_for_windows([video])
+                        journal.record(basic_infos, JournalStage.RENAMED)
+                    else:
+                        remove_partial_copy(basic_infos)
+                        videos_to_copy.append(video)
+                        continue
+                upload_pipeline.submit(video, journal.done_destinations(basic_infos), source_path)
+            # The device copies the videos one after the other and reports each one once copied
+            videos_by_device_id = {video.video_basic_infos.device_id: video for video in videos_to_copy}
+            for basic_infos in copy_videos_to_windows(device_session, [video.video_basic_infos for video in videos_to_copy]):
+                video = videos_by_device_id[basic_infos.device_id]
+                check_files_correctly_copied([basic_infos])
+                journal.record(basic_infos, JournalStage.COPIED)
+                with METRICS.measure("rename", video=video.new_name):
+                    rename_videos_for_windows([video])
+                journal.record(basic_infos, JournalStage.RENAMED)
+                upload_pipeline.submit(video, journal.done_destinations(basic_infos))
+            # The share link is sent without waiting for the uploads to the other destinations (see the priorities of the event)
+            if inputs_result.event.nextcloud_upload and inputs_result.event.nextcloud_public_share:
+                nextcloud_results = upload_pipeline.results([NEXTCLOUD_DESTINATION])
+                record_uploads(journal, nextcloud_results, videos_by_name)
+                share_notifications = share_and_notify(journal, inputs_result, nextcloud_results, videos_by_name, dispatcher)
+            upload_results = upload_pipeline.results()
+        record_uploads(journal, upload_results, videos_by_name)
+        # The local copy of a streamed video only appears once complete
+        streamed_copies = [video.video_basic_infos for video in streamed_videos if os.path.exists(video.wsl_full_path)]
+        journal.record_many(streamed_copies, JournalStage.COPIED)
+        journal.record_many(streamed_copies, JournalStage.RENAMED)
+        wait_for_notifications(journal, share_notifications, archived_notifications)
+        failed_copies = [video.new_name for video in streamed_videos if not os.path.exists(video.wsl_full_path)]
+        if failed_copies:
+            raise ValueError(f"Failed to copy {', '.join(failed_copies)} from the device")
+        report_skipped_uploads(upload_results)
+        report_renditions(upload_results)
+        report_upload_errors(upload_results)
+        if inputs_result.event.delete_videos_from_iphone:
+            videos_to_delete = [video for video in available_videos if not journal.is_done(video, JournalStage.DELETED)]
+            if videos_to_delete:
+                with METRICS.measure("delete", sum(video.size_bytes or 0 for video in videos_to_delete)):
+                    delete_videos(device_session, videos_to_delete)
+                journal.record_many(videos_to_delete, JournalStage.DELETED)
+
+
+def backfill(range_start: str, range_stop: str) -> None:
+    """
+    Archive the videos of every event of events.yml on every day of a date range, from a single listing of the device.
+    A failed (event, day) group does not stop the next ones.
+    """
+    for day in (range_start, range_stop):
+        if not validate_date_format(day):
+            raise ValueError(f"The day {day} has to be in the DD/MM/YYYY format")
+    archive_date_range(yaml_data_to_events(EVENTS_YAML_PATH), range_start, range_stop)
+
+
+def archive_date_range(events: ty.List[Event], range_start: str, range_stop: str, interactive: bool = True) -> None:
+    """
+    Archive the videos of the events on every day of a date range, from a single listing of the device.
+    A failed (event, day) group does not stop the next ones.
+    Without interactive, nothing is asked : the videos are not validated, and the events with a complex naming are skipped
+    as their title can't be completed.
+    """
+    with open_device_session(None, (range_start, range_stop)) as device_session:
+        with METRICS.measure("list"):
+            device_videos = device_session.list_videos()
+        groups = assign_videos_to_events(device_videos, events, range_start, range_stop)
+        if groups == []:
+            raise ValueError(f"No video found for the events between {range_start} and {range_stop}")
+        failed_groups = []
+        for window, videos in groups:
+            typer.echo(f"{window.event.video_title.strip()} on {window.day} : {len(videos)} video(s)")
+            if not interactive and window.event.complex_naming:
+                typer.echo(f"Skipped, the title has to be completed : archive it with --backfill-start {window.day}")
+                continue
+            try:
+                inputs_result = Inputs(day=window.day, event=window.event, complex_title_end=prompt_complex_title_end(window.event))
+                if interactive and inputs_result.event.validation_videos_found:
+                    prompt_validation_videos_found(videos)
+                archive_videos(device_session, inputs_result, videos)
+            except ValueError as e:
+                typer.echo(f"Failed to archive {window.event.video_title.strip()} on {window.day}: {e}")
+                failed_groups.append(f"{window.event.video_title.strip()} on {window.day}")
+        if failed_groups:
+            raise ValueError(f"{len(failed_groups)} group(s) failed out of {len(groups)} : {', '.join(failed_groups)}")
+
+
+def report_metrics() -> None:
+    """
+    Log the totals of each stage of the run, and export them for Prometheus when PROMETHEUS_TEXTFILE is set.
+    """
+    METRICS.log_summary()
+    prometheus_textfile = os.getenv("PROMETHEUS_TEXTFILE")
+    if prometheus_textfile:
+        METRICS.write_prometheus_textfile(prometheus_textfile)
+
+
+def archive_watched_range(events: ty.List[Event], range_start: str, range_stop: str) -> None:
+    """
+    Archive job of the watch mode, with the metrics of each job reported on their own.
+    """
+    METRICS.reset()
+    try:
+        with METRICS.live_progress(Console()):
+            archive_date_range(events, range_start, range_stop, interactive=False)
+    finally:
+        report_metrics()
+
+
+def watch() -> None:
+    """
+    Keep running, and archive the videos of the last WATCH_LOOKBACK_DAYS days (7 by default) each time the device is plugged in.
+    The device and events.yml are checked every WATCH_POLL_SECONDS (10 by default).
+    """
+    daemon = ArchiveDaemon(EventsConfig(EVENTS_YAML_PATH), archive_watched_range,
+                           poll_seconds=float(os.getenv("WATCH_POLL_SECONDS") or 10), lookback_days=int(os.getenv("WATCH_LOOKBACK_DAYS") or 7))
+    daemon.run()
+
+
 def main(
     log_level: int = logging.ERROR,
+    backfill_start: ty.Optional[str] = None, # First day (DD/MM/YYYY) to archive in backfill mode, for every event
+    backfill_stop: ty.Optional[str] = None, # Last day (DD/MM/YYYY) to archive in backfill mode, the first day by default
+    watch_device: bool = typer.Option(False, "--watch"), # Keep running and archive the videos each time the device is plugged in
 ) -> None:
-    logger: Logger = logging.getLogger(__name__)
-    logging.basicConfig(level=log_level)
+    configure_logging(log_level)
     console = Console()
     typer.echo(f"Welcome to the Timeframe Archivist !")
 
+    if watch_device:
+        try:
+            watch()
+        except (FileNotFoundError, ValueError) as e:
+            console.print(f"Exiting due to an error: {e}", style="bold red")
+            exit(1)
+        exit(0)
+
+    if backfill_start:
+        try:
+            with METRICS.live_progress(console):
+                backfill(backfill_start, backfill_stop or backfill_start)
+        except ValueError as e:
+            console.print(f"Exiting due to an error: {e}", style="bold red")
+            exit(1)
+        finally:
+            report_metrics()
+        exit(0)
+
     event =  Event(event_start="16:45",
                       event_stop="22:30",
                       complex_naming=False, 
@@ -67,23 +336,14 @@ def main(
     try:
         #events : ty.List[Event] = yaml_data_to_events(EVENTS_YAML_PATH)   
         #inputs_result = prompt_options(events)
-        available_videos : ty.List[VideoBasicInfos]  = check_available_videos(inputs_result)
-        if inputs_result.event.validation_videos_found:  
-            prompt_validation_videos_found(available_videos)
-        copy_videos_to_windows(inputs_result)
-        check_files_correctly_copied(available_videos)
-        videos_with_wrapped_data: ty.List[VideoInfosWrapper] = wrapp_data_to_videos(inputs_result, available_videos)
-        rename_videos_for_windows(videos_with_wrapped_data)
-        #files_nextcloud_locations = upload_file_to_nextcloud(videos_with_wrapped_data, inputs_result)
-        #shares = create_public_shares(files_nextcloud_locations)
-        #if inputs_result.event.nextcloud_telegram_notification:  
-        #    message = format_links_message(shares)
-        #    asyncio.run(send_message_to_telegram_conversation(message))
-        #S3
-        #if inputs_result.event.S3_upload:  
-        #    upload_videos_to_s3(inputs_result, videos_with_wrapped_data)
-        if inputs_result.event.delete_videos_from_iphone:
-            delete_videos(inputs_result)
+        with open_device_session(inputs_result) as device_session:
+            with METRICS.measure("list"):
+                available_videos : ty.List[VideoBasicInfos]  = check_available_videos(device_session, inputs_result)
+            if inputs_result.event.validation_videos_found:  
+                prompt_validation_videos_found(available_videos)
+            # After the prompt, the progress bars would hide it
+            with METRICS.live_progress(console):
+                archive_videos(device_session, inputs_result, available_videos)
             
       
         
@@ -91,6 +351,8 @@ def main(
     except ValueError as e:
         console.print(f"Exiting due to an error: {e}", style="bold red")
         exit(1)        
+    finally:
+        report_metrics()
     
     exit(0)
         
@@ -0,0 +1,209 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import typing as ty
+
+from rich.console import Console
+
+if ty.TYPE_CHECKING:
+    from rich.progress import Progress
+
+
+MB = 1024 * 1024
+LOGGER = logging.getLogger("timeframe_archivist.metrics")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format each log record as one JSON object per line. The fields given in extra={"fields": {...}} are added to it.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(log_level: int) -> None:
+    """
+    Write the logs of the given level and above as JSON lines on stderr, or in the LOG_FILE env variable when it is set.
+    """
+    log_file = os.getenv("LOG_FILE")
+    handler = logging.FileHandler(log_file) if log_file else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logging.basicConfig(level=log_level, handlers=[handler], force=True)
+
+
+class Transfer:
+    """
+    Progress of one file being copied or uploaded, displayed as a progress bar when the live progress is on.
+    """
+
+    def __init__(self, progress: "Progress | None", description: str, total_bytes: int):
+        self.progress = progress
+        self.task_id = progress.add_task(description, total=total_bytes) if progress else None
+
+    def advance(self, size_bytes: int) -> None:
+        if self.progress is not None:
+            self.progress.advance(self.task_id, size_bytes)
+
+    def finish(self) -> None:
+        if self.progress is not None:
+            self.progress.remove_task(self.task_id)
+
+
+class RunMetrics:
+    """
+    Duration, bytes and throughput of every stage of a run (listing, copy, rename, uploads, share, notification, deletion),
+    for each file and each destination. Every measure is logged at the INFO level with its fields, and can be exported
+    as a Prometheus textfile at the end of the run.
+    It also counts the events of the network requests (retries, circuit breakers opened) of each destination.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records: ty.List[ty.Dict[str, ty.Any]] = []
+        self.counters: ty.Dict[ty.Tuple[str, str | None], int] = {}
+        self.progress: "Progress | None" = None
+        self.current = threading.local()
+
+    def reset(self) -> None:
+        """
+        Forget the measures, before a new run of the same process (watch mode).
+        """
+        with self.lock:
+            self.records = []
+            self.counters = {}
+
+    def record(self, stage: str, duration_s: float, size_bytes: int = 0, video: str | None = None, destination: str | None = None) -> None:
+        record = {"stage": stage, "duration_s": round(duration_s, 3), "size_bytes": size_bytes,
+                  "mb_s": round(size_bytes / MB / duration_s, 2) if size_bytes and duration_s else None,
+                  "video": video, "destination": destination}
+        with self.lock:
+            self.records.append(record)
+        LOGGER.info(f"{stage} {video or ''} {destination or ''}".strip(), extra={"fields": record})
+
+    def increment(self, counter: str, destination: str | None = None) -> None:
+        with self.lock:
+            self.counters[(counter, destination)] = self.counters.get((counter, destination), 0) + 1
+
+    @contextmanager
+    def measure(self, stage: str, size_bytes: int = 0, video: str | None = None, destination: str | None = None) -> ty.Iterator[None]:
+        """
+        Record the duration of the block, only when it succeeds.
+        """
+        start = time.perf_counter()
+        yield
+        self.record(stage, time.perf_counter() - start, size_bytes, video, destination)
+
+    @contextmanager
+    def transfer(self, description: str, total_bytes: int) -> ty.Iterator[Transfer]:
+        """
+        Show the progress of a file transfer. The transfer is also the current one of the thread (see current_transfer),
+        so the code sending the data can report it without receiving it.
+        """
+        transfer = Transfer(self.progress, description, total_bytes)
+        previous = getattr(self.current, "transfer", None)
+        self.current.transfer = transfer
+        try:
+            yield transfer
+        finally:
+            self.current.transfer = previous
+            transfer.finish()
+
+    def current_transfer(self) -> Transfer:
+        """
+        Return the transfer of the thread, or one displaying nothing.
+        """
+        return getattr(self.current, "transfer", None) or Transfer(None, "", 0)
+
+    @contextmanager
+    def live_progress(self, console: Console) -> ty.Iterator[None]:
+        """
+        Display the transfers as progress bars with their rate and remaining time, when the console is a terminal.
+        """
+        if not console.is_terminal:
+            yield
+            return
+        # Only imported when displayed
+        from rich.progress import BarColumn, DownloadColumn, Progress, TextColumn, TimeRemainingColumn, TransferSpeedColumn
+        with Progress(TextColumn("{task.description}"), BarColumn(), DownloadColumn(), TransferSpeedColumn(), TimeRemainingColumn(),
+                      console=console, transient=True) as progress:
+            self.progress = progress
+            try:
+                yield
+            finally:
+                self.progress = None
+
+    def summary(self) -> ty.Dict[ty.Tuple[str, str | None], ty.Dict[str, float]]:
+        """
+        Return the totals of each stage and destination : files, seconds, bytes.
+        """
+        totals: ty.Dict[ty.Tuple[str, str | None], ty.Dict[str, float]] = {}
+        with self.lock:
+            for record in self.records:
+                total = totals.setdefault((record["stage"], record["destination"]), {"files": 0, "duration_s": 0.0, "size_bytes": 0})
+                total["files"] += 1
+                total["duration_s"] += record["duration_s"]
+                total["size_bytes"] += record["size_bytes"]
+        for total in totals.values():
+            total["duration_s"] = round(total["duration_s"], 3)
+        return totals
+
+    def log_summary(self) -> None:
+        for (stage, destination), total in self.summary().items():
+            fields = {"stage": stage, "destination": destination, **total,
+                      "mb_s": round(total["size_bytes"] / MB / total["duration_s"], 2) if total["size_bytes"] and total["duration_s"] else None}
+            LOGGER.info(f"total {stage} {destination or ''}".strip(), extra={"fields": fields})
+        with self.lock:
+            counters = dict(self.counters)
+        for (counter, destination), count in counters.items():
+            LOGGER.info(f"total {counter} {destination or ''}".strip(), extra={"fields": {"counter": counter, "destination": destination, "count": count}})
+
+    def write_prometheus_textfile(self, path: str) -> None:
+        """
+        Write the totals in the text format of Prometheus, for the textfile collector of node_exporter.
+        The file is replaced at once, so the collector never reads it half written.
+        """
+        lines = [
+            "# HELP timeframe_archivist_stage_duration_seconds Time spent in each stage during the last run.",
+            "# TYPE timeframe_archivist_stage_duration_seconds gauge",
+        ]
+        summary = self.summary()
+        labels = {key: f'stage="{key[0]}"' + (f',destination="{key[1]}"' if key[1] else "") for key in summary}
+        lines += [f"timeframe_archivist_stage_duration_seconds{{{labels[key]}}} {total['duration_s']}" for key, total in summary.items()]
+        lines += ["# HELP timeframe_archivist_stage_bytes Bytes processed by each stage during the last run.",
+                  "# TYPE timeframe_archivist_stage_bytes gauge"]
+        lines += [f"timeframe_archivist_stage_bytes{{{labels[key]}}} {total['size_bytes']}" for key, total in summary.items()]
+        lines += ["# HELP timeframe_archivist_stage_files Files processed by each stage during the last run.",
+                  "# TYPE timeframe_archivist_stage_files gauge"]
+        lines += [f"timeframe_archivist_stage_files{{{labels[key]}}} {total['files']}" for key, total in summary.items()]
+        with self.lock:
+            counters = dict(self.counters)
+        lines += ["# HELP timeframe_archivist_network_events Retries and circuit breakers opened for each destination during the last run.",
+                  "# TYPE timeframe_archivist_network_events gauge"]
+        lines += [f'timeframe_archivist_network_events{{event="{counter}"' + (f',destination="{destination}"' if destination else "") + f"}} {count}"
+                  for (counter, destination), count in counters.items()]
+        lines += ["# HELP timeframe_archivist_last_run_timestamp_seconds End of the last run.",
+                  "# TYPE timeframe_archivist_last_run_timestamp_seconds gauge",
+                  f"timeframe_archivist_last_run_timestamp_seconds {time.time()}"]
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
+
+
+# Metrics of the current run, shared by all the modules
+METRICS = RunMetrics()
@@ -0,0 +1,202 @@
+from datetime import datetime, timedelta, timezone
+import struct
+import typing as ty
+
+# Internal files
+from definitions import ContainerMetadata
+
+
+# Reader of the metadata of the MP4 and MOV videos (ISO base media / QuickTime files), without reading their media :
+# the file is a sequence of boxes (size, type, content), only the headers of the top level boxes are read to find
+# the moov box, which is then read entirely. It is a few hundred Kb even for hours of video, wherever it is in the file.
+#   moov/mvhd                                   creation time and duration of the video
+#   moov/trak/tkhd                              size and rotation of each track
+#   moov/trak/mdia/hdlr                         kind of the track (vide for the video)
+#   moov/trak/mdia/minf/stbl/stsd               codec of the track, the type of its first sample entry
+#   moov/meta/keys + moov/meta/ilst             QuickTime metadata, com.apple.quicktime.creationdate
+
+# Types of the boxes a MP4 or MOV file can start with, any other file is not read
+TOP_LEVEL_BOX_TYPES = {b"ftyp", b"wide", b"free", b"skip", b"mdat", b"moov", b"pnot", b"uuid"}
+# Above that size, the moov box is not read (a moov of a few Mb already indexes hours of video)
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+# Times of the boxes are counted in seconds from 1904
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+APPLE_CREATION_DATE_KEY = b"com.apple.quicktime.creationdate"
+
+
+def iter_boxes(data: memoryview) -> ty.Iterator[ty.Tuple[bytes, memoryview]]:
+    """
+    Yield the type and content of each box of data.
+    """
+    end = len(data)
+    position = 0
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, position)
+        header_size = 8
+        if size == 1:
+            if position + 16 > end:
+                raise ValueError("Truncated box header")
+            size = struct.unpack_from(">Q", data, position + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size or position + size > end:
+            raise ValueError(f"Box {box_type!r} of {size} bytes overflows its parent")
+        yield bytes(box_type), data[position + header_size:position + size]
+        position += size
+
+
+def find_box(data: memoryview, path: ty.List[bytes]) -> memoryview | None:
+    """
+    Return the content of the first box at the given path of box types, None if there is none.
+    """
+    for box_type, content in iter_boxes(data):
+        if box_type == path[0]:
+            return content if len(path) == 1 else find_box(content, path[1:])
+    return None
+
+
+def read_moov(file: ty.BinaryIO) -> memoryview | None:
+    """
+    Return the content of the moov box of a file, with small reads of the headers of the boxes before it.
+    None if the file is not a MP4 or MOV file, or has no moov box (a recording which was not finalised).
+    """
+    file_size = file.seek(0, 2)
+    position = 0
+    while position + 8 <= file_size:
+        file.seek(position)
+        header = file.read(16)
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if position == 0 and box_type not in TOP_LEVEL_BOX_TYPES:
+            return None
+        if size == 1:
+            if len(header) < 16:
+                raise ValueError("Truncated box header")
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - position
+        if size < header_size:
+            raise ValueError(f"Box {box_type!r} of {size} bytes at {position}")
+        if box_type == b"moov":
+            if size > MAX_MOOV_SIZE:
+                raise ValueError(f"The moov box is too large ({size} bytes)")
+            file.seek(position + header_size)
+            content = file.read(size - header_size)
+            if len(content) < size - header_size:
+                raise ValueError("Truncated moov box")
+            return memoryview(content)
+        position += size
+    return None
+
+
+def parse_movie_header(mvhd: memoryview) -> ty.Tuple[datetime | None, float | None]:
+    """
+    Return the creation time and the duration of the movie header box.
+    """
+    version = mvhd[0]
+    if version == 1:
+        creation_time, _, timescale, duration = struct.unpack_from(">QQIQ", mvhd, 4)
+    else:
+        creation_time, _, timescale, duration = struct.unpack_from(">IIII", mvhd, 4)
+    # 0 when the time was not set, the duration is all ones when unknown
+    creation_date = MP4_EPOCH + timedelta(seconds=creation_time) if creation_time else None
+    duration_s = duration / timescale if timescale and duration not in (0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF) else None
+    return creation_date, duration_s
+
+
+def parse_track_size(tkhd: memoryview) -> ty.Tuple[int, int]:
+    """
+    Return the width and height of a track as displayed, turned when its matrix rotates it by 90 or 270 degrees.
+    """
+    # The matrix follows the times, the track id, the duration, and 16 bytes of layer, group, volume and reserved fields
+    offset = 4 + (32 if tkhd[0] == 1 else 20) + 16
+    a, b = struct.unpack_from(">ii", tkhd, offset)
+    width, height = struct.unpack_from(">II", tkhd, offset + 36)
+    # Fixed point 16.16 values
+    width, height = width >> 16, height >> 16
+    if a == 0 and b != 0:
+        return height, width
+    return width, height
+
+
+def parse_quicktime_creation_date(meta: memoryview) -> datetime | None:
+    """
+    Return the com.apple.quicktime.creationdate of a QuickTime meta box, None if it has none.
+    """
+    # The meta box of QuickTime has no version and flags, the one of ISO files has
+    if bytes(meta[4:8]) != b"hdlr":
+        meta = meta[4:]
+    keys = find_box(meta, [b"keys"])
+    items = find_box(meta, [b"ilst"])
+    if keys is None or items is None:
+        return None
+    key_index = None
+    position = 8
+    for index in range(1, struct.unpack_from(">I", keys, 4)[0] + 1):
+        size = struct.unpack_from(">I", keys, position)[0]
+        if bytes(keys[position + 8:position + size]) == APPLE_CREATION_DATE_KEY:
+            key_index = index
+            break
+        position += size
+    if key_index is None:
+        return None
+    for item_type, item in iter_boxes(items):
+        if struct.unpack(">I", item_type)[0] == key_index:
+            value = find_box(item, [b"data"])
+            if value is None:
+                return None
+            # The value follows its type and locale, like 2024-05-12T18:03:21+0200
+            try:
+                return datetime.strptime(bytes(value[8:]).decode("utf-8").strip("\x00"), "%Y-%m-%dT%H:%M:%S%z")
+            except ValueError:
+                return None
+    return None
+
+
+def parse_moov(moov: memoryview) -> ContainerMetadata:
+    """
+    Return the metadata held by the content of a moov box.
+    """
+    creation_date, quicktime_creation_date, duration_s = None, None, None
+    width, height, codec = None, None, None
+    for box_type, content in iter_boxes(moov):
+        if box_type == b"mvhd":
+            creation_date, duration_s = parse_movie_header(content)
+        elif box_type == b"trak" and codec is None:
+            handler = find_box(content, [b"mdia", b"hdlr"])
+            if handler is None or bytes(handler[8:12]) != b"vide":
+                continue
+            tkhd = find_box(content, [b"tkhd"])
+            if tkhd is not None:
+                width, height = parse_track_size(tkhd)
+            stsd = find_box(content, [b"mdia", b"minf", b"stbl", b"stsd"])
+            if stsd is not None and struct.unpack_from(">I", stsd, 4)[0] > 0:
+                codec = bytes(stsd[12:16]).decode("latin-1")
+        elif box_type == b"meta":
+            # The local capture time with its UTC offset written by the phones is preferred to mvhd,
+            # which some cameras fill with their local time instead of UTC
+            quicktime_creation_date = parse_quicktime_creation_date(content)
+    creation_date = quicktime_creation_date or creation_date
+    return ContainerMetadata(
+        creation_date_utc=creation_date.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if creation_date else None,
+        duration_s=round(duration_s, 3) if duration_s is not None else None,
+        width=width,
+        height=height,
+        codec=codec,
+    )
+
+
+def read_container_metadata(path: str) -> ContainerMetadata | None:
+    """
+    Return the creation time, duration, size and codec of a MP4 or MOV video, reading only its moov box.
+    None if the file is not a MP4 or MOV file or has no moov box, a ValueError if its boxes are malformed.
+    """
+    with open(path, "rb", buffering=0) as file:
+        try:
+            moov = read_moov(file)
+            return parse_moov(moov) if moov is not None else None
+        except (struct.error, IndexError, ValueError) as e:
+            raise ValueError(f"Malformed video container {path}: {e}")
+
@@ -1,154 +1,642 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import io
+import json
+import threading
+import uuid
 import xml.etree.ElementTree as ET
 import os
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 import typer
 import typing as ty
 
 #
-from definitions import Inputs, VideoInfosWrapper, NextCloudInfos
-from utils import normalize_folders_path
+from bandwidth import DestinationThrottle, UNLIMITED
+from checksums import FileDigester, file_digest
+from definitions import Event, Inputs, VideoInfosWrapper, NextCloudInfos, RemoteFile, FileDigests
+from pipeline import Destination, NEXTCLOUD_DESTINATION
+from metrics import METRICS
+from resilience import get_retry_policy, send_request
+from staging import open_for_reading
+from tee import TeeSink
+from utils import normalize_folders_path, file_fingerprint, get_state_path
+
+MB = 1024 * 1024
+WEBDAV_NAMESPACES = {"d": "DAV:", "oc": "http://owncloud.org/ns"}
+LIST_FILES_PROPFIND_BODY = """<?xml version="1.0"?>
+<d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">
+  <d:prop><d:resourcetype/><d:getcontentlength/><oc:checksums/></d:prop>
+</d:propfind>"""
+FOLDER_CACHE_FILE = "nextcloud_folders.json"
+CONNECTION_POOL_SIZE = 32
+# Nextcloud only answers the MOVE assembling the chunks once the whole file is written
+ASSEMBLY_READ_TIMEOUT_S = 1800
 
 
 # TODO test on different user folder
 # TODO account with limited rights on ownclouds
 
+class NextcloudFolderMissingError(ValueError):
+    """
+    The folder of an upload does not exist on the server.
+    """
+
+
 def get_nextcloud_infos() -> NextCloudInfos:
     """
     Return nextcloud infos from env file like login, pwd, url, and formated urls for webdav and OCS APIs
     """
-    
+
     nextcloud_base_url = normalize_folders_path(os.getenv("NEXTCLOUD_BASE_URL")) #remove ending / if present
     nextcloud_user = os.getenv("NEXTCLOUD_USER")
     nextcloud_password = os.getenv("NEXTCLOUD_PASSWORD")
     nextcloud_webdav_url = f"{nextcloud_base_url}/remote.php/dav/files/{nextcloud_user}"
+    nextcloud_uploads_url = f"{nextcloud_base_url}/remote.php/dav/uploads/{nextcloud_user}"
     nextcloud_ocs_url = f"{nextcloud_base_url}/ocs/v2.php/apps/files_sharing/api/v1"
-    nextcloud_infos = NextCloudInfos(user=nextcloud_user, password=nextcloud_password, base_url=nextcloud_base_url, webdav_url=nextcloud_webdav_url, ocs_url=nextcloud_ocs_url)
-    
-    return nextcloud_infos 
+    nextcloud_infos = NextCloudInfos(user=nextcloud_user, password=nextcloud_password, base_url=nextcloud_base_url, webdav_url=nextcloud_webdav_url, uploads_url=nextcloud_uploads_url, ocs_url=nextcloud_ocs_url)
 
+    return nextcloud_infos
 
 
-def create_public_shares(file_paths: ty.List[str]) -> ty.List[str]:
+class NextcloudClient:
     """
-    Create a public share for the given nextcloud files
-    file_paths : for a link in the following form : https://{website}/remote.php/dav/files/{user_root_folder}/one_folder/one_file.txt, desired path would only be "/one_folder/one_file.txt"
+    Client for the WebDAV and OCS APIs of Nextcloud.
+    All the requests go through one HTTP session, so the TLS connections are kept alive and reused,
+    with the timeouts, retries and circuit breaker of resilience.py.
+    The folders known to exist are cached for the run, and saved between runs if a cache path is given.
     """
-    
-    share_links = []
-    nextcloud_infos = get_nextcloud_infos()
-    
-    for file_path in file_paths:
-        ocs_url = f"{nextcloud_infos.ocs_url}/shares"
+
+    def __init__(self, nextcloud_infos: NextCloudInfos, folder_cache_path: str | None = None):
+        self.infos = nextcloud_infos
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(nextcloud_infos.user, nextcloud_infos.password)
+        adapter = HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.folder_cache_path = folder_cache_path
+        self.folder_cache_lock = threading.Lock()
+        self.existing_folders: ty.Set[str] = self._load_folder_cache()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return send_request(self.session, method, url, NEXTCLOUD_DESTINATION, **kwargs)
+
+    def assembly_timeout(self) -> ty.Tuple[float, float]:
+        return get_retry_policy().connect_timeout_s, max(get_retry_policy().read_timeout_s, ASSEMBLY_READ_TIMEOUT_S)
+
+    def _load_folder_cache(self) -> ty.Set[str]:
+        if not self.folder_cache_path or not os.path.exists(self.folder_cache_path):
+            return set()
+        with open(self.folder_cache_path, "r") as file:
+            return set(json.load(file).get(self.infos.webdav_url, []))
+
+    def _save_folder_cache(self) -> None:
+        if not self.folder_cache_path:
+            return
+        # The cache file is shared by all the Nextcloud accounts, each one has its entry
+        folder_cache = {}
+        if os.path.exists(self.folder_cache_path):
+            with open(self.folder_cache_path, "r") as file:
+                folder_cache = json.load(file)
+        folder_cache[self.infos.webdav_url] = sorted(self.existing_folders)
+        temporary_path = f"{self.folder_cache_path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(folder_cache, file)
+        os.replace(temporary_path, self.folder_cache_path)
+
+    def forget_folders(self) -> None:
+        """
+        Empty the folder cache, when a folder supposed to exist is missing on the server.
+        """
+        with self.folder_cache_lock:
+            self.existing_folders.clear()
+            self._save_folder_cache()
+
+    def create_folders_if_they_do_not_exist(self, folders_path: str) -> None:
+        """
+        This function create all the folder in folders_path if they do not exist
+        A folder can't be created if it parent does not exist.
+        The folders already known to exist are not checked again.
+        """
+
+        with self.folder_cache_lock:
+            # Split the path to handle each folder
+            folders = [folder for folder in folders_path.split('/') if folder]
+            if '/'.join(folders) in self.existing_folders:
+                return
+            path_to_create = ''
+            for folder in folders:
+                path_to_create += '/' + folder
+                if path_to_create.lstrip('/') in self.existing_folders:
+                    continue
+                full_url = f"{self.infos.webdav_url}{path_to_create}/"
+
+                response = self.request('PROPFIND', full_url, headers={"Depth": "0"})
+
+                if response.status_code == 404:  # 404 means folder does not exist
+                    # Try to create the folder
+                    response = self.request('MKCOL', full_url)
+                    # 405 : the folder exists, created by a previous attempt whose answer was lost
+                    if response.status_code in [201, 405]:
+                        typer.echo(f"Folder {path_to_create} created successfully")
+                    else:
+                        raise ValueError(f"Failed to create the folder {path_to_create}. Status code: {response.status_code}. Response: {response.text}")
+
+                elif response.status_code != 207:  # 207 means folder exists
+                    raise ValueError(f"Error checking the folder {path_to_create}. Status code: {response.status_code}. Response: {response.text}")
+                self.existing_folders.add(path_to_create.lstrip('/'))
+            self._save_folder_cache()
+
+    def _ocs_shares_request(self, method: str, params: ty.Dict[str, ty.Any] | None = None, data: ty.Dict[str, ty.Any] | None = None) -> ty.Any:
+        """
+        Send a request to the OCS shares API, asking for a JSON answer, and return its data.
+        """
         headers = {
             "OCS-APIRequest": "true",
-            "Content-Type": "application/x-www-form-urlencoded"
+            "Accept": "application/json"
         }
+        response = self.request(method, f"{self.infos.ocs_url}/shares", headers=headers, params={"format": "json", **(params or {})}, data=data)
+        try:
+            ocs = response.json()["ocs"]
+        except (ValueError, KeyError):
+            raise ValueError(f"Unexpected answer from the OCS API. Status code: {response.status_code}, Response: {response.text}")
+        
+        # OCS status code is in the body and can be an error even when the HTTP status code is 200
+        status_code = ocs["meta"]["statuscode"]
+        if status_code not in [100, 200]:
+            raise ValueError(f"Error in the request to the OCS API : Status code = {status_code} - Status = {ocs['meta']['status']} - message = {ocs['meta']['message']}")
+        return ocs["data"]
+
+    def find_public_shares(self, folder: str) -> ty.Dict[str, str]:
+        """
+        Return the links of the existing read only public shares of the files inside folder, by file path.
+        One request lists the shares of all the files of the folder.
+        """
+        links = {}
+        for share in self._ocs_shares_request('GET', params={"path": folder, "subfiles": "true", "reshares": "false"}):
+            if share["share_type"] == 3 and share["permissions"] == 1 and share.get("token"):
+                links.setdefault(share["path"], f"{self.infos.base_url}/s/{share['token']}")
+        return links
+
+    def find_public_share(self, path: str) -> str | None:
+        """
+        Return the link of an existing read only public share of path, if there is one.
+        """
+        for share in self._ocs_shares_request('GET', params={"path": path, "reshares": "false"}):
+            if share["share_type"] == 3 and share["permissions"] == 1 and share.get("token"):
+                return f"{self.infos.base_url}/s/{share['token']}"
+        return None
+
+    def create_public_share(self, path: str) -> str:
+        """
+        Create a public read only link for path and return it.
+        path : for a link in the following form : https://{website}/remote.php/dav/files/{user_root_folder}/one_folder/one_file.txt, desired path would only be "/one_folder/one_file.txt"
+        """
         data = {
-            'path': file_path,
+            'path': '/' + path.lstrip('/'),
             'shareType': 3,  # 3 for public link
             'permissions': 1  # Read permissions
         }
-        response = requests.post(ocs_url, headers=headers, data=data, auth=HTTPBasicAuth(nextcloud_infos.user, nextcloud_infos.password))
+        share = self._ocs_shares_request('POST', data=data)
+        if not share.get("token"):
+            raise ValueError(f"Failed to retrieve the share link for {path} (token value not present)")
+        return f"{self.infos.base_url}/s/{share['token']}"
+
+    def create_public_shares(self, paths: ty.List[str], workers: int = 4) -> ty.List[str]:
+        """
+        Return a public share link for each of the given nextcloud files or folders, in the same order.
+        The existing links are reused : they are looked up with one request per parent folder, then the
+        missing ones are created, up to workers at the same time.
+        """
+        paths = ['/' + path.lstrip('/') for path in paths]
+        parent_folders = sorted({os.path.dirname(path) for path in paths})
+        links: ty.Dict[str, str] = {}
+        for parent_folder in parent_folders:
+            if parent_folder != '/':
+                links.update(self.find_public_shares(parent_folder))
+                continue
+            # The shares of the files of the root folder can't be listed with subfiles, they are looked up one by one
+            for path in paths:
+                link = self.find_public_share(path) if os.path.dirname(path) == '/' else None
+                if link:
+                    links[path] = link
         
-        # OCS doesn't follow HTTP code responses and always return 200 even in case of problems...
-        # To parse OCS's return code, we have to parse the HTTP request response in XML
-
-        if response.status_code in [200, 201]:
-            
-            # Parse OCS response which is in XML
-            response_to_xml = ET.fromstring(response.text)
-            status_code = response_to_xml.find('.//statuscode').text
-            
-            if status_code == "200":
-                # Navigate to the token element (link for share)
-                token_element = response_to_xml.find('.//token').text
-                if token_element is not None:
-                    share_links.append(f"{nextcloud_infos.base_url}/s/{token_element}")
-                else:
-                    raise ValueError(f"Failed to retrieve the share link for {file_path} (token value not present)")
+        missing_paths = [path for path in paths if path not in links]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            links.update(zip(missing_paths, executor.map(self.create_public_share, missing_paths)))
+        return [links[path] for path in paths]
+
+    @staticmethod
+    def _checksum_headers(video: VideoInfosWrapper) -> ty.Dict[str, str]:
+        if video.digests is None:
+            return {}
+        return {"OC-Checksum": f"MD5:{video.digests.md5}"}
+
+    def upload_video(self, video: VideoInfosWrapper, nextcloud_folder: str, event: Event, throttle: DestinationThrottle = UNLIMITED) -> str:
+        """
+        Upload one video into the (already existing) nextcloud_folder, in chunks if the event asks for it,
+        at the rate allowed by the throttle.
+        It return the file's location on Nextcloud.
+        """
+
+        if event.nextcloud_chunked_upload and os.path.getsize(video.wsl_full_path) > event.nextcloud_chunk_size_mb * MB:
+            self.upload_video_in_chunks(video, nextcloud_folder, event, throttle)
+            return f"{nextcloud_folder}/{video.new_name}"
+
+        # Open the local file
+        with open_for_reading(video.wsl_full_path) as file_data:
+            # Prepare the full URL (concatenating the remote file path)
+            full_url = f"{self.infos.webdav_url}/{nextcloud_folder}/{video.new_name}"
+
+            # Make a PUT request to upload the file, Nextcloud keeps the checksum of the file when it is given
+            response = self.request('PUT', full_url, data=throttle.wrap(file_data), headers=self._checksum_headers(video))
+
+            # Check if the upload was successful
+            if response.status_code in [201, 204]:
+                METRICS.current_transfer().advance(os.path.getsize(video.wsl_full_path))
+            if response.status_code == 201:
+                typer.echo(f"File {video.new_name} uploaded successfully. Go to {full_url}")
+            elif response.status_code == 204:
+                typer.echo(f"File {video.new_name} overwritten successfully. Go to {full_url}")
+            elif response.status_code == 409: # The parent folder is missing
+                raise NextcloudFolderMissingError(f"Failed to upload file {video.new_name}, the folder {nextcloud_folder} does not exist")
             else:
-                status = response_to_xml.find('.//status').text
-                message = response_to_xml.find('.//message').text
-                raise ValueError(f"Failed to create share. Error in the request to the OCS API : Status code = {status_code} - Status = {status} - message = {message}")
-                
-                             
+                raise ValueError(f"Failed to upload file {video.new_name} Status code: {response.status_code}, Response: {response.content}")
+
+        return f"{nextcloud_folder}/{video.new_name}"
+
+    def upload_video_in_chunks(self, video: VideoInfosWrapper, nextcloud_folder: str, event: Event, throttle: DestinationThrottle = UNLIMITED) -> None:
+        """
+        Upload one video with the chunked upload API of Nextcloud (v2) : the chunks are sent in parallel into
+        an upload folder, then assembled into the final file with a MOVE. A chunk is only read once it fits
+        in the memory budget of the throttle.
+        The upload folder name only depends on the file, its destination and the chunk size, so a new run resumes the upload
+        and skips the chunks already present on the server.
+        """
+
+        file_size = os.path.getsize(video.wsl_full_path)
+        chunk_size = event.nextcloud_chunk_size_mb * MB
+        chunks_count = -(-file_size // chunk_size)
+
+        destination_url = f"{self.infos.webdav_url}/{nextcloud_folder}/{video.new_name}"
+        upload_id = "timeframe-archivist-" + hashlib.sha256(f"{destination_url}/{file_fingerprint(video.wsl_full_path)}/{chunk_size}".encode()).hexdigest()[:32]
+        upload_url = f"{self.infos.uploads_url}/{upload_id}"
+        headers = {"Destination": destination_url}
+
+        existing_chunks = self.list_uploaded_chunks(upload_url)
+        if existing_chunks is None:
+            self.start_chunked_upload(upload_url, headers, video.new_name)
+            existing_chunks = {}
+        elif existing_chunks:
+            typer.echo(f"Resuming the upload of {video.new_name} ({len(existing_chunks)} chunk(s) already on Nextcloud)")
+            # Chunks beyond the end of the file would be assembled with the others
+            for chunk_name in existing_chunks:
+                if not chunk_name.isdigit() or int(chunk_name) > chunks_count:
+                    self.delete_uploaded_chunk(upload_url, chunk_name, video.new_name)
+
+        # The chunks are sent by other threads
+        transfer = METRICS.current_transfer()
+
+        def upload_chunk(chunk_number: int) -> None:
+            with throttle.reserve_memory(min(chunk_size, file_size - (chunk_number - 1) * chunk_size)):
+                with open(video.wsl_full_path, 'rb') as file_data:
+                    file_data.seek((chunk_number - 1) * chunk_size)
+                    data = file_data.read(chunk_size)
+                self.upload_chunk(upload_url, headers, chunk_number, data, file_size, video.new_name, throttle)
+            transfer.advance(len(data))
+
+        missing_chunks = [chunk_number for chunk_number in range(1, chunks_count + 1)
+                          if existing_chunks.get(str(chunk_number)) != min(chunk_size, file_size - (chunk_number - 1) * chunk_size)]
+        transfer.advance(file_size - sum(min(chunk_size, file_size - (chunk_number - 1) * chunk_size) for chunk_number in missing_chunks))
+        with ThreadPoolExecutor(max_workers=event.nextcloud_chunk_workers) as executor:
+            # list() raises the first error of the chunks, if any
+            list(executor.map(upload_chunk, missing_chunks))
+
+        self.assemble_chunks(upload_url, {**headers, **self._checksum_headers(video)}, file_size, video.new_name, nextcloud_folder)
+
+    def start_chunked_upload(self, upload_url: str, headers: ty.Dict[str, str], file_name: str) -> None:
+        """
+        Create the upload folder of a chunked upload.
+        """
+        response = self.request('MKCOL', upload_url, headers=headers)
+        # 405 : the folder exists, created by a previous attempt whose answer was lost
+        if response.status_code not in [201, 405]:
+            raise ValueError(f"Failed to start the chunked upload of {file_name}. Status code: {response.status_code}. Response: {response.text}")
+
+    def upload_chunk(self, upload_url: str, headers: ty.Dict[str, str], chunk_number: int, data: bytes, file_size: int,
+                     file_name: str, throttle: DestinationThrottle = UNLIMITED) -> None:
+        """
+        Send one chunk of a chunked upload, at the rate allowed by the throttle.
+        """
+        # Chunk names have to be numbers from 1 to 10000, Nextcloud assembles them in numerical order
+        response = self.request('PUT', f"{upload_url}/{chunk_number}", data=throttle.wrap(io.BytesIO(data)), headers={**headers, "OC-Total-Length": str(file_size)})
+        if response.status_code not in [201, 204]:
+            raise ValueError(f"Failed to upload chunk {chunk_number} of {file_name}. Status code: {response.status_code}. Response: {response.text}")
+
+    def delete_uploaded_chunk(self, upload_url: str, chunk_name: str, file_name: str) -> None:
+        """
+        Remove a chunk from the upload folder of a chunked upload.
+        """
+        response = self.request('DELETE', f"{upload_url}/{chunk_name}")
+        # 404 : already removed by a previous attempt whose answer was lost
+        if response.status_code not in [204, 404]:
+            raise ValueError(f"Failed to remove chunk {chunk_name} of {file_name}. Status code: {response.status_code}. Response: {response.text}")
+
+    def assemble_chunks(self, upload_url: str, headers: ty.Dict[str, str], file_size: int, file_name: str, nextcloud_folder: str) -> None:
+        """
+        Assemble the chunks of an upload folder into the destination file, with a MOVE.
+        """
+        destination_url = headers["Destination"]
+        response = self.request('MOVE', f"{upload_url}/.file", headers={**headers, "OC-Total-Length": str(file_size)},
+                                timeout=self.assembly_timeout())
+        if response.status_code == 201:
+            typer.echo(f"File {file_name} uploaded successfully. Go to {destination_url}")
+        elif response.status_code == 204:
+            typer.echo(f"File {file_name} overwritten successfully. Go to {destination_url}")
+        elif response.status_code == 409: # The parent folder is missing
+            raise NextcloudFolderMissingError(f"Failed to assemble the chunks of {file_name}, the folder {nextcloud_folder} does not exist")
         else:
-            raise ValueError(f"Failed to create share. Status code: {response.status_code}, Response: {response.text}")
-        
-    return share_links
-        
-        
-    
-    
+            raise ValueError(f"Failed to assemble the chunks of {file_name}. Status code: {response.status_code}. Response: {response.text}")
+
+    def list_files(self, folder: str) -> ty.Dict[str, RemoteFile]:
+        """
+        Return the files present in a folder, by name, with one PROPFIND Depth:1.
+        Return an empty dict if the folder does not exist.
+        """
+
+        response = self.request('PROPFIND', f"{self.infos.webdav_url}/{folder}/", headers={"Depth": "1", "Content-Type": "application/xml"}, data=LIST_FILES_PROPFIND_BODY)
+        if response.status_code == 404:
+            return {}
+        if response.status_code != 207:
+            raise ValueError(f"Error listing the folder {folder}. Status code: {response.status_code}. Response: {response.text}")
+
+        remote_files = {}
+        for response_element in ET.fromstring(response.content).findall('d:response', WEBDAV_NAMESPACES):
+            if response_element.find('.//d:resourcetype/d:collection', WEBDAV_NAMESPACES) is not None:
+                continue
+            name = requests.utils.unquote(response_element.find('d:href', WEBDAV_NAMESPACES).text.rstrip('/').split('/')[-1])
+            content_length = response_element.find('.//d:getcontentlength', WEBDAV_NAMESPACES)
+            checksums = [checksum.text for checksum in response_element.findall('.//oc:checksums/oc:checksum', WEBDAV_NAMESPACES) if checksum.text]
+            remote_files[name] = RemoteFile(name=name, size_bytes=int(content_length.text) if content_length is not None and content_length.text else 0,
+                                            checksum=" ".join(checksums) or None)
+        return remote_files
+
+    def list_uploaded_chunks(self, upload_url: str) -> ty.Dict[str, int] | None:
+        """
+        Return the size of each chunk already present in an upload folder, by chunk name.
+        Return None if the upload folder does not exist.
+        """
+
+        response = self.request('PROPFIND', upload_url, headers={"Depth": "1"})
+        if response.status_code == 404:
+            return None
+        if response.status_code != 207:
+            raise ValueError(f"Error checking the upload folder {upload_url}. Status code: {response.status_code}. Response: {response.text}")
+
+        chunks = {}
+        for response_element in ET.fromstring(response.content).findall('d:response', WEBDAV_NAMESPACES):
+            chunk_name = response_element.find('d:href', WEBDAV_NAMESPACES).text.rstrip('/').split('/')[-1]
+            content_length = response_element.find('.//d:getcontentlength', WEBDAV_NAMESPACES)
+            if content_length is not None and content_length.text:
+                chunks[chunk_name] = int(content_length.text)
+        return chunks
+
+
+@lru_cache(maxsize=None)
+def get_nextcloud_client() -> NextcloudClient:
+    """
+    Return the Nextcloud client shared by the whole run, creating it on first use.
+    The folder cache is saved between runs when NEXTCLOUD_PERSIST_FOLDER_CACHE is true.
+    """
+    folder_cache_path = None
+    if os.getenv("NEXTCLOUD_PERSIST_FOLDER_CACHE", "false").lower() == "true":
+        folder_cache_path = get_state_path(FOLDER_CACHE_FILE)
+    return NextcloudClient(get_nextcloud_infos(), folder_cache_path)
+
+
+def create_public_shares(file_paths: ty.List[str], workers: int = 4) -> ty.List[str]:
+    """
+    Create a public share for the given nextcloud files (see NextcloudClient.create_public_shares)
+    """
+    return get_nextcloud_client().create_public_shares(file_paths, workers)
+
+
+def create_event_public_shares(inputs_result: Inputs, file_paths: ty.List[str]) -> ty.Dict[str, str]:
+    """
+    Return the public share link of each uploaded file, by location : its own link, or the link of the whole
+    event folder for every file if nextcloud_share_event_folder is set.
+    """
+    if inputs_result.event.nextcloud_share_event_folder:
+        event_folder_link, = create_public_shares([normalize_folders_path(inputs_result.event.nextcloud_folder)], inputs_result.event.nextcloud_share_workers)
+        return {file_path: event_folder_link for file_path in file_paths}
+    return dict(zip(file_paths, create_public_shares(file_paths, inputs_result.event.nextcloud_share_workers)))
 
 
 def create_folders_if_they_do_not_exist(folders_path : str):
-    
+
     """
     This function create all the folder in folders_path if they do not exist
     A folder can't be created if it parent does not exist.
     """
-    
-    nextcloud_infos = get_nextcloud_infos()
-    next_cloud_webdav_url = f"{nextcloud_infos.webdav_url}"
-    # Split the path to handle each folder
-    folders = folders_path.split('/')
-    path_to_create = ''
-    for folder in folders:
-        if folder:
-            path_to_create += '/' + folder
-            full_url = f"{next_cloud_webdav_url}{path_to_create}/"
-            
-            response = requests.request('PROPFIND', full_url, auth=HTTPBasicAuth(nextcloud_infos.user, nextcloud_infos.password))
-            
-            if response.status_code == 404:  # 404 means folder does not exist
-                # Try to create the folder
-                response = requests.request('MKCOL', full_url, auth=HTTPBasicAuth(nextcloud_infos.user, nextcloud_infos.password))
-                if response.status_code == 201:
-                    typer.echo(f"Folder {path_to_create} created successfully")
-                else:
-                    raise ValueError(f"Failed to create the folder {path_to_create}. Status code: {response.status_code}. Response: {response.text}")
-                
-            elif response.status_code == 207:  # Assuming 207 means folder exists
-                #TODO log already exist
-                test = 1
-            else:
-                raise ValueError(f"Error checking the folder {path_to_create}. Status code: {response.status_code}. Response: {response.text}")
-            
+
+    get_nextcloud_client().create_folders_if_they_do_not_exist(folders_path)
 
 
 def upload_file_to_nextcloud(videos: ty.List[VideoInfosWrapper], inputs_result: Inputs) -> ty.List[str]:
-    
+
     """
     This function upload the list of videos in parameter into nextcloud.
     It return the list of the files's location on Nextcloud after having been uploaded.
-    
+
     """
-    
-    nextcloud_infos = get_nextcloud_infos()
-    nextcloud_folder = normalize_folders_path(inputs_result.event.nextcloud_folder)
-    create_folders_if_they_do_not_exist(nextcloud_folder)
+
+    nextcloud_folder = prepare_nextcloud_folder(inputs_result)
     files_locations = []
-    
+
     for video in videos:
-    # Open the local file
-        with open(video.wsl_full_path, 'rb') as file_data:
-            # Prepare the full URL (concatenating the remote file path)
-            full_url = f"{nextcloud_infos.webdav_url}/{nextcloud_folder}/{video.new_name}"
-            print(full_url)
+        files_locations.append(upload_video_to_nextcloud(video, nextcloud_folder, inputs_result.event))
 
-            # Make a PUT request to upload the file
-            response = requests.put(full_url, data=file_data, auth=HTTPBasicAuth(nextcloud_infos.user, nextcloud_infos.password))
+    return files_locations
 
-            # Check if the upload was successful
-            if response.status_code == 201:
-                typer.echo(f"File {video.new_name} uploaded successfully. Go to {full_url}")
-                files_locations.append(f"{nextcloud_folder}/{video.new_name}")                
-            elif response.status_code == 204:
-                 typer.echo(f"File {video.new_name} overwritten successfully. Go to {full_url}")  
-                 files_locations.append(f"{nextcloud_folder}/{video.new_name}")    
-            else: 
-                raise ValueError(f"Failed to upload file {video.new_name} Status code: {response.status_code}, Response: {response.content}")
-                
-    return files_locations
\ No newline at end of file
+
+def prepare_nextcloud_folder(inputs_result: Inputs) -> str:
+    """
+    Create the event folder on Nextcloud if needed and return its normalized path.
+    """
+    nextcloud_folder = normalize_folders_path(inputs_result.event.nextcloud_folder)
+    create_folders_if_they_do_not_exist(nextcloud_folder)
+    return nextcloud_folder
+
+
+def list_nextcloud_files(nextcloud_folder: str) -> ty.Dict[str, RemoteFile]:
+    """
+    Return the files already present in nextcloud_folder, by name.
+    """
+    return get_nextcloud_client().list_files(nextcloud_folder)
+
+
+def is_same_nextcloud_file(file_path: str, remote_file: RemoteFile, digests: FileDigests | None = None) -> bool:
+    """
+    Compare a local file with a file present on Nextcloud : the sizes have to be equal, and the checksum too
+    if Nextcloud has one for the file (like "SHA1:<digest> MD5:<digest>").
+    The digests of the file are used when given, instead of reading it again.
+    """
+    size_bytes = digests.size_bytes if digests else os.path.getsize(file_path)
+    if size_bytes != remote_file.size_bytes:
+        return False
+    if not remote_file.checksum:
+        return True
+    remote_checksums = dict(checksum.split(":", 1) for checksum in remote_file.checksum.split(" "))
+    if digests and "MD5" in remote_checksums:
+        return digests.md5 == remote_checksums["MD5"].lower()
+    algorithm, digest = next(iter(remote_checksums.items()))
+    return file_digest(file_path, algorithm) == digest.lower()
+
+
+def upload_video_to_nextcloud(video: VideoInfosWrapper, nextcloud_folder: str, event: Event, throttle: DestinationThrottle = UNLIMITED) -> str:
+    """
+    Upload one video into nextcloud_folder.
+    If the folder is missing although it was cached, the cache is emptied, the folders created and the upload done again.
+    It return the file's location on Nextcloud.
+    """
+
+    nextcloud_client = get_nextcloud_client()
+    try:
+        return nextcloud_client.upload_video(video, nextcloud_folder, event, throttle)
+    except NextcloudFolderMissingError:
+        nextcloud_client.forget_folders()
+        nextcloud_client.create_folders_if_they_do_not_exist(nextcloud_folder)
+        return nextcloud_client.upload_video(video, nextcloud_folder, event, throttle)
+
+
+class NextcloudStreamSink(TeeSink):
+    """
+    Upload a file to Nextcloud while it is read, with the chunked upload API : the blocks are gathered into
+    chunks of nextcloud_chunk_size_mb, each chunk is sent as soon as it is full, with up to nextcloud_chunk_workers
+    chunks in flight (the reading waits beyond that, and for the memory budget of the throttle), then the chunks
+    are assembled with a MOVE, sent by the NextcloudClient like the ones of upload_video_in_chunks. When the event folder
+    is missing, it is created and the chunks assembled again. size_bytes is the size of the file which is read.
+    Unlike upload_video_in_chunks, a streamed upload is not resumed by the next run.
+    """
+
+    def __init__(self, video: VideoInfosWrapper, size_bytes: int, nextcloud_folder: str, event: Event, throttle: DestinationThrottle = UNLIMITED):
+        self.client = get_nextcloud_client()
+        self.throttle = throttle
+        self.video_name = video.new_name
+        self.nextcloud_folder = nextcloud_folder
+        self.destination_url = f"{self.client.infos.webdav_url}/{nextcloud_folder}/{video.new_name}"
+        self.upload_url = f"{self.client.infos.uploads_url}/timeframe-archivist-stream-{uuid.uuid4().hex}"
+        self.headers = {"Destination": self.destination_url}
+        self.chunk_size = event.nextcloud_chunk_size_mb * MB
+        self.buffer = bytearray()
+        self.file_hash = hashlib.md5()
+        self.expected_size_bytes = size_bytes
+        self.size_bytes = 0
+        self.started = False
+        self.chunk_futures: ty.List[Future] = []
+        self.chunks_in_flight = threading.BoundedSemaphore(event.nextcloud_chunk_workers)
+        self.executor = ThreadPoolExecutor(max_workers=event.nextcloud_chunk_workers, thread_name_prefix="nextcloud-stream")
+
+    def write(self, block: bytes) -> None:
+        self.buffer += block
+        self.file_hash.update(block)
+        self.size_bytes += len(block)
+        while len(self.buffer) >= self.chunk_size:
+            chunk = bytes(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+            self._send_chunk(chunk)
+
+    def _send_chunk(self, chunk: bytes) -> None:
+        for future in self.chunk_futures:
+            # Stop at the first failed chunk
+            if future.done() and future.exception():
+                raise future.exception()
+        if not self.started:
+            self.client.start_chunked_upload(self.upload_url, self.headers, self.video_name)
+            self.started = True
+        self.chunks_in_flight.acquire()
+        self.throttle.acquire_memory(len(chunk))
+        future = self.executor.submit(self.client.upload_chunk, self.upload_url, self.headers, len(self.chunk_futures) + 1, chunk,
+                                      self.expected_size_bytes, self.video_name, self.throttle)
+        future.add_done_callback(lambda _: (self.throttle.release_memory(len(chunk)), self.chunks_in_flight.release()))
+        self.chunk_futures.append(future)
+
+    def close(self) -> str:
+        try:
+            if self.buffer or not self.started:
+                self._send_chunk(bytes(self.buffer))
+            for future in self.chunk_futures:
+                future.result()
+            if self.size_bytes != self.expected_size_bytes:
+                raise ValueError(f"Read {self.size_bytes} bytes of {self.video_name} instead of {self.expected_size_bytes}")
+        except ValueError:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=True)
+
+        headers = {**self.headers, "OC-Checksum": f"MD5:{self.file_hash.hexdigest()}"}
+        try:
+            try:
+                self.client.assemble_chunks(self.upload_url, headers, self.size_bytes, self.video_name, self.nextcloud_folder)
+            except NextcloudFolderMissingError:
+                # The chunks stay in the upload folder, they are assembled again once the folders are created
+                self.client.forget_folders()
+                self.client.create_folders_if_they_do_not_exist(self.nextcloud_folder)
+                self.client.assemble_chunks(self.upload_url, headers, self.size_bytes, self.video_name, self.nextcloud_folder)
+        except ValueError:
+            self.abort()
+            raise
+        return f"{self.nextcloud_folder}/{self.video_name}"
+
+    def abort(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.started:
+            self.client.request('DELETE', self.upload_url)
+            self.started = False
+
+
+class NextcloudDestination(Destination):
+
+    name = NEXTCLOUD_DESTINATION
+
+    def __init__(self, inputs_result: Inputs):
+        super().__init__(inputs_result)
+        self.nextcloud_folder = prepare_nextcloud_folder(inputs_result)
+
+    @property
+    def workers(self) -> int:
+        return self.inputs_result.event.nextcloud_upload_workers
+
+    def upload(self, video: VideoInfosWrapper) -> str:
+        return upload_video_to_nextcloud(video, self.nextcloud_folder, self.inputs_result.event, self.throttle)
+
+    def location(self, video: VideoInfosWrapper) -> str:
+        return f"{self.nextcloud_folder}/{video.new_name}"
+
+    def list_remote_files(self) -> ty.Dict[str, RemoteFile]:
+        return list_nextcloud_files(self.nextcloud_folder)
+
+    def is_same_file(self, video: VideoInfosWrapper, remote_file: RemoteFile) -> bool:
+        return is_same_nextcloud_file(video.wsl_full_path, remote_file, video.digests)
+
+    @property
+    def uses_rendition(self) -> bool:
+        return self.inputs_result.event.nextcloud_rendition
+
+    def open_stream(self, video: VideoInfosWrapper, size_bytes: int, digester: FileDigester) -> TeeSink | None:
+        # Only the chunked upload API allows to send a file whose reading is not finished,
+        # and a rendition is made from the complete file
+        if not self.inputs_result.event.nextcloud_chunked_upload or self.uses_rendition:
+            return None
+        return NextcloudStreamSink(video, size_bytes, self.nextcloud_folder, self.inputs_result.event, self.throttle)
+
+
+def create_destination(inputs_result: Inputs) -> Destination:
+    return NextcloudDestination(inputs_result)
+
+
+def warm_up(event: Event) -> None:
+    get_nextcloud_client()
@@ -0,0 +1,473 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import threading
+import time
+import typer
+import typing as ty
+
+# Internal files
+from bandwidth import DestinationThrottle, TransferScheduler, UNLIMITED
+from checksums import FileDigester, compute_file_digests
+from definitions import Event, Inputs, VideoInfosWrapper, UploadResult, RemoteFile, Rendition, RenditionSettings
+from plugins import load_enabled_destination_plugins, NEXTCLOUD_DESTINATION, S3_DESTINATION
+from staging import StagingArea, get_staging_area
+from metrics import METRICS
+from tee import TeeSink, FileSink, DigestSink, ProgressSink, tee_file
+from transcode import check_ffmpeg, get_renditions_folder, make_rendition
+
+
+MB = 1024 * 1024
+# The pools of processes are started while other threads run (uploads, staging, notifications, progress) :
+# a forked child could inherit a lock held by one of them, the processes are started from a clean server instead
+PROCESS_CONTEXT = multiprocessing.get_context("forkserver")
+
+
+class Destination(ABC):
+    """
+    A place where the videos are uploaded. Each destination plugin (see plugins.py) implements one.
+    """
+
+    name: str
+    # Rate limits and memory budget of the uploads, given by the upload pipeline
+    throttle: DestinationThrottle = UNLIMITED
+
+    def __init__(self, inputs_result: Inputs):
+        self.inputs_result = inputs_result
+
+    @property
+    @abstractmethod
+    def workers(self) -> int:
+        """
+        Number of files uploaded at the same time.
+        """
+
+    @abstractmethod
+    def upload(self, video: VideoInfosWrapper) -> str:
+        """
+        Upload the video and return its location on the destination.
+        """
+
+    @abstractmethod
+    def location(self, video: VideoInfosWrapper) -> str:
+        """
+        Return the location of the video on the destination.
+        """
+
+    @abstractmethod
+    def list_remote_files(self) -> ty.Dict[str, RemoteFile]:
+        """
+        Return the files already present on the destination, by name, with one listing.
+        """
+
+    @abstractmethod
+    def is_same_file(self, video: VideoInfosWrapper, remote_file: RemoteFile) -> bool:
+        """
+        Return True if the remote file is the same as the local video.
+        """
+
+    def open_stream(self, video: VideoInfosWrapper, size_bytes: int, digester: FileDigester) -> TeeSink | None:
+        """
+        Return a sink uploading the video while it is read (see tee.py), None if the destination
+        can only upload a complete local file. size_bytes is the size of the file which will be read,
+        and digester hashes it in the same tee, for the sinks sending its digests.
+        """
+        return None
+
+    @property
+    def uses_rendition(self) -> bool:
+        """
+        True if the destination receives the lighter rendition of the videos (see transcode.py) instead of the originals.
+        """
+        return False
+
+
+class UploadPipeline:
+    """
+    Upload each video to all the enabled destinations as soon as it is submitted, while the next
+    videos are still being copied from the device.
+    Every destination has its own pool of workers, and an error on one file does not stop the others.
+    The files already present on a destination (same name, size and checksum when available) are not uploaded again.
+    Each video is read once by a pool of processes to compute its digests, which are then shared by all
+    the destinations (comparison with the remote files, and integrity checksums sent with the uploads).
+    With a stream_block_size, each video is instead read once by a tee (see tee.py) feeding the destinations
+    able to upload a stream, the digests and, when it is read from the device, the local copy.
+    Otherwise, with a staging_area, the videos are read from their staged copy on the native file system (see staging.py),
+    made by the threads of the pipeline so the copies from the device go on meanwhile.
+    With a scheduler, the destinations share the uplink and the memory with its rate limits and priorities (see bandwidth.py).
+    With rendition_settings, a pool of processes makes the renditions of the videos with ffmpeg, for the destinations using them.
+    The pool of processes computing the digests is only started for the first video to hash, with at most one process per video (videos_count).
+    on_result is called with the result of each upload as soon as it is done, from the worker thread : it must not wait.
+    """
+
+    def __init__(self, destinations: ty.List[Destination], s3_part_size: int | None = None,
+                 stream_block_size: int | None = None, stream_buffered_blocks: int = 4,
+                 staging_area: StagingArea | None = None, scheduler: TransferScheduler | None = None,
+                 rendition_settings: RenditionSettings | None = None, rendition_workers: int = 1,
+                 on_result: ty.Callable[[UploadResult], None] | None = None, videos_count: int | None = None):
+        self.destinations = destinations
+        self.on_result = on_result
+        self.rendition_settings = rendition_settings
+        if scheduler:
+            for destination in destinations:
+                destination.throttle = scheduler.for_destination(destination.name)
+        self.staging_area = staging_area
+        self.s3_part_size = s3_part_size
+        self.stream_block_size = stream_block_size
+        self.stream_buffered_blocks = stream_buffered_blocks
+        self.executors = {destination.name: ThreadPoolExecutor(max_workers=destination.workers, thread_name_prefix=destination.name)
+                          for destination in destinations}
+        self.digests_workers = min(os.cpu_count() or 1, videos_count) if videos_count else os.cpu_count() or 1
+        self.digests_executor: ProcessPoolExecutor | None = None
+        self.digests_executor_lock = threading.Lock()
+        self.stream_executor = ThreadPoolExecutor(max_workers=max([destination.workers for destination in destinations], default=1), thread_name_prefix="tee")
+        self.staging_executor = ThreadPoolExecutor(max_workers=max([destination.workers for destination in destinations], default=1), thread_name_prefix="staging") if staging_area else None
+        self.rendition_executor = ProcessPoolExecutor(max_workers=rendition_workers, mp_context=PROCESS_CONTEXT) if rendition_settings else None
+        self.digests_futures: ty.Dict[str, Future] = {}
+        self.staged_futures: ty.Dict[str, Future] = {} # Path of the staged copy of each video, with a staging area
+        self.rendition_futures: ty.Dict[str, Future] = {}
+        self.remote_files: ty.Dict[str, ty.Dict[str, RemoteFile]] = {}
+        self.pending: ty.List[ty.Tuple[VideoInfosWrapper, str, Future]] = []
+
+    def __enter__(self) -> "UploadPipeline":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
+
+    def list_remote_files(self) -> None:
+        """
+        Take one listing of every destination, used to skip the files already uploaded.
+        """
+        for destination in self.destinations:
+            self.remote_files[destination.name] = destination.list_remote_files()
+
+    def submit(self, video: VideoInfosWrapper, done_locations: ty.Dict[str, str] | None = None, source_path: str | None = None) -> None:
+        """
+        Queue the upload of a copied and renamed video to every destination.
+        done_locations gives the destinations the video was already uploaded to by a previous run, with its location :
+        they are reported as skipped without being checked again.
+        source_path is given when the video has not been copied yet and can be read from the device while streaming :
+        the local copy is then written by the tee.
+        """
+        done_locations = done_locations or {}
+        pending_destinations = [destination for destination in self.destinations if destination.name not in done_locations]
+        if self.stream_block_size and (pending_destinations or source_path):
+            stream_futures = self._submit_stream(video, pending_destinations, source_path)
+        else:
+            stream_futures = {}
+            if pending_destinations:
+                self._submit_digests(video)
+        rendition_destinations = [destination.name for destination in pending_destinations if destination.uses_rendition]
+        if self.rendition_settings and rendition_destinations:
+            # A streamed video can only be transcoded once its local copy is complete, when its digests are set
+            self._submit_rendition(video, self.digests_futures[video.wsl_full_path] if source_path else None)
+        futures = []
+        rendition_uploads = []
+        for destination in self.destinations:
+            if destination.name in done_locations:
+                future: Future = Future()
+                future.set_result((done_locations[destination.name], True))
+            elif destination.name in stream_futures:
+                future = stream_futures[destination.name]
+            else:
+                future = self.executors[destination.name].submit(self._transfer, destination, video)
+            if self.on_result and destination.name not in done_locations:
+                future.add_done_callback(lambda done, destination_name=destination.name: self.on_result(self._result(video, destination_name, done)))
+            self.pending.append((video, destination.name, future))
+            futures.append(future)
+            if destination.name in rendition_destinations:
+                rendition_uploads.append(future)
+        if video.wsl_full_path in self.staged_futures and not stream_futures:
+            self._release_when_done(self.staged_futures[video.wsl_full_path], futures)
+        if self.rendition_settings and rendition_uploads:
+            self._remove_rendition_when_done(self.rendition_futures[video.wsl_full_path], rendition_uploads)
+
+    def _submit_digests(self, video: VideoInfosWrapper) -> None:
+        """
+        Queue the digests of a video, computed by the pool of processes.
+        With a staging area, the video is staged first by a thread of the pipeline, then its digests and uploads read the staged copy.
+        """
+        if not self.staging_area:
+            self.digests_futures[video.wsl_full_path] = self._get_digests_executor().submit(compute_file_digests, video.wsl_full_path, self.s3_part_size)
+            return
+        staged_future = self.staging_executor.submit(self.staging_area.stage, video.wsl_full_path, video.new_name)
+        digests_future: Future = Future()
+        self.staged_futures[video.wsl_full_path] = staged_future
+        self.digests_futures[video.wsl_full_path] = digests_future
+
+        def start(future: Future) -> None:
+            if future.exception():
+                digests_future.set_exception(future.exception())
+            else:
+                self._get_digests_executor().submit(compute_file_digests, future.result(), self.s3_part_size).add_done_callback(
+                    lambda done: copy_outcome(done, digests_future))
+
+        staged_future.add_done_callback(start)
+
+    def _get_digests_executor(self) -> ProcessPoolExecutor:
+        """
+        Return the pool of processes computing the digests, started on the first call.
+        """
+        # Also called from the staging threads
+        with self.digests_executor_lock:
+            if self.digests_executor is None:
+                self.digests_executor = ProcessPoolExecutor(max_workers=self.digests_workers, mp_context=PROCESS_CONTEXT)
+            return self.digests_executor
+
+    def _release_when_done(self, staged_future: Future, futures: ty.List[Future]) -> None:
+        """
+        Allow the eviction of a staged video once all its uploads are done.
+        """
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def release(_: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0 and not staged_future.exception():
+                    self.staging_area.release(staged_future.result())
+
+        for future in futures:
+            future.add_done_callback(release)
+
+    def _remove_rendition_when_done(self, rendition_future: Future, futures: ty.List[Future]) -> None:
+        """
+        Remove the rendition of a video once all the destinations using it are done with it.
+        """
+        # An upload can fail before the rendition is made : it is also waited for
+        remaining = [len(futures) + 1]
+        lock = threading.Lock()
+
+        def remove(_: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0 and not rendition_future.exception() and os.path.exists(rendition_future.result().path):
+                    os.remove(rendition_future.result().path)
+
+        for future in [*futures, rendition_future]:
+            future.add_done_callback(remove)
+
+    def _submit_rendition(self, video: VideoInfosWrapper, after: Future | None) -> None:
+        """
+        Queue the rendition of a video, at once or when the after future is done.
+        """
+        rendition_path = os.path.join(get_renditions_folder(), video.new_name)
+        if after is None:
+            self.rendition_futures[video.wsl_full_path] = self.rendition_executor.submit(make_rendition, video.wsl_full_path, rendition_path, self.rendition_settings)
+            return
+        rendition_future: Future = Future()
+        self.rendition_futures[video.wsl_full_path] = rendition_future
+
+        def start(future: Future) -> None:
+            if future.exception():
+                rendition_future.set_exception(future.exception())
+            else:
+                self.rendition_executor.submit(make_rendition, video.wsl_full_path, rendition_path, self.rendition_settings).add_done_callback(
+                    lambda done: copy_outcome(done, rendition_future))
+
+        after.add_done_callback(start)
+
+    def _submit_stream(self, video: VideoInfosWrapper, destinations: ty.List[Destination], source_path: str | None) -> ty.Dict[str, Future]:
+        """
+        Queue the tee of a video, and return the futures of the destinations it uploads to.
+        The files already present on a destination are not streamed : they are compared with the digests computed by the tee.
+        """
+        sinks: ty.Dict[str, TeeSink] = {}
+        size_bytes = os.path.getsize(source_path or video.wsl_full_path)
+        digest_sink = DigestSink(self.s3_part_size)
+        for destination in destinations:
+            if video.new_name not in self.remote_files.get(destination.name, {}):
+                sink = destination.open_stream(video, size_bytes, digest_sink.digester)
+                if sink is not None:
+                    sinks[destination.name] = sink
+        # The other destinations wait for the digests, set once the tee is done (and the local copy complete)
+        self.digests_futures[video.wsl_full_path] = Future()
+        stream_futures: ty.Dict[str, Future] = {name: Future() for name in sinks}
+        self.stream_executor.submit(self._stream, video, source_path, digest_sink, sinks, stream_futures)
+        return stream_futures
+
+    def _stream(self, video: VideoInfosWrapper, source_path: str | None, digest_sink: DigestSink, sinks: ty.Dict[str, TeeSink], stream_futures: ty.Dict[str, Future]) -> None:
+        digests_future = self.digests_futures[video.wsl_full_path]
+        read_path = source_path or video.wsl_full_path
+        size_bytes = os.path.getsize(read_path)
+        # First sink, so the digests of a block are computed before the uploads waiting for them can need them
+        all_sinks = [digest_sink, *sinks.values()]
+        if source_path:
+            all_sinks.append(FileSink(video.wsl_full_path))
+        start = time.perf_counter()
+        try:
+            with METRICS.transfer(f"{video.new_name} → {', '.join(sinks) or 'digests'}", size_bytes) as transfer:
+                outcomes = tee_file(read_path, [*all_sinks, ProgressSink(transfer)], self.stream_block_size, self.stream_buffered_blocks)[:-1]
+        except Exception as e:
+            for future in [digests_future, *stream_futures.values()]:
+                future.set_exception(ValueError(f"Failed to read {source_path or video.wsl_full_path}: {e}"))
+            return
+
+        # Every sink took the whole time of the reading
+        duration_s = time.perf_counter() - start
+        (digests, digests_error), *sinks_outcomes = outcomes
+        copy_error = sinks_outcomes.pop()[1] if source_path else None
+        if source_path and copy_error is None:
+            METRICS.record("copy", duration_s, size_bytes, video.new_name)
+        for (location, error), (destination_name, future) in zip(sinks_outcomes, stream_futures.items()):
+            if error is None:
+                METRICS.record("upload", duration_s, size_bytes, video.new_name, destination_name)
+                future.set_result((location, False))
+            else:
+                future.set_exception(error)
+        if digests_error or copy_error:
+            digests_future.set_exception(copy_error or digests_error)
+        else:
+            digests_future.set_result(digests)
+
+    def _transfer(self, destination: Destination, video: VideoInfosWrapper) -> ty.Tuple[str, bool]:
+        """
+        Upload the video to the destination unless it is already there.
+        It return the location of the video and if the upload was skipped.
+        The video is shared by the workers of every destination : each one uploads its own copy of it.
+        """
+        digests = self.digests_futures[video.wsl_full_path].result()
+        upload_path = video.wsl_full_path
+        if video.wsl_full_path in self.staged_futures:
+            # Done before the digests
+            upload_path = self.staged_futures[video.wsl_full_path].result()
+        upload_video = video.model_copy(update={"digests": digests, "wsl_full_path": upload_path})
+        if destination.uses_rendition:
+            rendition = self._wait_for_rendition(video, digests.size_bytes)
+            upload_video = video.model_copy(update={"wsl_full_path": rendition.path, "digests": rendition.digests, "rendition": rendition})
+        remote_file = self.remote_files.get(destination.name, {}).get(video.new_name)
+        if remote_file and destination.is_same_file(upload_video, remote_file):
+            typer.echo(f"File {video.new_name} already present on {destination.name}, skipped")
+            return destination.location(video), True
+        size_bytes = os.path.getsize(upload_video.wsl_full_path)
+        with METRICS.transfer(f"{video.new_name} → {destination.name}", size_bytes), \
+                METRICS.measure("upload", size_bytes, video.new_name, destination.name):
+            return destination.upload(upload_video), False
+
+    def _wait_for_rendition(self, video: VideoInfosWrapper, original_size_bytes: int) -> Rendition:
+        """
+        Wait for the rendition of a video, and report its duration and the size saved.
+        """
+        rendition = self.rendition_futures[video.wsl_full_path].result()
+        METRICS.record("transcode", rendition.duration_s, original_size_bytes, video.new_name)
+        typer.echo(f"Rendition of {video.new_name} made in {rendition.duration_s:.1f}s : {original_size_bytes / MB:.0f} Mb → {rendition.digests.size_bytes / MB:.0f} Mb")
+        return rendition
+
+    def results(self, destination_names: ty.List[str] | None = None) -> ty.List[UploadResult]:
+        """
+        Wait for every queued upload and return one result per file and per destination, in submission order.
+        With destination_names, only the uploads to these destinations are waited for and returned.
+        """
+        return [self._result(video, destination, future) for video, destination, future in self.pending
+                if destination_names is None or destination in destination_names]
+
+    def _result(self, video: VideoInfosWrapper, destination: str, future: Future) -> UploadResult:
+        """
+        Wait for the upload of a video to a destination and return its result.
+        """
+        size_bytes = os.path.getsize(video.wsl_full_path) if os.path.exists(video.wsl_full_path) else 0
+        try:
+            location, skipped = future.result()
+            uses_rendition = any(destination_plugin.uses_rendition for destination_plugin in self.destinations if destination_plugin.name == destination)
+            rendition_future = self.rendition_futures.get(video.wsl_full_path)
+            rendition_size_bytes = None
+            if uses_rendition and rendition_future and rendition_future.done() and not rendition_future.exception():
+                rendition_size_bytes = rendition_future.result().digests.size_bytes
+            return UploadResult(video_name=video.new_name, destination=destination, location=location, error=None, size_bytes=size_bytes, skipped=skipped,
+                                rendition_size_bytes=rendition_size_bytes)
+        except Exception as e:
+            return UploadResult(video_name=video.new_name, destination=destination, location=None, error=str(e), size_bytes=size_bytes)
+
+    def shutdown(self) -> None:
+        # The tees first, the uploads of the other destinations can be waiting for them
+        self.stream_executor.shutdown(wait=True)
+        if self.staging_executor:
+            self.staging_executor.shutdown(wait=True)
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        if self.digests_executor:
+            self.digests_executor.shutdown(wait=True)
+        if self.rendition_executor:
+            self.rendition_executor.shutdown(wait=True)
+
+
+def copy_outcome(source: Future, target: Future) -> None:
+    """
+    Set the result or the exception of a done future on another one.
+    """
+    if source.exception():
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def create_upload_pipeline(inputs_result: Inputs, on_result: ty.Callable[[UploadResult], None] | None = None,
+                           videos_count: int | None = None) -> UploadPipeline:
+    """
+    Build the pipeline with the destinations enabled in the event, and take their listings.
+    Only the modules of these destinations are imported.
+    videos_count is the number of videos which will be submitted, when it is known.
+    """
+    destinations: ty.List[Destination] = [plugin.create_destination(inputs_result)
+                                          for plugin in load_enabled_destination_plugins(inputs_result.event)]
+    s3_part_size = inputs_result.event.S3_multipart_chunksize_mb * MB if inputs_result.event.S3_upload else None
+    stream_block_size = inputs_result.event.streaming_block_size_mb * MB if inputs_result.event.streaming_upload else None
+    rendition_settings = None
+    if any(destination.uses_rendition for destination in destinations):
+        check_ffmpeg()
+        rendition_settings = RenditionSettings(max_height=inputs_result.event.nextcloud_rendition_max_height,
+                                               video_bitrate_kbps=inputs_result.event.nextcloud_rendition_video_bitrate_kbps)
+    upload_pipeline = UploadPipeline(destinations, s3_part_size, stream_block_size, inputs_result.event.streaming_buffered_blocks,
+                                     get_staging_area(), create_transfer_scheduler(inputs_result.event),
+                                     rendition_settings, inputs_result.event.nextcloud_rendition_workers, on_result, videos_count)
+    upload_pipeline.list_remote_files()
+    return upload_pipeline
+
+
+def create_transfer_scheduler(event: Event) -> TransferScheduler | None:
+    """
+    Return the scheduler of the rate limits, priorities and memory budget of the event, None if it has no limit.
+    """
+    rates_mb_s = {S3_DESTINATION: event.S3_max_rate_mb_s, NEXTCLOUD_DESTINATION: event.nextcloud_max_rate_mb_s}
+    if not (any(rates_mb_s.values()) or event.upload_max_rate_mb_s or event.upload_memory_budget_mb):
+        return None
+    return TransferScheduler(rates_bytes_s={name: rate_mb_s * MB if rate_mb_s else None for name, rate_mb_s in rates_mb_s.items()},
+                             priorities={S3_DESTINATION: event.S3_priority, NEXTCLOUD_DESTINATION: event.nextcloud_priority},
+                             total_rate_bytes_s=event.upload_max_rate_mb_s * MB if event.upload_max_rate_mb_s else None,
+                             memory_budget_bytes=event.upload_memory_budget_mb * MB if event.upload_memory_budget_mb else None)
+
+
+def report_skipped_uploads(results: ty.List[UploadResult]) -> None:
+    """
+    Display, for each destination, the files and bytes that were not uploaded because they were already there.
+    """
+    for destination in dict.fromkeys(result.destination for result in results):
+        skipped_results = [result for result in results if result.destination == destination and result.skipped]
+        if skipped_results:
+            skipped_mb = sum(result.size_bytes for result in skipped_results) / MB
+            typer.echo(f"{len(skipped_results)} file(s) already on {destination}, {skipped_mb:.0f} Mb not uploaded again")
+
+
+def report_renditions(results: ty.List[UploadResult]) -> None:
+    """
+    Display, for each destination receiving renditions, the bytes not uploaded thanks to them.
+    """
+    for destination in dict.fromkeys(result.destination for result in results if result.rendition_size_bytes is not None):
+        uploaded_results = [result for result in results if result.destination == destination and result.rendition_size_bytes is not None and not result.skipped]
+        if uploaded_results:
+            original_mb = sum(result.size_bytes for result in uploaded_results) / MB
+            rendition_mb = sum(result.rendition_size_bytes for result in uploaded_results) / MB
+            typer.echo(f"{len(uploaded_results)} rendition(s) uploaded to {destination} : {rendition_mb:.0f} Mb instead of {original_mb:.0f} Mb, {original_mb - rendition_mb:.0f} Mb saved")
+
+
+def report_upload_errors(results: ty.List[UploadResult]) -> None:
+    """
+    Display every failed upload, then raise an error if there was at least one.
+    """
+    failed_results = [result for result in results if result.error is not None]
+    for result in failed_results:
+        typer.echo(f"Failed to upload {result.video_name} to {result.destination}: {result.error}")
+    if failed_results:
+        raise ValueError(f"{len(failed_results)} upload(s) failed out of {len(results)}")
@@ -0,0 +1,53 @@
+from importlib import import_module
+from types import ModuleType
+import typing as ty
+
+# Internal files
+from definitions import Event
+
+
+NEXTCLOUD_DESTINATION = "nextcloud"
+S3_DESTINATION = "S3"
+TELEGRAM_NOTIFIER = "telegram"
+
+# Optional integrations : name -> (module implementing it, settings of the Event enabling it, any of them).
+# A module is only imported when the event enables it, so an event without S3 never loads boto3.
+PLUGINS: ty.Dict[str, ty.Tuple[str, ty.List[str]]] = {
+    NEXTCLOUD_DESTINATION: ("nextcloud", ["nextcloud_upload"]),
+    S3_DESTINATION: ("s3", ["S3_upload"]),
+    TELEGRAM_NOTIFIER: ("telegram_bot", ["nextcloud_telegram_notification", "telegram_archive_notification", "telegram_failure_notification"]),
+}
+
+# Plugins providing an upload destination, with a create_destination(inputs_result) function and a warm_up(event) function
+# creating their client ahead of the first upload, in upload order
+DESTINATION_PLUGINS = [NEXTCLOUD_DESTINATION, S3_DESTINATION]
+
+
+def is_plugin_enabled(event: Event, name: str) -> bool:
+    _, event_settings = PLUGINS[name]
+    return any(getattr(event, event_setting) for event_setting in event_settings)
+
+
+def load_plugin(name: str) -> ModuleType:
+    """
+    Import the module of a plugin. Python keeps it in sys.modules, so it is only loaded once.
+    """
+    module_name, _ = PLUGINS[name]
+    return import_module(module_name)
+
+
+def load_enabled_destination_plugins(event: Event) -> ty.List[ModuleType]:
+    """
+    Return the modules of the destinations enabled by the event.
+    """
+    return [load_plugin(name) for name in DESTINATION_PLUGINS if is_plugin_enabled(event, name)]
+
+
+def warm_up_destination_plugins(events: ty.List[Event]) -> None:
+    """
+    Import the destinations enabled by any of the events and create their clients, so a long running process
+    (watch mode) starts each archive with them ready.
+    """
+    for event in events:
+        for plugin in load_enabled_destination_plugins(event):
+            plugin.warm_up(event)
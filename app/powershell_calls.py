@@ -1,4 +1,3 @@
-from datetime import datetime, timedelta
 import json
 import os
 import sys
@@ -6,68 +5,149 @@ import subprocess
 import typer
 import typing as ty
 
-from definitions import VideoBasicInfos, Inputs, PowershellCommandParameter
+from definitions import VideoBasicInfos, Inputs, PowershellCommandParameter, DeviceEvent, DeviceEventType
+from device import DeviceSession
+from device_protocol import read_device_events, video_from_listing
+from metrics import METRICS, Transfer
 
-from datetime import datetime, timedelta
-import pytz
 
+POWERSHELL_SCRIPT_PATH = "../timeframe_archivist.ps1"
 
-# TODO check if stdout can be parsed as JSON object, if not print error
 
-def call_powershell_script(day: str, event_start: str, event_stop: str, event_timezone: str, command: PowershellCommandParameter) -> str | None:
-    windows_destination_folder = os.getenv("WINDOWS_DESTINATION_FOLDER")
+def get_powershell_executable() -> str:
+    return os.getenv("POWERSHELL_EXECUTABLE") or "powershell.exe"
+
+
+def is_powershell_device_connected() -> bool:
+    """
+    Return True if the script finds a phone plugged in Windows, without listing it.
+    """
     try:
-        # Using subprocess.run to execute the command
-        result = subprocess.run(f"powershell.exe -ExecutionPolicy Bypass -File ../timeframe_archivist.ps1 -day {day} -event_start {event_start} -event_stop {event_stop} -event_timezone '{event_timezone}' -command {command.value} -files_destination_path '{windows_destination_folder}' ", shell=True, text=True, capture_output=True, check=True)
-        
-        stdout = result.stdout
-        # Printing the stderr of the command, if any
-        if result.stderr:
-            print("Standard Error:")
-            print(result.stderr)
-        return stdout
-    except subprocess.CalledProcessError as e:
-        # Handling errors that occur during the command execution
-        print("An error occurred while executing the shell command:", e.stderr)    
-    
-    
-def copy_videos_to_windows(inputs_result: Inputs):
-    # Copy files to computer
-    results_copy = call_powershell_script(inputs_result.day, inputs_result.event.event_start, inputs_result.event.event_stop, inputs_result.event.event_timezone, PowershellCommandParameter.COPY_FILES)
-    results_json = json.loads(results_copy)
-    if isinstance(results_json, str): # Thanks to https://stackoverflow.com/questions/25613565/python-json-loads-returning-string-instead-of-dictionary
-        results_json = json.loads(results_json)
-    if isinstance(results_json, dict) and "Error" in results_json:
-        raise ValueError(f'{results_json["Error"]}')
-    else:
-        typer.echo(f"Videos have been transferred to {os.getenv('WINDOWS_DESTINATION_FOLDER')} with success !")
-        
-        
-def check_available_videos(inputs_result: Inputs) -> ty.List[VideoBasicInfos]:
-    available_videos = call_powershell_script(inputs_result.day, inputs_result.event.event_start, inputs_result.event.event_stop, inputs_result.event.event_timezone, PowershellCommandParameter.LIST_VIDEOS)
-    available_videos_json = json.loads(available_videos)
-    if isinstance(available_videos_json, str): 
-        available_videos_json = json.loads(available_videos_json) # Thanks to https://stackoverflow.com/questions/25613565/python-json-loads-returning-string-instead-of-dictionary
-    if available_videos_json == []:
-        raise ValueError(f"No video found for the given parameters (Day: {inputs_result.day}, Start : {inputs_result.event.event_start} Stop : {inputs_result.event.event_stop} Timezone : {inputs_result.event.event_timezone})")
-    elif isinstance(available_videos_json, dict) and "Error" in available_videos_json:
-        raise ValueError(f'{available_videos_json["Error"]}')
-    else:
-        # Order videos by date created asc
-        sorted_videos = sorted(available_videos_json, key=lambda x: x['creation_date'])
+        result = subprocess.run([get_powershell_executable(), "-ExecutionPolicy", "Bypass", "-File", POWERSHELL_SCRIPT_PATH,
+                                 "-command", PowershellCommandParameter.CHECK_DEVICE.value],
+                                capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ValueError(f"Failed to look for the device: {e}")
+    return any(event.event == DeviceEventType.DONE for event in read_device_events(result.stdout.splitlines()))
+
+
+class PowershellDeviceSession(DeviceSession):
+    """
+    Device session backed by one long running timeframe_archivist.ps1 process.
+    The script finds the phone and lists the videos once, then waits for copy/delete requests
+    (one JSON object per line) on its stdin. Its stdout is read line by line, as the events of
+    device_protocol.py are written : each video is available as soon as it is copied.
+    """
+
+    def __init__(self, inputs_result: Inputs | None, date_range: ty.Tuple[str, str] | None = None):
+        super().__init__(inputs_result, date_range)
+        self.process: subprocess.Popen | None = None
+        self.events: ty.Iterator[DeviceEvent] | None = None
+        self.request_pending = False
+
+    def open(self) -> None:
+        windows_destination_folder = os.getenv("WINDOWS_DESTINATION_FOLDER")
+        # The script only returns the raw listing of the range, the event window is applied by list_videos
+        range_start, range_stop = self.listing_range()
+        self.process = subprocess.Popen([get_powershell_executable(), "-ExecutionPolicy", "Bypass", "-File", POWERSHELL_SCRIPT_PATH,
+                                         "-range_start", range_start,
+                                         "-range_stop", range_stop,
+                                         "-command", PowershellCommandParameter.SESSION.value,
+                                         "-files_destination_path", windows_destination_folder],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        self.events = read_device_events(self.process.stdout)
+
+    def close(self) -> None:
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self._send_request({"command": "exit"})
+                self.process.wait(timeout=30)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+
+    def _send_request(self, request: ty.Dict[str, ty.Any]) -> None:
+        # The events of an interrupted request (failed or not read until the end) are skipped first
+        while self.request_pending:
+            self._next_event()
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        self.request_pending = request["command"] != "exit"
+
+    def _next_event(self) -> DeviceEvent:
+        event = next(self.events, None)
+        if event is None:
+            self.request_pending = False
+            raise ValueError(f"The PowerShell session ended unexpectedly (exit code {self.process.wait()})")
+        if event.event == DeviceEventType.DONE:
+            self.request_pending = False
+        return event
+
+    def _request_events(self, request: ty.Dict[str, ty.Any]) -> ty.Iterator[DeviceEvent]:
+        """
+        Send a request and yield its events until the end of the request. An error event is raised.
+        """
+        self._send_request(request)
+        while self.request_pending:
+            event = self._next_event()
+            if event.event == DeviceEventType.ERROR:
+                raise ValueError(f"{event.message}")
+            if event.event != DeviceEventType.DONE:
+                yield event
+
+    def _enumerate_videos(self) -> ty.List[VideoBasicInfos]:
         video_basic_infos_list = []
-        for video in sorted_videos:
-            video_basic_infos_list.append(VideoBasicInfos(size_mb=video["size_mb"], creation_date=video["creation_date"], original_name=video["original_name"]))
-        return video_basic_infos_list
-    
-    
-def delete_videos(inputs_result: Inputs) -> None:
-    deletion_result = call_powershell_script(inputs_result.day, inputs_result.event.event_start, inputs_result.event.event_stop, inputs_result.event.event_timezone, PowershellCommandParameter.DELETE_FILES)
-    deletion_result_json = json.loads(deletion_result)
-    if isinstance(deletion_result_json, str):
-        deletion_result_json = json.loads(deletion_result_json) # Thanks to https://stackoverflow.com/questions/25613565/python-json-loads-returning-string-instead-of-dictionary
-    if isinstance(deletion_result_json, dict) and "Error" in deletion_result_json:
-        raise ValueError(f'{deletion_result_json["Error"]}')
-    else:
-        typer.echo(f"Files deleted with success")
-    
\ No newline at end of file
+        while True:
+            event = self._next_event()
+            if event.event == DeviceEventType.ERROR:
+                raise ValueError(f"{event.message}")
+            if event.event == DeviceEventType.LISTING_DONE:
+                return video_basic_infos_list
+            if event.event == DeviceEventType.LISTED:
+                video_basic_infos_list.append(video_from_listing(event.video))
+
+    def _copy_items(self, ids: ty.List[str]) -> ty.Iterator[str]:
+        transfer: Transfer | None = None
+        try:
+            for event in self._request_events({"command": PowershellCommandParameter.COPY_FILES.value, "ids": ids}):
+                name = self.manifest[event.id].original_name
+                if event.event == DeviceEventType.COPY_STARTED:
+                    typer.echo(f"Copying {name} ({round(event.size_bytes / (1024 * 1024))} Mb)...")
+                    transfer = Transfer(METRICS.progress, f"{name} ← device", event.size_bytes)
+                elif event.event == DeviceEventType.COPIED:
+                    # MTP gives no progress during the copy of a file, only its duration once done
+                    transfer.advance(event.size_bytes)
+                    transfer.finish()
+                    transfer = None
+                    METRICS.record("copy", event.seconds, event.size_bytes, name)
+                    typer.echo(f"{name} copied in {event.seconds:.0f}s ({event.size_bytes / (1024 * 1024) / max(event.seconds, 0.001):.1f} Mb/s)")
+                    yield event.id
+        finally:
+            if transfer is not None:
+                transfer.finish()
+
+    def _delete_items(self, ids: ty.List[str]) -> None:
+        for _ in self._request_events({"command": PowershellCommandParameter.DELETE_FILES.value, "ids": ids}):
+            pass
+
+
+def copy_videos_to_windows(device_session: DeviceSession, videos: ty.List[VideoBasicInfos]) -> ty.Iterator[VideoBasicInfos]:
+    # Copy files to computer, each one is yielded once copied
+    for video in device_session.copy_videos(videos):
+        typer.echo(f"Video {video.original_name} transferred to {os.getenv('WINDOWS_DESTINATION_FOLDER')} with success !")
+        yield video
+
+
+def check_available_videos(device_session: DeviceSession, inputs_result: Inputs) -> ty.List[VideoBasicInfos]:
+    available_videos = device_session.list_videos()
+    if available_videos == []:
+        raise ValueError(f"No video found for the given parameters (Day: {inputs_result.day}, Start : {inputs_result.event.event_start} Stop : {inputs_result.event.event_stop} Timezone : {inputs_result.event.event_timezone})")
+    # Order videos by date created asc, to the second (creation_date is rounded to the minute)
+    return sorted(available_videos, key=lambda x: x.creation_date_utc)
+
+
+def delete_videos(device_session: DeviceSession, videos: ty.List[VideoBasicInfos]) -> None:
+    device_session.delete_videos(videos)
+    typer.echo(f"Files deleted with success")
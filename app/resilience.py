@@ -0,0 +1,216 @@
+from functools import lru_cache
+import logging
+import os
+import random
+import threading
+import time
+import typing as ty
+from urllib.parse import urlparse
+
+import requests
+
+# Internal files
+from metrics import METRICS
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Answers of a server which is overloaded or unavailable for a moment
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Answers meaning the request was not processed, it can be sent again whatever its method
+REFUSED_STATUS_CODES = {429, 503}
+# Methods which have the same effect when sent twice, retried after any network error
+# (a second MKCOL answers 405 as the folder exists, which the callers accept)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "PROPFIND", "MKCOL"}
+
+
+class CircuitOpenError(ValueError):
+    """
+    A host failed too many times in a row, the requests to it are refused for a while.
+    """
+
+
+class RetryPolicy:
+    """
+    Timeouts of the network requests, and the attempts made before giving up on a request which failed on the network
+    or on a server error. The delay before each new attempt is drawn between 0 and an exponential backoff
+    (full jitter), so the workers hitting the same server don't retry all at once.
+    """
+
+    def __init__(self, connect_timeout_s: float = 10, read_timeout_s: float = 120, max_attempts: int = 5,
+                 backoff_base_s: float = 1, backoff_max_s: float = 30):
+        self.connect_timeout_s = connect_timeout_s
+        self.read_timeout_s = read_timeout_s
+        self.max_attempts = max_attempts
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+    @property
+    def timeout(self) -> ty.Tuple[float, float]:
+        return self.connect_timeout_s, self.read_timeout_s
+
+    def backoff_s(self, attempt: int) -> float:
+        """
+        Return the delay before the attempt following the given one (0 for the first).
+        """
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * 2 ** attempt))
+
+
+@lru_cache(maxsize=None)
+def get_retry_policy() -> RetryPolicy:
+    """
+    Return the policy of every destination, from the NETWORK_* env variables.
+    """
+    return RetryPolicy(connect_timeout_s=float(os.getenv("NETWORK_CONNECT_TIMEOUT_S") or 10),
+                       read_timeout_s=float(os.getenv("NETWORK_READ_TIMEOUT_S") or 120),
+                       max_attempts=int(os.getenv("NETWORK_MAX_ATTEMPTS") or 5),
+                       backoff_base_s=float(os.getenv("NETWORK_BACKOFF_BASE_S") or 1),
+                       backoff_max_s=float(os.getenv("NETWORK_BACKOFF_MAX_S") or 30))
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a host after failure_threshold failures in a row : they fail at once instead of
+    waiting for their timeouts and retries. After reset_s, one request is let through to probe the host,
+    its success closes the circuit again, its failure opens it for another reset_s.
+    """
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_s: float = 30):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_s = reset_s
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def check(self) -> None:
+        """
+        Raise an error if the circuit is open, or if another request is already probing the host.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining_s = self.opened_at + self.reset_s - time.monotonic()
+            if remaining_s > 0 or self.probing:
+                raise CircuitOpenError(f"{self.host} failed {self.failures} times in a row, no request is sent to it for {max(remaining_s, 0):.0f}s")
+            self.probing = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def release_probe(self) -> None:
+        """
+        Let another request probe the host, when a request stopped without an answer of the host (local error).
+        """
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self, destination: str | None = None) -> None:
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures < self.failure_threshold:
+                return
+            if self.opened_at is None:
+                LOGGER.warning(f"Circuit opened for {self.host} after {self.failures} failures in a row")
+                METRICS.increment("circuit_opened", destination)
+            self.opened_at = time.monotonic()
+
+
+CIRCUIT_BREAKERS: ty.Dict[str, CircuitBreaker] = {}
+CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """
+    Return the circuit breaker of the host of an URL, shared by all the requests of the process.
+    It opens after CIRCUIT_BREAKER_FAILURES failures in a row (5 by default), for CIRCUIT_BREAKER_RESET_S (30 by default).
+    """
+    host = urlparse(url).netloc or url
+    with CIRCUIT_BREAKERS_LOCK:
+        if host not in CIRCUIT_BREAKERS:
+            CIRCUIT_BREAKERS[host] = CircuitBreaker(host, failure_threshold=int(os.getenv("CIRCUIT_BREAKER_FAILURES") or 5),
+                                                    reset_s=float(os.getenv("CIRCUIT_BREAKER_RESET_S") or 30))
+        return CIRCUIT_BREAKERS[host]
+
+
+def record_retry(destination: str | None, description: str, reason: ty.Any, delay_s: float) -> None:
+    """
+    Count a new attempt of a request in the metrics of the run.
+    """
+    METRICS.increment("retry", destination)
+    LOGGER.info(f"{description} failed ({reason}), attempt again in {delay_s:.1f}s")
+
+
+def get_retry_after_s(response: requests.Response) -> float | None:
+    """
+    Return the delay asked by the Retry-After header of an answer, in seconds, if it gives one.
+    """
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def is_never_sent(error: requests.RequestException) -> bool:
+    """
+    Return True if the request failed before it could reach the server (connection refused or timed out).
+    """
+    return isinstance(error, requests.ConnectTimeout) or (isinstance(error, requests.ConnectionError) and "NewConnectionError" in repr(error))
+
+
+def send_request(session: requests.Session, method: str, url: str, destination: str | None = None,
+                 policy: RetryPolicy | None = None, **kwargs) -> requests.Response:
+    """
+    Send a request with the timeouts of the policy, through the circuit breaker of its host.
+    It is sent again after a jittered backoff when it failed on the network or got a server error, if it is safe to :
+    always when the server never received it or refused it (429, 503), otherwise only for idempotent methods.
+    A body given as a file is rewound before each attempt.
+    The answer of the last attempt is returned whatever its status, a network error is raised as a ValueError.
+    Any other error of the requests library (broken answer, too many redirects) counts as a failure of the host, without a new attempt.
+    """
+    policy = policy or get_retry_policy()
+    circuit_breaker = get_circuit_breaker(url)
+    kwargs.setdefault("timeout", policy.timeout)
+    body = kwargs.get("data")
+    body_position = body.tell() if hasattr(body, "seek") else None
+    description = f"{method} {url}"
+    attempt = 0
+    while True:
+        circuit_breaker.check()
+        if body_position is not None:
+            body.seek(body_position)
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            circuit_breaker.record_failure(destination)
+            if attempt + 1 == policy.max_attempts or not (method in IDEMPOTENT_METHODS or is_never_sent(e)):
+                raise ValueError(f"{description} failed after {attempt + 1} attempt(s): {e}")
+            delay_s = policy.backoff_s(attempt)
+            record_retry(destination, description, type(e).__name__, delay_s)
+        except requests.RequestException as e:
+            circuit_breaker.record_failure(destination)
+            raise ValueError(f"{description} failed: {e}")
+        except BaseException:
+            # The request may have been a probe of the host, another one has to be let through
+            circuit_breaker.release_probe()
+            raise
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                circuit_breaker.record_success()
+                return response
+            # A 429 only asks this client to slow down, the host is up
+            if response.status_code == 429:
+                circuit_breaker.record_success()
+            else:
+                circuit_breaker.record_failure(destination)
+            if attempt + 1 == policy.max_attempts or not (method in IDEMPOTENT_METHODS or response.status_code in REFUSED_STATUS_CODES):
+                return response
+            delay_s = get_retry_after_s(response) or policy.backoff_s(attempt)
+            record_retry(destination, description, response.status_code, delay_s)
+        time.sleep(delay_s)
+        attempt += 1
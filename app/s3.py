@@ -1,50 +1,239 @@
 import boto3
-from botocore.exceptions import NoCredentialsError
+from botocore.config import Config
+from botocore.exceptions import NoCredentialsError, ClientError
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import hashlib
+import io
+import json
 import os
-from mypy_boto3_s3 import S3Client
-from boto3.s3.transfer import S3UploadFailedError
-from definitions import Inputs, VideoInfosWrapper
+import threading
+from bandwidth import DestinationThrottle, UNLIMITED
+from checksums import FileDigester, file_digest, s3_multipart_etag, md5_base64, s3_etag_from_digests
+from definitions import Event, Inputs, VideoInfosWrapper, RemoteFile, FileDigests
+from pipeline import Destination, S3_DESTINATION
+from metrics import METRICS
+from resilience import get_circuit_breaker, get_retry_policy, record_retry, RETRYABLE_STATUS_CODES
+from staging import open_for_reading
+from tee import TeeSink
+from utils import get_state_path, file_fingerprint
 from botocore.exceptions import NoCredentialsError, EndpointConnectionError 
 import typer
 import typing as ty
 
+if ty.TYPE_CHECKING:
+    # Only needed by type checkers, it is slow to import
+    from mypy_boto3_s3 import S3Client
 
 
-def create_s3_client() -> S3Client:
+MB = 1024 * 1024
+MULTIPART_UPLOADS_STATE_FILE = "s3_multipart_uploads.json"
+# Errors of S3 asking to slow down, the request was not processed
+THROTTLING_ERROR_CODES = {"SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException"}
+
+
+class MultipartUploadsState:
+    """
+    Multipart uploads in progress, saved on disk after each finished part so an interrupted upload
+    can be resumed by the next run.
+    Uploads are keyed by bucket, key and file fingerprint : a different file with the same name starts a new upload.
+    """
+
+    def __init__(self, state_path: str):
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.uploads: ty.Dict[str, ty.Dict[str, ty.Any]] = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r") as file:
+                self.uploads = json.load(file)
+
+    @staticmethod
+    def upload_key(bucket: str, key: str, fingerprint: str) -> str:
+        return f"{bucket}/{key}/{fingerprint}"
+
+    def get(self, upload_key: str) -> ty.Dict[str, ty.Any] | None:
+        with self.lock:
+            return self.uploads.get(upload_key)
+
+    def start(self, upload_key: str, bucket: str, key: str, upload_id: str, part_size: int) -> None:
+        with self.lock:
+            self.uploads[upload_key] = {"bucket": bucket, "key": key, "upload_id": upload_id, "part_size": part_size, "parts": {}}
+            self._save()
+
+    def add_part(self, upload_key: str, part_number: int, etag: str) -> None:
+        with self.lock:
+            self.uploads[upload_key]["parts"][str(part_number)] = etag
+            self._save()
+
+    def remove(self, upload_key: str) -> None:
+        with self.lock:
+            self.uploads.pop(upload_key, None)
+            self._save()
+
+    def remove_upload_id(self, upload_id: str) -> None:
+        with self.lock:
+            self.uploads = {upload_key: upload for upload_key, upload in self.uploads.items() if upload["upload_id"] != upload_id}
+            self._save()
+
+    def _save(self) -> None:
+        # Write in a temporary file first, so a crash while saving can't corrupt the state
+        temporary_path = f"{self.state_path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.uploads, file)
+        os.replace(temporary_path, self.state_path)
+
+
+@lru_cache(maxsize=None)
+def get_multipart_uploads_state() -> MultipartUploadsState:
+    return MultipartUploadsState(get_state_path(MULTIPART_UPLOADS_STATE_FILE))
+
+
+def create_s3_client(max_pool_connections: int = 10) -> "S3Client":
     """
     Create an S3 client using explicit credentials.
+    Its requests follow the timeouts, retries and circuit breakers of resilience.py, instead of the retries of botocore.
     """
-    return boto3.client(
+    policy = get_retry_policy()
+    s3_client = boto3.client(
         's3',
         aws_access_key_id=os.getenv("AWS_KEY_ID"),
         aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
-        region_name=os.getenv("AWS_REGION")
+        region_name=os.getenv("AWS_REGION"),
+        endpoint_url=os.getenv("AWS_ENDPOINT_URL") or None,
+        config=Config(max_pool_connections=max_pool_connections, connect_timeout=policy.connect_timeout_s, read_timeout=policy.read_timeout_s,
+                      # The standard retries of botocore only decide not to retry, get_retry_delay decides instead
+                      retries={"mode": "standard", "total_max_attempts": 1})
     )
+    s3_client.meta.events.register("before-send.s3", check_circuit_breaker)
+    s3_client.meta.events.register("needs-retry.s3", get_retry_delay)
+    return s3_client
+
+
+def check_circuit_breaker(request: ty.Any, **kwargs) -> None:
+    """
+    Refuse to send a request while the circuit breaker of its host is open (botocore before-send event).
+    """
+    get_circuit_breaker(request.url).check()
+
+
+def get_retry_delay(response: ty.Any, attempts: int, caught_exception: Exception | None, operation: ty.Any, request_dict: ty.Dict[str, ty.Any], **kwargs) -> float | None:
+    """
+    Return the delay before sending a request again, or None if it has to fail (botocore needs-retry event).
+    Like for the other destinations, a request failed on the network or on a server error is retried, which is safe
+    for every S3 operation used : a CreateMultipartUpload sent twice only leaves an empty upload, aborted by s3_cleanup.py.
+    """
+    policy = get_retry_policy()
+    circuit_breaker = get_circuit_breaker(request_dict["url"])
+    status_code = response[0].status_code if response else None
+    error_code = response[1].get("Error", {}).get("Code") if response else None
+    throttled = status_code == 429 or error_code in THROTTLING_ERROR_CODES
+    if caught_exception is None and status_code not in RETRYABLE_STATUS_CODES and not throttled:
+        circuit_breaker.record_success()
+        return None
+    # S3 is up when it asks to slow down
+    if throttled:
+        circuit_breaker.record_success()
+    else:
+        circuit_breaker.record_failure(S3_DESTINATION)
+    if attempts >= policy.max_attempts:
+        return None
+    delay_s = policy.backoff_s(attempts - 1)
+    record_retry(S3_DESTINATION, f"S3 {operation.name}", caught_exception or error_code or status_code, delay_s)
+    return delay_s
+
+
+@lru_cache(maxsize=None)
+def get_s3_client(max_pool_connections: int = 10) -> "S3Client":
+    """
+    Return the S3 client shared by the whole run (boto3 clients are thread safe), creating it on first use.
+    """
+    return create_s3_client(max_pool_connections)
+
+
+def get_event_s3_client(event: Event) -> "S3Client":
+    """
+    Return the shared S3 client, with enough pooled connections for all the parts uploaded at the same time.
+    """
+    return get_s3_client(event.S3_max_concurrency * event.S3_upload_workers)
     
     
-def upload_videos_to_s3(inputs: Inputs, videos_with_wrapped_data: ty.List[VideoInfosWrapper]) -> None:
-    
-    for video in videos_with_wrapped_data:
-        upload_file_to_s3(inputs, video.new_name, video.wsl_full_path)
-        
-        
+def get_s3_key(event: Event, video_name: str) -> str:
+    """
+    Return the key of a video in the bucket of the event.
+    """
+    if event.S3_folder:
+        return f"{event.S3_folder}/{video_name}"
+    return video_name
+
+
+def list_s3_files(event: Event) -> ty.Dict[str, RemoteFile]:
+    """
+    Return the files already present in the S3 folder of the event, by name.
+    """
+    s3_client = get_event_s3_client(event)
+    prefix = f"{event.S3_folder}/" if event.S3_folder else ""
+    remote_files = {}
+    try:
+        for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=event.S3_bucket, Prefix=prefix, Delimiter="/"):
+            for s3_object in page.get("Contents", []):
+                name = s3_object["Key"][len(prefix):]
+                remote_files[name] = RemoteFile(name=name, size_bytes=s3_object["Size"], checksum=s3_object["ETag"].strip('"'))
+    except ClientError as e:
+        raise ValueError(f"Failed to list the files of {event.S3_bucket}/{prefix}: {e}")
+    return remote_files
+
+
+def is_same_s3_file(event: Event, file_path: str, remote_file: RemoteFile, digests: FileDigests | None = None) -> bool:
+    """
+    Compare a local file with a file present on S3 : the sizes have to be equal, and the ETags too when it can be computed locally
+    (ETag of a simple upload, or of a multipart upload done with the part size of the event).
+    The digests of the file are used when given, instead of reading it again.
+    """
+    size_bytes = digests.size_bytes if digests else os.path.getsize(file_path)
+    if size_bytes != remote_file.size_bytes:
+        return False
+    if not remote_file.checksum:
+        return True
+    if "-" not in remote_file.checksum:
+        local_etag = digests.md5 if digests else file_digest(file_path, "md5")
+        return local_etag == remote_file.checksum
+    part_size = event.S3_multipart_chunksize_mb * MB
+    parts_count = int(remote_file.checksum.split("-")[1])
+    if parts_count != -(-remote_file.size_bytes // part_size):
+        # Uploaded with another part size, the ETag can't be computed
+        return True
+    if digests and digests.s3_part_size == part_size:
+        return s3_etag_from_digests(digests, multipart=True) == remote_file.checksum
+    return s3_multipart_etag(file_path, part_size) == remote_file.checksum
+
 
-def upload_file_to_s3(inputs: Inputs, video_name: str, video_wsl_path: str):
+def upload_file_to_s3(inputs: Inputs, video_name: str, video_wsl_path: str, digests: FileDigests | None = None,
+                      throttle: DestinationThrottle = UNLIMITED) -> str:
     """
-    Upload a file to an S3 bucket in the choosen storage class.
+    Upload a file to an S3 bucket in the choosen storage class : in one request below S3_multipart_threshold_mb,
+    otherwise with a resumable multipart upload (parts of S3_multipart_chunksize_mb, S3_max_concurrency at the same time).
+    When the digests of the file are given, they are sent as Content-MD5 so S3 checks the integrity of what it receives.
+    The file is sent at the rate allowed by the throttle.
+    It return the key of the uploaded object.
     """
     
-    # Create an S3 client
-    s3_client: S3Client = create_s3_client()
-    if inputs.event.S3_folder:
-        full_path: str = f"{inputs.event.S3_folder}/{video_name}"
-    else:
-        full_path = video_name
+    s3_client: "S3Client" = get_event_s3_client(inputs.event)
+    full_path: str = get_s3_key(inputs.event, video_name)
+    transfer = METRICS.current_transfer()
             
     try:
         # Upload the file
-        s3_client.upload_file(video_wsl_path, inputs.event.S3_bucket, full_path, ExtraArgs={'StorageClass': inputs.event.S3_storage_class})  # type: ignore
+        size_bytes = os.path.getsize(video_wsl_path)
+        if size_bytes >= inputs.event.S3_multipart_threshold_mb * MB:
+            resumable_multipart_upload(s3_client, inputs.event, video_wsl_path, full_path, digests, throttle)
+        else:
+            checksum_args = {"ContentMD5": md5_base64(digests.md5)} if digests else {}
+            with open_for_reading(video_wsl_path) as file_data:
+                s3_client.put_object(Bucket=inputs.event.S3_bucket, Key=full_path, Body=throttle.wrap(file_data), StorageClass=inputs.event.S3_storage_class, **checksum_args)  # type: ignore
+            transfer.advance(size_bytes)
         typer.echo(f"File {video_name} uploaded to S3 {inputs.event.S3_storage_class} successfully")
+        return full_path
         
     except FileNotFoundError:
         raise ValueError("File not found")
@@ -52,8 +241,223 @@ def upload_file_to_s3(inputs: Inputs, video_name: str, video_wsl_path: str):
         raise ValueError("Credentials not available")
     except EndpointConnectionError:
         raise ValueError(f"Error while connecting to the provided aws enpoint {os.getenv('AWS_REGION')}, check your AWS region")
-    except S3UploadFailedError as e:
-        if "Check your key and signing method" in str(e):
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "SignatureDoesNotMatch":
             raise ValueError(f"Error while using aws credientials, check your AWS Secret key")
-        else: 
-            raise ValueError(f"{e}")
\ No newline at end of file
+        raise ValueError(f"Failed to upload {video_name} to S3: {e}")
+
+
+def resumable_multipart_upload(s3_client: "S3Client", event: Event, file_path: str, key: str, digests: FileDigests | None = None,
+                               throttle: DestinationThrottle = UNLIMITED) -> None:
+    """
+    Upload a file in several parts, resuming the multipart upload started by a previous run for the same file if there is one :
+    the parts already present on S3 are listed and only the missing ones are sent.
+    Each part is sent with its Content-MD5 when the digests have been computed with the same part size.
+    A part is only read once it fits in the memory budget of the throttle.
+    """
+    state = get_multipart_uploads_state()
+    upload_key = state.upload_key(event.S3_bucket, key, file_fingerprint(file_path))
+    upload = state.get(upload_key)
+    uploaded_parts: ty.Dict[int, str] = {}
+    if upload:
+        try:
+            uploaded_parts = list_uploaded_parts(s3_client, event.S3_bucket, key, upload["upload_id"])
+            typer.echo(f"Resuming the upload of {key} ({len(uploaded_parts)} part(s) already on S3)")
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+            # The upload has been aborted or completed in the meantime
+            upload = None
+    if not upload:
+        part_size = event.S3_multipart_chunksize_mb * MB
+        response = s3_client.create_multipart_upload(Bucket=event.S3_bucket, Key=key, StorageClass=event.S3_storage_class)  # type: ignore
+        state.start(upload_key, event.S3_bucket, key, response["UploadId"], part_size)
+        upload = state.get(upload_key)
+
+    upload_id = upload["upload_id"]
+    part_size = upload["part_size"]
+    file_size = os.path.getsize(file_path)
+    parts_count = max(1, -(-file_size // part_size))
+    part_md5s = digests.s3_part_md5s if digests and digests.s3_part_size == part_size else None
+    # The parts are sent by other threads
+    transfer = METRICS.current_transfer()
+
+    def upload_part(part_number: int) -> None:
+        with throttle.reserve_memory(min(part_size, file_size - (part_number - 1) * part_size)):
+            with open(file_path, "rb") as file:
+                file.seek((part_number - 1) * part_size)
+                data = file.read(part_size)
+            checksum_args = {"ContentMD5": md5_base64(part_md5s[part_number - 1])} if part_md5s else {}
+            response = s3_client.upload_part(Bucket=event.S3_bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+                                             Body=throttle.wrap(io.BytesIO(data)), **checksum_args)
+        uploaded_parts[part_number] = response["ETag"]
+        state.add_part(upload_key, part_number, response["ETag"])
+        transfer.advance(len(data))
+
+    missing_parts = [part_number for part_number in range(1, parts_count + 1) if part_number not in uploaded_parts]
+    transfer.advance(file_size - sum(min(part_size, file_size - (part_number - 1) * part_size) for part_number in missing_parts))
+    with ThreadPoolExecutor(max_workers=event.S3_max_concurrency) as executor:
+        # list() raises the first error of the parts, if any
+        list(executor.map(upload_part, missing_parts))
+
+    s3_client.complete_multipart_upload(Bucket=event.S3_bucket, Key=key, UploadId=upload_id,
+                                        MultipartUpload={"Parts": [{"PartNumber": part_number, "ETag": uploaded_parts[part_number]} for part_number in range(1, parts_count + 1)]})
+    state.remove(upload_key)
+
+
+def list_uploaded_parts(s3_client: "S3Client", bucket: str, key: str, upload_id: str) -> ty.Dict[int, str]:
+    """
+    Return the ETag of every part already uploaded for a multipart upload, by part number.
+    """
+    parts = {}
+    for page in s3_client.get_paginator("list_parts").paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            parts[part["PartNumber"]] = part["ETag"]
+    return parts
+
+
+def abort_stale_multipart_uploads(bucket: str, older_than: timedelta) -> ty.List[str]:
+    """
+    Abort the multipart uploads of the bucket started before older_than, so their parts stop being billed.
+    It return the keys of the aborted uploads.
+    """
+    s3_client = get_s3_client()
+    state = get_multipart_uploads_state()
+    limit = datetime.now(timezone.utc) - older_than
+    aborted_keys = []
+    try:
+        for page in s3_client.get_paginator("list_multipart_uploads").paginate(Bucket=bucket):
+            for upload in page.get("Uploads", []):
+                if upload["Initiated"] < limit:
+                    s3_client.abort_multipart_upload(Bucket=bucket, Key=upload["Key"], UploadId=upload["UploadId"])
+                    state.remove_upload_id(upload["UploadId"])
+                    aborted_keys.append(upload["Key"])
+    except ClientError as e:
+        raise ValueError(f"Failed to abort the multipart uploads of {bucket}: {e}")
+    return aborted_keys
+
+
+class S3StreamSink(TeeSink):
+    """
+    Upload a file to S3 while it is read : the blocks are gathered into parts of S3_multipart_chunksize_mb,
+    and each part is sent with its Content-MD5 as soon as it is full, with up to S3_max_concurrency parts
+    in flight (the reading waits beyond that, and for the memory budget of the throttle).
+    A file smaller than one part is sent with one put_object.
+    When the digester hashing the file in the same tee uses the same part size, the Content-MD5 of each part
+    is taken from it instead of being computed again.
+    Unlike upload_file_to_s3, a streamed upload is not resumed by the next run.
+    """
+
+    def __init__(self, inputs: Inputs, video_name: str, throttle: DestinationThrottle = UNLIMITED, digester: FileDigester | None = None):
+        self.inputs = inputs
+        self.event = inputs.event
+        self.video_name = video_name
+        self.throttle = throttle
+        self.s3_client = get_event_s3_client(inputs.event)
+        self.key = get_s3_key(inputs.event, video_name)
+        self.part_size = inputs.event.S3_multipart_chunksize_mb * MB
+        self.digester = digester if digester is not None and digester.s3_part_size == self.part_size else None
+        self.buffer = bytearray()
+        self.upload_id: str | None = None
+        self.part_futures: ty.List[Future] = []
+        self.parts_in_flight = threading.BoundedSemaphore(inputs.event.S3_max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=inputs.event.S3_max_concurrency, thread_name_prefix="s3-stream")
+
+    def write(self, block: bytes) -> None:
+        self.buffer += block
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._send_part(part)
+
+    def _send_part(self, part: bytes) -> None:
+        for future in self.part_futures:
+            # Stop at the first failed part
+            if future.done() and future.exception():
+                raise future.exception()
+        try:
+            if self.upload_id is None:
+                self.upload_id = self.s3_client.create_multipart_upload(Bucket=self.event.S3_bucket, Key=self.key, StorageClass=self.event.S3_storage_class)["UploadId"]  # type: ignore
+        except ClientError as e:
+            raise ValueError(f"Failed to upload {self.video_name} to S3: {e}")
+        self.parts_in_flight.acquire()
+        self.throttle.acquire_memory(len(part))
+        future = self.executor.submit(self._upload_part, len(self.part_futures) + 1, part)
+        future.add_done_callback(lambda _: (self.throttle.release_memory(len(part)), self.parts_in_flight.release()))
+        self.part_futures.append(future)
+
+    def _part_md5(self, part_number: int, data: bytes) -> str:
+        if self.digester is None:
+            return hashlib.md5(data).hexdigest()
+        return self.digester.wait_part_md5(part_number)
+
+    def _upload_part(self, part_number: int, data: bytes) -> ty.Dict[str, ty.Any]:
+        try:
+            response = self.s3_client.upload_part(Bucket=self.event.S3_bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number,
+                                                  Body=self.throttle.wrap(io.BytesIO(data)), ContentMD5=md5_base64(self._part_md5(part_number, data)))
+        except ClientError as e:
+            raise ValueError(f"Failed to upload part {part_number} of {self.video_name} to S3: {e}")
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def close(self) -> str:
+        try:
+            if self.upload_id is None:
+                data = bytes(self.buffer)
+                self.s3_client.put_object(Bucket=self.event.S3_bucket, Key=self.key, Body=self.throttle.wrap(io.BytesIO(data)), ContentMD5=md5_base64(self._part_md5(1, data)),
+                                          StorageClass=self.event.S3_storage_class)  # type: ignore
+            else:
+                if self.buffer:
+                    self._send_part(bytes(self.buffer))
+                parts = [future.result() for future in self.part_futures]
+                self.s3_client.complete_multipart_upload(Bucket=self.event.S3_bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts})
+        except ClientError as e:
+            self.abort()
+            raise ValueError(f"Failed to upload {self.video_name} to S3: {e}")
+        except ValueError:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=True)
+        typer.echo(f"File {self.video_name} uploaded to S3 {self.event.S3_storage_class} successfully")
+        return self.key
+
+    def abort(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.upload_id is not None:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.event.S3_bucket, Key=self.key, UploadId=self.upload_id)
+            except ClientError:
+                pass # The upload will be removed by s3_cleanup.py
+            self.upload_id = None
+
+
+class S3Destination(Destination):
+
+    name = S3_DESTINATION
+
+    @property
+    def workers(self) -> int:
+        return self.inputs_result.event.S3_upload_workers
+
+    def upload(self, video: VideoInfosWrapper) -> str:
+        return upload_file_to_s3(self.inputs_result, video.new_name, video.wsl_full_path, video.digests, self.throttle)
+
+    def location(self, video: VideoInfosWrapper) -> str:
+        return get_s3_key(self.inputs_result.event, video.new_name)
+
+    def list_remote_files(self) -> ty.Dict[str, RemoteFile]:
+        return list_s3_files(self.inputs_result.event)
+
+    def is_same_file(self, video: VideoInfosWrapper, remote_file: RemoteFile) -> bool:
+        return is_same_s3_file(self.inputs_result.event, video.wsl_full_path, remote_file, video.digests)
+
+    def open_stream(self, video: VideoInfosWrapper, size_bytes: int, digester: FileDigester) -> TeeSink | None:
+        return S3StreamSink(self.inputs_result, video.new_name, self.throttle, digester)
+
+
+def create_destination(inputs_result: Inputs) -> Destination:
+    return S3Destination(inputs_result)
+
+
+def warm_up(event: Event) -> None:
+    get_event_s3_client(event)
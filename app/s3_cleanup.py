@@ -0,0 +1,42 @@
+from datetime import timedelta
+from dotenv import load_dotenv
+from pathlib import Path
+from rich.console import Console
+import typer
+import typing as ty
+
+# Internal files
+from inputs import yaml_data_to_events
+from s3 import abort_stale_multipart_uploads
+
+# Load environment variables from the .env file
+load_dotenv(override=True) # Erase WSL2 env variable that were conflicting
+
+EVENTS_YAML_PATH = Path("../events.yml")
+
+
+def main(
+    bucket: ty.Optional[str] = typer.Option(None, help="Bucket to clean, all the S3 buckets of events.yml by default"),
+    older_than_hours: int = typer.Option(24, help="Abort the multipart uploads started more than this number of hours ago"),
+) -> None:
+    """
+    Abort the unfinished S3 multipart uploads, which keep costing storage until they are completed or aborted.
+    """
+    console = Console()
+    try:
+        if bucket:
+            buckets = [bucket]
+        else:
+            buckets = sorted({event.S3_bucket for event in yaml_data_to_events(EVENTS_YAML_PATH) if event.S3_upload})
+        for bucket_to_clean in buckets:
+            aborted_keys = abort_stale_multipart_uploads(bucket_to_clean, timedelta(hours=older_than_hours))
+            typer.echo(f"{len(aborted_keys)} stale multipart upload(s) aborted in {bucket_to_clean}")
+            for key in aborted_keys:
+                typer.echo(f"  - {key}")
+    except ValueError as e:
+        console.print(f"Exiting due to an error: {e}", style="bold red")
+        exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
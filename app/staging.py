@@ -0,0 +1,136 @@
+import hashlib
+import os
+import threading
+import typing as ty
+
+# Internal files
+from kernel_copy import copy_file
+
+
+MB = 1024 * 1024
+
+# Files under /mnt/<drive> are read through the 9P file system of WSL2, slow with small reads : every read of a
+# video asks for blocks of IO_BLOCK_SIZE_MB (8 by default), whatever the size the caller (requests, boto3...) reads.
+DEFAULT_IO_BLOCK_SIZE_MB = 8
+
+
+def get_io_block_size() -> int:
+    """
+    Return the size of the blocks read from the video files, from the IO_BLOCK_SIZE_MB env variable.
+    """
+    return int(os.getenv("IO_BLOCK_SIZE_MB") or DEFAULT_IO_BLOCK_SIZE_MB) * MB
+
+
+def open_for_reading(file_path: str) -> ty.BinaryIO:
+    """
+    Open a video to read it : the small reads of the caller are served from a buffer filled by big blocks.
+    """
+    return open(file_path, 'rb', buffering=get_io_block_size())
+
+
+class StagingArea:
+    """
+    Cache of the videos on the native Linux file system, in front of the Windows destination folder.
+    A video is read once from /mnt/<drive> by big blocks, then all the reads of the uploads (digests, parts,
+    chunks, retries) use the staged copy. The folder is bounded to max_size bytes : the least recently used
+    videos are evicted first, except the ones still in use (staged and not released yet).
+    The videos are still copied and renamed in the Windows destination folder.
+    """
+
+    def __init__(self, folder: str, max_size: int):
+        self.folder = folder
+        self.max_size = max_size
+        # Only held for the bookkeeping, the copies are made outside of it so several videos can be staged at once
+        self.lock = threading.Lock()
+        self.in_use: ty.Set[str] = set()
+        # Copies in progress, set once done, and the size they reserved in the folder
+        self.copying: ty.Dict[str, threading.Event] = {}
+        self.reserved_size = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def staged_path(self, file_path: str, name: str) -> str:
+        """
+        Return the path of the staged copy of a file. It depends on the size and modification time of the file,
+        so a staged copy is never used for another version of it.
+        """
+        stat = os.stat(file_path)
+        key = hashlib.sha256(f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+        return os.path.join(self.folder, f"{key}-{name}")
+
+    def stage(self, file_path: str, name: str) -> str:
+        """
+        Copy a file in the staging area if it is not there yet, and return the path to read it from.
+        A file bigger than the whole staging area is read directly.
+        """
+        size = os.path.getsize(file_path)
+        if size > self.max_size:
+            return file_path
+        staged_path = self.staged_path(file_path, name)
+        with self.lock:
+            self.in_use.add(staged_path)
+            copying = self.copying.get(staged_path)
+            if copying is None:
+                if os.path.exists(staged_path):
+                    # Marks the copy as recently used
+                    os.utime(staged_path)
+                    return staged_path
+                self.evict(size)
+                self.copying[staged_path] = threading.Event()
+                self.reserved_size += size
+        if copying is not None:
+            # The same file is being staged by another thread
+            copying.wait()
+            if not os.path.exists(staged_path):
+                raise ValueError(f"Failed to stage {file_path}")
+            return staged_path
+
+        partial_path = f"{staged_path}.part"
+        try:
+            copy_file(file_path, partial_path)
+            os.replace(partial_path, staged_path)
+            # copy_file keeps the modification time of the source, it is used here as the last use time
+            os.utime(staged_path)
+        except OSError:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            with self.lock:
+                self.in_use.discard(staged_path)
+            raise
+        finally:
+            with self.lock:
+                self.reserved_size -= size
+                self.copying.pop(staged_path).set()
+        return staged_path
+
+    def release(self, staged_path: str) -> None:
+        """
+        Allow the eviction of a staged copy, once every upload reading it is done.
+        """
+        with self.lock:
+            self.in_use.discard(staged_path)
+
+    def evict(self, needed_size: int) -> None:
+        """
+        Remove the least recently used copies until needed_size bytes fit under max_size, with the size reserved by
+        the copies in progress. Called with the lock held.
+        """
+        entries = [entry for entry in os.scandir(self.folder) if entry.is_file() and not entry.name.endswith(".part")]
+        used_size = self.reserved_size + sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            if used_size + needed_size <= self.max_size:
+                break
+            if entry.path in self.in_use:
+                continue
+            used_size -= entry.stat().st_size
+            os.remove(entry.path)
+
+
+def get_staging_area() -> StagingArea | None:
+    """
+    Return the staging area of the STAGING_FOLDER env variable, bounded to STAGING_MAX_SIZE_GB (20 by default).
+    None when STAGING_FOLDER is not set : the videos are read from the destination folder.
+    """
+    folder = os.getenv("STAGING_FOLDER")
+    if not folder:
+        return None
+    return StagingArea(folder, int(float(os.getenv("STAGING_MAX_SIZE_GB") or 20) * 1024 * MB))
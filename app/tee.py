@@ -0,0 +1,154 @@
+from abc import ABC, abstractmethod
+import os
+import queue
+import threading
+import typing as ty
+
+# Internal files
+from checksums import FileDigester
+
+
+# Put in the queue of a sink once the source has been entirely read, or when the reading failed
+END_OF_STREAM = None
+READ_FAILED = object()
+
+
+class TeeSink(ABC):
+    """
+    Receives the blocks of a file read once by tee_file, in order, from its own thread.
+    """
+
+    @abstractmethod
+    def write(self, block: bytes) -> None:
+        ...
+
+    @abstractmethod
+    def close(self) -> ty.Any:
+        """
+        Finish the transfer once every block has been written, and return its result.
+        """
+
+    def abort(self) -> None:
+        """
+        Called instead of close when the source could not be read entirely, or after a failed write. Nothing to do by default.
+        """
+
+
+class FileSink(TeeSink):
+    """
+    Write the blocks to a local file. The file is written under a temporary name and only appears
+    at its path once complete.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.partial_path = f"{path}.part"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(self.partial_path, 'wb')
+
+    def write(self, block: bytes) -> None:
+        self.file.write(block)
+
+    def close(self) -> str:
+        self.file.close()
+        os.replace(self.partial_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        self.file.close()
+        os.remove(self.partial_path)
+
+
+class DigestSink(TeeSink):
+    """
+    Compute the digests of the file (see checksums.FileDigester). The other sinks can wait on its digester
+    for the digests they send, instead of hashing the blocks again.
+    """
+
+    def __init__(self, s3_part_size: int | None = None):
+        self.digester = FileDigester(s3_part_size)
+
+    def write(self, block: bytes) -> None:
+        self.digester.update(block)
+
+    def close(self) -> ty.Any:
+        return self.digester.digests()
+
+    def abort(self) -> None:
+        self.digester.abort()
+
+
+class ProgressSink(TeeSink):
+    """
+    Report the blocks read to the progress of a transfer (see metrics.Transfer).
+    """
+
+    def __init__(self, transfer: ty.Any):
+        self.transfer = transfer
+
+    def write(self, block: bytes) -> None:
+        self.transfer.advance(len(block))
+
+    def close(self) -> None:
+        return None
+
+
+def _run_sink(sink: TeeSink, blocks: queue.Queue, outcome: ty.Dict[str, ty.Any]) -> None:
+    """
+    Write the blocks of the queue to the sink until the end of the stream. After an error, the next blocks
+    are still taken from the queue (and dropped) so the reader is never blocked by a failed sink.
+    """
+    failed = False
+    while True:
+        block = blocks.get()
+        if block is END_OF_STREAM or block is READ_FAILED:
+            break
+        if failed:
+            continue
+        try:
+            sink.write(block)
+        except Exception as e:
+            outcome["error"] = e
+            failed = True
+    if failed or block is READ_FAILED:
+        try:
+            sink.abort()
+        except Exception:
+            pass # The error of the write, or of the reading, is the one reported
+        return
+    try:
+        outcome["result"] = sink.close()
+    except Exception as e:
+        outcome["error"] = e
+
+
+def tee_file(source_path: str, sinks: ty.List[TeeSink], block_size: int, buffered_blocks: int) -> ty.List[ty.Tuple[ty.Any, Exception | None]]:
+    """
+    Read a file once, in blocks of block_size, and give every block to all the sinks at the same time.
+    Each sink runs in its own thread behind a queue of at most buffered_blocks blocks : when a sink is slower
+    than the others, its queue fills up and the reading waits, so the memory used stays under
+    about block_size * (buffered_blocks + 1) * number of sinks.
+    It return, for each sink, its result and its error (None if it succeeded). An error while reading the source is raised.
+    """
+    queues = [queue.Queue(maxsize=buffered_blocks) for _ in sinks]
+    outcomes: ty.List[ty.Dict[str, ty.Any]] = [{} for _ in sinks]
+    threads = [threading.Thread(target=_run_sink, args=(sink, blocks, outcome), name="tee-sink", daemon=True)
+               for sink, blocks, outcome in zip(sinks, queues, outcomes)]
+    for thread in threads:
+        thread.start()
+
+    end_marker = END_OF_STREAM
+    try:
+        with open(source_path, 'rb') as source:
+            while block := source.read(block_size):
+                for blocks in queues:
+                    blocks.put(block)
+    except BaseException:
+        end_marker = READ_FAILED
+        raise
+    finally:
+        for blocks in queues:
+            blocks.put(end_marker)
+        for thread in threads:
+            thread.join()
+    return [(outcome.get("result"), outcome.get("error")) for outcome in outcomes]
@@ -1,18 +1,50 @@
+import asyncio
+from concurrent.futures import Future
+from datetime import timedelta
+import functools
+import logging
 import os
 import telegram
-from telegram.error import InvalidToken, BadRequest, Forbidden
+from telegram.error import InvalidToken, BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+import threading
+import time
 import typing as ty
 
-async def send_message_to_telegram_conversation(message: str) -> None:
+# Internal files
+from definitions import NotificationType
+from metrics import METRICS
+from plugins import TELEGRAM_NOTIFIER
+from resilience import RetryPolicy, get_circuit_breaker, get_retry_policy, record_retry
+
+
+LOGGER = logging.getLogger(__name__)
+# Longest text of a Telegram message, the longer ones are split
+MAX_MESSAGE_LENGTH = 4096
+
+
+def get_bot() -> telegram.Bot:
+    """
+    Return a telegram bot (specified in the env file), with the timeouts of resilience.py
+    """
+    policy = get_retry_policy()
+    request = HTTPXRequest(connect_timeout=policy.connect_timeout_s, read_timeout=policy.read_timeout_s, write_timeout=policy.read_timeout_s)
+    # TELEGRAM_API_URL is only set to use another Bot API server
+    try:
+        return telegram.Bot(os.getenv("TELEGRAM_BOT_TOKEN"), base_url=os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org/bot", request=request)
+    except InvalidToken:
+        raise ValueError("The bot token provided is invalid.")
+
+
+async def send_message_to_telegram_conversation(bot: telegram.Bot, chat_id: str, message: str) -> None:
     """
-    Send a message to a telegram conversation using a telegram bot (specified in the env file)
+    Send a message to a telegram conversation using the bot
     """
-    
     # Chat_id can be :  ID of the user (then the conversation will be betwen the user and the bot) - ID of a telegram chat (then the message will be send in a group)
-    chat_id = os.getenv("TELEGRAM_CHAT_ID") 
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    try: 
-        await telegram.Bot(bot_token).sendMessage(chat_id=chat_id, text=message)
+    try:
+        # Only done once for a bot, it then keeps its HTTP connections
+        await bot.initialize()
+        await bot.send_message(chat_id=chat_id, text=message)
     except InvalidToken:
         raise ValueError("The bot token provided is invalid.")
     except Forbidden as e:
@@ -23,6 +55,137 @@ async def send_message_to_telegram_conversation(message: str) -> None:
         else:
             raise ValueError(f"Bad request: {e}")
 
+
+class NotificationDispatcher:
+    """
+    Send the notifications of the runs (share links ready, videos archived on S3, failed archives) from a background thread,
+    so the upload workers only queue them and never wait for Telegram.
+    The notifications queued within coalesce_seconds of the first one are sent as a single message, two messages are
+    at least min_interval_seconds apart (Telegram allows about 20 messages per minute in a group), and a message refused
+    for flooding (429) is sent again after the delay given by Telegram. One bot, and its HTTP connections, is kept for all the messages.
+    The network errors are retried with the policy and the circuit breaker of resilience.py (a message whose answer was lost
+    can then be received twice).
+    """
+
+    def __init__(self, bot: telegram.Bot, chat_id: str, coalesce_seconds: float = 2, min_interval_seconds: float = 3, policy: RetryPolicy | None = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.coalesce_seconds = coalesce_seconds
+        self.min_interval_seconds = min_interval_seconds
+        self.policy = policy or get_retry_policy()
+        self.last_sent: float | None = None
+        self.ready = threading.Event()
+        self.closed = False
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.queue: "asyncio.Queue[ty.Tuple[NotificationType, str, Future] | None] | None" = None
+        self.thread = threading.Thread(target=asyncio.run, args=(self._dispatch(),), name="telegram", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def notify(self, notification_type: NotificationType, text: str) -> Future:
+        """
+        Queue a notification, from any thread. The returned future is done once it is sent, with a ValueError if it could not be.
+        """
+        future: Future = Future()
+        if self.closed:
+            future.set_exception(ValueError("The Telegram notifications are stopped"))
+        else:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (notification_type, text, future))
+        return future
+
+    def close(self) -> None:
+        """
+        Send the notifications already queued, then stop the thread.
+        """
+        if not self.closed:
+            self.closed = True
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+            self.thread.join()
+
+    async def _dispatch(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.ready.set()
+        stopped = False
+        while not stopped:
+            notification = await self.queue.get()
+            if notification is None:
+                break
+            batch = [notification]
+            deadline = self.loop.time() + self.coalesce_seconds
+            while (remaining_s := deadline - self.loop.time()) > 0:
+                try:
+                    notification = await asyncio.wait_for(self.queue.get(), remaining_s)
+                except asyncio.TimeoutError:
+                    break
+                if notification is None:
+                    stopped = True
+                    break
+                batch.append(notification)
+            await self._send_batch(batch)
+        await self.bot.shutdown()
+
+    async def _send_batch(self, batch: ty.List[ty.Tuple[NotificationType, str, Future]]) -> None:
+        try:
+            for message in format_notifications([(notification_type, text) for notification_type, text, _ in batch]):
+                await self._send(message)
+        except Exception as e:
+            LOGGER.warning(f"Failed to send the Telegram notification: {e}")
+            for _, _, future in batch:
+                future.set_exception(e if isinstance(e, ValueError) else ValueError(f"Failed to send the Telegram notification: {e}"))
+            return
+        for _, _, future in batch:
+            future.set_result(None)
+
+    async def _send(self, message: str) -> None:
+        """
+        Send one message, spaced from the previous one, and retry when Telegram asks to wait or the network fails.
+        """
+        circuit_breaker = get_circuit_breaker(self.bot.base_url)
+        for attempt in range(self.policy.max_attempts):
+            if self.last_sent is not None:
+                await asyncio.sleep(self.last_sent + self.min_interval_seconds - self.loop.time())
+            circuit_breaker.check()
+            start = time.perf_counter()
+            try:
+                await send_message_to_telegram_conversation(self.bot, self.chat_id, message)
+                circuit_breaker.record_success()
+                METRICS.record("notify", time.perf_counter() - start, destination=TELEGRAM_NOTIFIER)
+                return
+            except RetryAfter as e:
+                circuit_breaker.record_success()
+                delay_s = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                error = e
+            except NetworkError as e:
+                circuit_breaker.record_failure(TELEGRAM_NOTIFIER)
+                delay_s = self.policy.backoff_s(attempt)
+                error = e
+            finally:
+                self.last_sent = self.loop.time()
+            if attempt + 1 < self.policy.max_attempts:
+                record_retry(TELEGRAM_NOTIFIER, "Telegram message", error, delay_s)
+                await asyncio.sleep(delay_s)
+        raise ValueError(f"Telegram message not sent after {self.policy.max_attempts} attempts: {error}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_dispatcher() -> NotificationDispatcher:
+    """
+    Return the dispatcher of the notifications, created once for the process (its thread and bot are then reused by the next runs).
+    The messages are coalesced for TELEGRAM_COALESCE_SECONDS (2 by default) and spaced by TELEGRAM_MIN_INTERVAL_SECONDS (3 by default).
+    """
+    return NotificationDispatcher(get_bot(), os.getenv("TELEGRAM_CHAT_ID"),
+                                  coalesce_seconds=float(os.getenv("TELEGRAM_COALESCE_SECONDS") or 2),
+                                  min_interval_seconds=float(os.getenv("TELEGRAM_MIN_INTERVAL_SECONDS") or 3))
+
+
+def send_message(message: str) -> None:
+    """
+    Send a message to the telegram conversation, from synchronous code, and wait until it is sent
+    """
+    get_dispatcher().notify(NotificationType.MESSAGE, message).result()
+
+
 def format_links_message(messages: ty.List[str]) -> str:
     """
     Return a list of video links into one formated string
@@ -30,5 +193,29 @@ def format_links_message(messages: ty.List[str]) -> str:
     return_string = ""
     for message in messages:
         return_string = return_string + message + " "
-    
-    return return_string[:-1]
\ No newline at end of file
+
+    return return_string[:-1]
+
+
+def format_notifications(notifications: ty.List[ty.Tuple[NotificationType, str]]) -> ty.List[str]:
+    """
+    Return the messages sending coalesced notifications : one line per type, the share links on the same line,
+    split in several messages above the length allowed by Telegram.
+    """
+    lines = []
+    for notification_type in NotificationType:
+        texts = list(dict.fromkeys(text for text_type, text in notifications if text_type == notification_type))
+        if not texts:
+            continue
+        if notification_type == NotificationType.SHARE_READY:
+            lines.append(format_links_message(texts))
+        else:
+            lines.extend(texts)
+    messages = [""]
+    for line in lines:
+        for start in range(0, len(line), MAX_MESSAGE_LENGTH):
+            part = line[start:start + MAX_MESSAGE_LENGTH]
+            if messages[-1] and len(messages[-1]) + 1 + len(part) > MAX_MESSAGE_LENGTH:
+                messages.append("")
+            messages[-1] = f"{messages[-1]}\n{part}" if messages[-1] else part
+    return [message for message in messages if message]
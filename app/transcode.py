@@ -0,0 +1,69 @@
+import os
+import shutil
+import subprocess
+import time
+import typing as ty
+
+# Internal files
+from checksums import compute_file_digests
+from definitions import Rendition, RenditionSettings
+from utils import get_state_path
+
+
+def get_ffmpeg_executable() -> str:
+    return os.getenv("FFMPEG_EXECUTABLE") or "ffmpeg"
+
+
+def check_ffmpeg() -> None:
+    """
+    Raise an error if ffmpeg can't be found, before any video is copied.
+    """
+    if shutil.which(get_ffmpeg_executable()) is None:
+        raise ValueError(f"{get_ffmpeg_executable()} not found, it is needed by nextcloud_rendition (set FFMPEG_EXECUTABLE or install ffmpeg)")
+
+
+def get_renditions_folder() -> str:
+    """
+    Return the folder of the renditions waiting to be uploaded : the RENDITIONS_FOLDER env variable, or a folder of the state folder.
+    """
+    renditions_folder = os.getenv("RENDITIONS_FOLDER") or get_state_path("renditions")
+    os.makedirs(renditions_folder, exist_ok=True)
+    return renditions_folder
+
+
+def get_ffmpeg_arguments(source_path: str, output_path: str, output_format: str, settings: RenditionSettings) -> ty.List[str]:
+    """
+    Return the ffmpeg command making the rendition : the first video and audio tracks in H.264/AAC, scaled down to
+    max_height and capped to video_bitrate_kbps, or only remuxed without them.
+    The index of the file is moved at its start (faststart), so it can be played while it is downloaded.
+    """
+    arguments = [get_ffmpeg_executable(), "-nostdin", "-y", "-loglevel", "error", "-i", source_path,
+                 "-map", "0:v:0", "-map", "0:a:0?", "-map_metadata", "0"]
+    if settings.max_height is None and settings.video_bitrate_kbps is None:
+        arguments += ["-c", "copy"]
+    else:
+        arguments += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k"]
+        if settings.max_height:
+            # -2 keeps the ratio with an even width, videos smaller than max_height are not scaled up
+            arguments += ["-vf", f"scale=-2:'min({settings.max_height},ih)'"]
+        if settings.video_bitrate_kbps:
+            arguments += ["-maxrate", f"{settings.video_bitrate_kbps}k", "-bufsize", f"{2 * settings.video_bitrate_kbps}k"]
+    return arguments + ["-movflags", "+faststart", "-f", output_format, output_path]
+
+
+def make_rendition(source_path: str, rendition_path: str, settings: RenditionSettings) -> Rendition:
+    """
+    Make the rendition of a video with ffmpeg and compute its digests. It runs in a worker process of the upload pipeline.
+    The rendition is written under a temporary name and only appears at its path once complete.
+    """
+    partial_path = f"{rendition_path}.part"
+    # Same container as the original, the rendition keeps its name
+    output_format = "mov" if rendition_path.lower().endswith(".mov") else "mp4"
+    start = time.perf_counter()
+    result = subprocess.run(get_ffmpeg_arguments(source_path, partial_path, output_format, settings), capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise ValueError(f"Failed to transcode {os.path.basename(source_path)}: {result.stderr.strip()[-500:]}")
+    os.replace(partial_path, rendition_path)
+    return Rendition(path=rendition_path, digests=compute_file_digests(rendition_path), duration_s=time.perf_counter() - start)
@@ -1,4 +1,8 @@
+import hashlib
+import os
 import re
+
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
     
 def windows_to_wsl2_path(windows_path: str) -> str:
     """
@@ -9,7 +13,10 @@ def windows_to_wsl2_path(windows_path: str) -> str:
 
     Returns:
     str: A WSL2-style path (e.g., '/mnt/c/Users/Username/file.txt').
+    Paths that are already absolute POSIX paths are returned unchanged, which allows to use a local folder on Linux.
     """
+    if windows_path.startswith('/'):
+        return windows_path
     # Regex to capture the drive letter and the rest of the path
     match = re.match(r"([a-zA-Z]):\\(.*)", windows_path)
     if not match:
@@ -48,4 +55,28 @@ def validate_date_format(date_str):
 
 def normalize_folders_path(folders_path: str) -> str:
     # Normalize the folder path and remove / at the beginning and at the end
-    return folders_path.strip('/')
\ No newline at end of file
+    return folders_path.strip('/')
+
+
+def get_state_path(file_name: str) -> str:
+    """
+    Return the path of a file kept between two runs, inside the STATE_FOLDER env variable (../.state by default).
+    """
+    state_folder = os.getenv("STATE_FOLDER") or "../.state"
+    os.makedirs(state_folder, exist_ok=True)
+    return os.path.join(state_folder, file_name)
+
+
+def file_fingerprint(file_path: str) -> str:
+    """
+    Return a cheap fingerprint of a file : its size and a hash of its first and last MB.
+    It allows to recognise a file between two runs without reading it entirely.
+    """
+    size = os.path.getsize(file_path)
+    sample_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        sample_hash.update(file.read(FINGERPRINT_SAMPLE_SIZE))
+        if size > FINGERPRINT_SAMPLE_SIZE:
+            file.seek(max(FINGERPRINT_SAMPLE_SIZE, size - FINGERPRINT_SAMPLE_SIZE))
+            sample_hash.update(file.read(FINGERPRINT_SAMPLE_SIZE))
+    return f"{size}-{sample_hash.hexdigest()[:16]}"
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+import logging
+import os
+from pathlib import Path
+import queue
+import threading
+import time
+import typer
+import typing as ty
+import yaml
+
+# Internal files
+from definitions import Event
+from device import is_device_connected
+from inputs import yaml_data_to_events
+from plugins import warm_up_destination_plugins
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class EventsConfig:
+    """
+    The events of events.yml, parsed again only when the file is modified.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.modified: float | None = None
+        self.events: ty.List[Event] = []
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Parse the file again if it was modified since the last time, and return True if it was.
+        A file that can't be parsed is reported and the previous events are kept.
+        """
+        try:
+            modified = os.path.getmtime(self.path)
+            if modified == self.modified:
+                return False
+            self.modified = modified
+            self.events = yaml_data_to_events(self.path)
+        except (OSError, KeyError, ValueError, yaml.YAMLError) as e:
+            if not self.events:
+                raise
+            typer.echo(f"Failed to reload {self.path}, the previous events are kept: {e}")
+            return False
+        warm_up_destination_plugins(self.events)
+        return True
+
+
+class ArchiveDaemon:
+    """
+    Long running watch mode : the device is polled every poll_seconds, and each time it is plugged in, an archive
+    of the last lookback_days is queued for every event of events.yml, without any prompt.
+    The jobs are run one after the other by a worker thread, while the device and events.yml keep being polled.
+    The process stays up between the archives, with its modules imported and its clients (S3, Nextcloud) created.
+    """
+
+    def __init__(self, config: EventsConfig, archive: ty.Callable[[ty.List[Event], str, str], None],
+                 poll_seconds: float = 10, lookback_days: int = 7):
+        self.config = config
+        self.archive = archive
+        self.poll_seconds = poll_seconds
+        self.lookback_days = lookback_days
+        self.jobs: "queue.Queue[ty.Tuple[ty.List[Event], str, str] | None]" = queue.Queue()
+        self.stopped = threading.Event()
+        self.archiving = threading.Event()
+        self.worker = threading.Thread(target=self._run_jobs, name="archive-jobs", daemon=True)
+
+    def run(self) -> None:
+        """
+        Poll until stop() is called or the process is interrupted (Ctrl+C), then finish the current job.
+        """
+        self.worker.start()
+        typer.echo(f"Watching for the device every {self.poll_seconds:g}s, {len(self.config.events)} event(s) loaded")
+        connected = False
+        try:
+            while not self.stopped.is_set():
+                if self.config.reload_if_changed():
+                    typer.echo(f"{self.config.path} reloaded, {len(self.config.events)} event(s)")
+                # The device is not looked for during an archive, the script would compete with the session for it
+                was_connected, connected = connected, self.archiving.is_set() or self._is_device_connected()
+                # Only a new connection queues a job, not a device staying plugged in
+                if connected and not was_connected and self.jobs.empty():
+                    typer.echo("Device plugged in, archive queued")
+                    self.jobs.put(self._next_job())
+                self.stopped.wait(self.poll_seconds)
+        except KeyboardInterrupt:
+            typer.echo("Stopping the watch mode after the current archive...")
+        finally:
+            self.stopped.set()
+            self.jobs.put(None)
+            self.worker.join()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def _is_device_connected(self) -> bool:
+        try:
+            return is_device_connected()
+        except ValueError as e:
+            typer.echo(f"Failed to look for the device: {e}")
+            return False
+
+    def _next_job(self) -> ty.Tuple[ty.List[Event], str, str]:
+        today = datetime.now()
+        return self.config.events, (today - timedelta(days=self.lookback_days)).strftime("%d/%m/%Y"), today.strftime("%d/%m/%Y")
+
+    def _run_jobs(self) -> None:
+        while (job := self.jobs.get()) is not None:
+            events, range_start, range_stop = job
+            start = time.perf_counter()
+            self.archiving.set()
+            try:
+                self.archive(events, range_start, range_stop)
+                typer.echo(f"Archive of {range_start} to {range_stop} done in {time.perf_counter() - start:.0f}s, waiting for the device")
+            except ValueError as e:
+                typer.echo(f"Archive of {range_start} to {range_stop} stopped: {e}")
+            except Exception:
+                # The next plug in has to be archived anyway
+                LOGGER.exception(f"Archive of {range_start} to {range_stop} failed")
+            finally:
+                self.archiving.clear()
@@ -0,0 +1,264 @@
+"""
+End-to-end benchmark of an archive run : synthetic videos in a fake device folder are listed, copied, renamed,
+uploaded to S3 and Nextcloud, shared, notified on Telegram and deleted by the real code of app/, against local stand-ins
+(fake PowerShell runner or mounted folder, moto S3 server, WebDAV/OCS server, Telegram Bot API).
+It reports the time and throughput of each stage, and saves them in benchmarks/results so that two versions can be compared.
+
+    python benchmarks/archive.py --videos 4 --size-mb 1024
+    python benchmarks/archive.py --device powershell --baseline benchmarks/results/<previous run>.json
+
+With --fault-rate, the servers are reached through proxies injecting the faults of a flaky uplink (see standins/faulty_proxy.py),
+and the retries and circuit breakers opened by the app are reported.
+"""
+import argparse
+from contextlib import ExitStack
+from datetime import datetime, timezone
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as ty
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+APP_FOLDER = os.path.join(BENCHMARKS_FOLDER, "..", "app")
+sys.path.insert(0, APP_FOLDER)
+
+from standins.faulty_proxy import FaultyProxy
+from standins.nextcloud_server import NextcloudStandIn
+from standins.s3_server import S3StandIn
+from standins.telegram_server import TelegramStandIn
+
+MB = 1024 * 1024
+BUCKET = "timeframe-archivist-benchmark"
+# The videos are created during the event of the benchmark, one minute apart
+EVENT_DAY = "12/05/2024"
+FIRST_VIDEO_TIMESTAMP = datetime(2024, 5, 12, 18, 0, tzinfo=timezone.utc).timestamp()
+
+
+class StageTimer:
+    """
+    Collect the duration and the bytes of every call of each stage. Calls of a stage can overlap (uploads run in parallel) :
+    the wall time of a stage goes from its first start to its last end, the busy time adds the calls.
+    """
+
+    def __init__(self):
+        self.calls: ty.Dict[str, ty.List[ty.Tuple[float, float, int]]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, start: float, end: float, size_bytes: int = 0) -> None:
+        with self.lock:
+            self.calls.setdefault(stage, []).append((start, end, size_bytes))
+
+    def wrap(self, stage: str, function: ty.Callable, size: ty.Callable[..., int] = lambda *args, **kwargs: 0) -> ty.Callable:
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, start, time.perf_counter(), size(*args, **kwargs))
+        return timed
+
+    def wrap_coroutine(self, stage: str, function: ty.Callable) -> ty.Callable:
+        @functools.wraps(function)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.record(stage, start, time.perf_counter())
+        return timed
+
+    def wrap_generator(self, stage: str, function: ty.Callable, size: ty.Callable[[ty.Any], int]) -> ty.Callable:
+        """
+        Time a generator : each call lasts from the request of an item until it is yielded.
+        """
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            for item in function(*args, **kwargs):
+                self.record(stage, start, time.perf_counter(), size(item))
+                yield item
+                start = time.perf_counter()
+        return timed
+
+    def report(self) -> ty.Dict[str, ty.Dict[str, float]]:
+        stages = {}
+        for stage, calls in self.calls.items():
+            wall_s = max(end for _, end, _ in calls) - min(start for start, _, _ in calls)
+            size_mb = sum(size_bytes for _, _, size_bytes in calls) / MB
+            stages[stage] = {"calls": len(calls), "wall_s": wall_s, "busy_s": sum(end - start for start, end, _ in calls),
+                             "mb": size_mb, "mb_s": size_mb / wall_s if wall_s and size_mb else 0}
+        return stages
+
+
+def create_device_videos(device_folder: str, videos: int, size_mb: int) -> None:
+    """
+    Write the synthetic videos in a month folder, like the phone storage. Each video is made of one random block
+    of 1 Mb repeated, different for each video.
+    """
+    month_folder = os.path.join(device_folder, "202405__")
+    os.makedirs(month_folder)
+    for number in range(videos):
+        path = os.path.join(month_folder, f"IMG_{number:04}.MOV")
+        block = os.urandom(MB)
+        with open(path, "wb") as file:
+            for _ in range(size_mb):
+                file.write(block)
+        timestamp = FIRST_VIDEO_TIMESTAMP + number * 60
+        os.utime(path, (timestamp, timestamp))
+
+
+def file_size(video) -> int:
+    return video.size_bytes or 0
+
+
+def instrument(timer: StageTimer) -> None:
+    """
+    Replace the functions of each stage of the archive run by timed ones.
+    """
+    import main
+    import nextcloud
+    import pipeline
+    import s3
+    import telegram_bot
+
+    main.check_available_videos = timer.wrap("list", main.check_available_videos)
+    main.copy_videos_to_windows = timer.wrap_generator("copy", main.copy_videos_to_windows, file_size)
+    main.check_files_correctly_copied = timer.wrap("check copy", main.check_files_correctly_copied)
+    main.rename_videos_for_windows = timer.wrap("rename", main.rename_videos_for_windows)
+    main.delete_videos = timer.wrap("delete", main.delete_videos)
+    uploaded_size = lambda destination, video: os.path.getsize(video.wsl_full_path)
+    s3.S3Destination.upload = timer.wrap("upload S3", s3.S3Destination.upload, uploaded_size)
+    nextcloud.NextcloudDestination.upload = timer.wrap("upload nextcloud", nextcloud.NextcloudDestination.upload, uploaded_size)
+    # With --streaming, a video is read once for all the destinations
+    pipeline.tee_file = timer.wrap("stream", pipeline.tee_file, lambda source_path, *args: os.path.getsize(source_path))
+    nextcloud.create_event_public_shares = timer.wrap("share", nextcloud.create_event_public_shares)
+    # The messages are sent by the notification dispatcher, in the background
+    telegram_bot.send_message_to_telegram_conversation = timer.wrap_coroutine("notify", telegram_bot.send_message_to_telegram_conversation)
+
+
+def run_archive(args: argparse.Namespace) -> float:
+    import main
+    from definitions import Event, Inputs
+    from device import open_device_session
+    import s3
+
+    event = Event(event_start="19:45", event_stop="22:30", complex_naming=False, video_title="Benchmark", complex_name_format_helper=None,
+                  title_end_with_date=True, event_timezone="Romance Standard Time", delete_videos_from_iphone=True, validation_videos_found=False,
+                  S3_upload=True, S3_storage_class="STANDARD", S3_bucket=BUCKET, S3_folder="benchmark",
+                  S3_multipart_threshold_mb=args.chunk_size_mb, S3_multipart_chunksize_mb=args.chunk_size_mb,
+                  nextcloud_upload=True, nextcloud_folder="benchmark", nextcloud_public_share=True, nextcloud_telegram_notification=True,
+                  nextcloud_chunked_upload=args.nextcloud_chunked, nextcloud_chunk_size_mb=args.chunk_size_mb,
+                  streaming_upload=args.streaming, upload_max_rate_mb_s=args.upload_max_rate_mb_s,
+                  upload_memory_budget_mb=args.upload_memory_budget_mb)
+    inputs = Inputs(day=EVENT_DAY, event=event, complex_title_end="")
+    s3.get_s3_client().create_bucket(Bucket=BUCKET)
+
+    start = time.perf_counter()
+    with open_device_session(inputs) as device_session:
+        videos = main.check_available_videos(device_session, inputs)
+        main.archive_videos(device_session, inputs, videos)
+    return time.perf_counter() - start
+
+
+def get_version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=BENCHMARKS_FOLDER, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(results: ty.Dict[str, ty.Any], baseline: ty.Dict[str, ty.Any] | None) -> None:
+    print(f"{results['videos']} video(s) of {results['size_mb']} Mb, {results['device']} device : {results['total_s']:.2f} s")
+    print(f"  {'stage':<18} {'calls':>5} {'wall s':>8} {'busy s':>8} {'Mb/s':>8}" + (f" {'vs baseline':>12}" if baseline else ""))
+    for stage, measures in results["stages"].items():
+        line = f"  {stage:<18} {measures['calls']:>5} {measures['wall_s']:>8.2f} {measures['busy_s']:>8.2f} {measures['mb_s']:>8.1f}"
+        baseline_measures = (baseline or {}).get("stages", {}).get(stage)
+        if baseline_measures and baseline_measures["wall_s"]:
+            line += f" {(measures['wall_s'] / baseline_measures['wall_s'] - 1) * 100:>+11.0f}%"
+        print(line)
+    if results.get("injected_faults"):
+        print(f"  faults injected : {results['injected_faults']}")
+    if results.get("network_events"):
+        print(f"  network events : {results['network_events']}")
+    if baseline:
+        print(f"  total : {(results['total_s'] / baseline['total_s'] - 1) * 100:+.0f}% against {baseline['version']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=1024, help="Size of each video")
+    parser.add_argument("--device", choices=["local", "powershell"], default="local",
+                        help="Mounted folder backend, or the PowerShell session protocol with benchmarks/standins/fake_powershell.py")
+    parser.add_argument("--chunk-size-mb", type=int, default=64, help="S3 parts and Nextcloud chunks size")
+    parser.add_argument("--nextcloud-chunked", action="store_true", help="Use the chunked upload of Nextcloud")
+    parser.add_argument("--streaming", action="store_true", help="Enable the streaming_upload event option")
+    parser.add_argument("--upload-max-rate-mb-s", type=float, help="Simulate a limited uplink shared by the destinations")
+    parser.add_argument("--upload-memory-budget-mb", type=int, help="Limit the parts and chunks held in memory by the uploads")
+    parser.add_argument("--fault-rate", type=float, default=0,
+                        help="Share of the requests failing (split between 503 errors, closed connections and stalls)")
+    parser.add_argument("--stall-s", type=float, default=3, help="Duration of the stalls, the app read timeout is set below it")
+    parser.add_argument("--work-folder", help="Folder of the device, destination and servers files, a temporary folder by default")
+    parser.add_argument("--output-folder", default=os.path.join(BENCHMARKS_FOLDER, "results"))
+    parser.add_argument("--baseline", help="Results of a previous run to compare with")
+    args = parser.parse_args()
+
+    timer = StageTimer()
+    proxies: ty.Dict[str, FaultyProxy] = {}
+    with tempfile.TemporaryDirectory(dir=args.work_folder) as work_folder, ExitStack() as stack, \
+            S3StandIn() as s3_server, NextcloudStandIn(os.path.join(work_folder, "nextcloud")) as nextcloud_server, TelegramStandIn() as telegram_server:
+        device_folder = os.path.join(work_folder, "device")
+        create_device_videos(device_folder, args.videos, args.size_mb)
+        os.environ.update({**s3_server.env(), **nextcloud_server.env(), **telegram_server.env(),
+                           "WINDOWS_DESTINATION_FOLDER": os.path.join(work_folder, "destination"),
+                           "STATE_FOLDER": os.path.join(work_folder, "state")})
+        if args.fault_rate:
+            for variable in ("AWS_ENDPOINT_URL", "NEXTCLOUD_BASE_URL", "TELEGRAM_API_URL"):
+                proxies[variable] = stack.enter_context(FaultyProxy(os.environ[variable], error_rate=args.fault_rate / 3, reset_rate=args.fault_rate / 3,
+                                                                    stall_rate=args.fault_rate / 3, stall_s=args.stall_s))
+                os.environ[variable] = proxies[variable].base_url
+            # Short timeouts and backoffs, so the faults slow the run down as little as on a real uplink
+            for variable, value in (("NETWORK_READ_TIMEOUT_S", args.stall_s / 2), ("NETWORK_BACKOFF_BASE_S", 0.1), ("NETWORK_BACKOFF_MAX_S", 2)):
+                os.environ.setdefault(variable, str(value))
+        if args.device == "local":
+            os.environ.update({"DEVICE_BACKEND": "local", "LOCAL_DEVICE_FOLDER": device_folder})
+        else:
+            os.environ.update({"DEVICE_BACKEND": "powershell", "FAKE_POWERSHELL_DEVICE_FOLDER": device_folder,
+                               "POWERSHELL_EXECUTABLE": os.path.join(BENCHMARKS_FOLDER, "standins", "fake_powershell.py")})
+        # The app reads its files relatively to app/
+        os.chdir(APP_FOLDER)
+        instrument(timer)
+        total_s = run_archive(args)
+        if telegram_server.messages == []:
+            raise RuntimeError("No Telegram notification was sent")
+        from metrics import METRICS
+        network_events = {f"{counter} {destination}": count for (counter, destination), count in METRICS.counters.items()}
+        injected_faults = {variable: dict(proxy.faults) for variable, proxy in proxies.items()}
+
+    results = {"version": get_version(), "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+               "videos": args.videos, "size_mb": args.size_mb, "device": args.device, "chunk_size_mb": args.chunk_size_mb,
+               "nextcloud_chunked": args.nextcloud_chunked, "streaming": args.streaming,
+               "upload_max_rate_mb_s": args.upload_max_rate_mb_s, "upload_memory_budget_mb": args.upload_memory_budget_mb,
+               "fault_rate": args.fault_rate, "injected_faults": injected_faults, "network_events": network_events,
+               "total_s": total_s, "mb_s": args.videos * args.size_mb / total_s, "stages": timer.report()}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(results, baseline)
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    output_path = os.path.join(args.output_folder, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{results['version']}.json")
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved in {output_path}")
+
+
+if __name__ == "__main__":
+    main()
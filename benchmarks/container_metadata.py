@@ -0,0 +1,101 @@
+"""
+Measure the listing of a folder of large videos with their container metadata (mp4_metadata.py : creation date,
+duration, resolution and codec read from the moov box) against a stat of each file, the listing of the local device
+backend with its threads, and ffprobe when it is installed. The sample videos are sparse files laid out like the ones
+of a phone (benchmarks/standins/sample_videos.py), half with their moov box after the media.
+Run it with --folder on a mounted phone (or any folder of real videos) and --samples 0 to measure existing videos.
+
+    python benchmarks/container_metadata.py --samples 40 --size-mb 4096
+    python benchmarks/container_metadata.py --folder /run/user/1000/gvfs/.../DCIM --samples 0
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing as ty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from device import VIDEO_EXTENSIONS, LocalDirectoryDeviceSession
+from mp4_metadata import read_container_metadata
+from staging import MB
+from standins.sample_videos import write_sample_video
+
+
+def create_sample_videos(folder: str, samples: int, size_mb: int) -> None:
+    month_folder = os.path.join(folder, "202405__")
+    os.makedirs(month_folder, exist_ok=True)
+    start = datetime(2024, 5, 12, 16, tzinfo=timezone.utc)
+    for index in range(samples):
+        write_sample_video(os.path.join(month_folder, f"IMG_{index:04d}.MOV"), size_mb * MB, start + timedelta(minutes=15 * index),
+                           duration_s=600 + index, rotated=index % 3 == 0, faststart=index % 2 == 1)
+
+
+def list_video_paths(folder: str) -> ty.List[str]:
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(folder) for name in names if name.lower().endswith(VIDEO_EXTENSIONS))
+
+
+def timed(function: ty.Callable[[], ty.Any], runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def ffprobe(path: str) -> None:
+    subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration:stream=codec_name,width,height", "-of", "json", path],
+                   capture_output=True, check=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", help="Folder of the videos, a temporary folder by default")
+    parser.add_argument("--samples", type=int, default=20, help="Sample videos written in the folder first")
+    parser.add_argument("--size-mb", type=int, default=2048, help="Size of each sample video")
+    parser.add_argument("--workers", type=int, default=4, help="Threads of the listing of the local device backend")
+    parser.add_argument("--runs", type=int, default=5, help="Measures of each case, the median is kept")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        folder = args.folder or temporary_folder
+        if args.samples:
+            create_sample_videos(folder, args.samples, args.size_mb)
+        paths = list_video_paths(folder)
+        if not paths:
+            raise ValueError(f"No video found in {folder}")
+        metadata = [read_container_metadata(path) for path in paths]
+        size_mb = sum(os.path.getsize(path) for path in paths) / MB
+        print(f"{len(paths)} videos ({size_mb:.0f} Mb) in {folder}, {sum(1 for item in metadata if item is not None)} with their container metadata")
+
+        results: ty.Dict[str, ty.Any] = {"videos": len(paths), "size_mb": round(size_mb)}
+        results["stat_s"] = timed(lambda: [os.stat(path) for path in paths], args.runs)
+        results["container_metadata_s"] = timed(lambda: [read_container_metadata(path) for path in paths], args.runs)
+        # Every date of the samples is in May 2024, the listing of real videos covers the whole range of the phone
+        first_day, last_day = ("11/05/2024", "31/05/2024") if args.samples else ("01/01/2000", "31/12/2099")
+
+        def device_listing() -> None:
+            LocalDirectoryDeviceSession(None, folder, temporary_folder, (first_day, last_day), copy_workers=args.workers)._enumerate_videos()
+        results["device_listing_s"] = timed(device_listing, args.runs)
+        if shutil.which("ffprobe"):
+            results["ffprobe_s"] = timed(lambda: [ffprobe(path) for path in paths], 1)
+
+        for case, duration in results.items():
+            if case.endswith("_s"):
+                print(f"  {case[:-2]:<20} {duration * 1000:9.1f} ms ({duration * 1000 / len(paths):7.3f} ms per video)")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
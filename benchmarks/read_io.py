@@ -0,0 +1,101 @@
+"""
+Compare the read throughput of a video with several block sizes, and the reads of the uploads from a staged copy
+(one copy on the native file system, then every read from it) with direct reads of the file.
+Run it with --folder on the Windows destination folder (/mnt/c/...) to measure the 9P file system of WSL2,
+and --staging-folder on the native Linux file system.
+
+    python benchmarks/read_io.py --folder /mnt/c/Users/me/Videos --size-mb 512 --reads 3
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import typing as ty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from staging import MB, StagingArea
+
+
+BLOCK_SIZES_KB = [64, 1024, 8 * 1024, 32 * 1024]
+
+
+def create_sample_file(folder: str, size_mb: int) -> str:
+    path = os.path.join(folder, "timeframe_archivist_read_benchmark.mp4")
+    block = os.urandom(MB)
+    with open(path, "wb") as file:
+        for _ in range(size_mb):
+            file.write(block)
+    return path
+
+
+def drop_cache(path: str) -> None:
+    """
+    Ask the kernel to forget the cached pages of the file, so each measure reads from the file system.
+    Not every file system supports it (9P keeps its own cache) : the measures are then warm reads.
+    """
+    if hasattr(os, "posix_fadvise"):
+        with open(path, "rb") as file:
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def read_file(path: str, block_size: int) -> None:
+    with open(path, "rb", buffering=0) as file:
+        while file.read(block_size):
+            pass
+
+
+def timed(function: ty.Callable[[], ty.Any], runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default=tempfile.gettempdir(), help="Folder of the sample file, the one the videos are copied to")
+    parser.add_argument("--staging-folder", help="Native folder of the staged copies, a temporary folder by default")
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--reads", type=int, default=3, help="Reads of a video by the uploads (digests, then each destination)")
+    parser.add_argument("--runs", type=int, default=3, help="Measures of each case, the median is kept")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    path = create_sample_file(args.folder, args.size_mb)
+    results: ty.Dict[str, ty.Any] = {"size_mb": args.size_mb, "block_sizes_mb_s": {}}
+    try:
+        print(f"Reading {args.size_mb} Mb from {args.folder}")
+        for block_size_kb in BLOCK_SIZES_KB:
+            duration = timed(lambda: (drop_cache(path), read_file(path, block_size_kb * 1024)), args.runs)
+            results["block_sizes_mb_s"][block_size_kb] = args.size_mb / duration
+            print(f"  blocks of {block_size_kb:>6} Kb : {args.size_mb / duration:8.1f} Mb/s")
+
+        block_size = 8 * MB
+        direct = timed(lambda: [(drop_cache(path), read_file(path, block_size)) for _ in range(args.reads)], args.runs)
+        with tempfile.TemporaryDirectory(dir=args.staging_folder) as staging_folder:
+            def staged_reads() -> None:
+                drop_cache(path)
+                staging_area = StagingArea(os.path.join(staging_folder, str(time.perf_counter_ns())), 4 * args.size_mb * MB)
+                staged_path = staging_area.stage(path, os.path.basename(path))
+                for _ in range(args.reads):
+                    read_file(staged_path, block_size)
+                os.remove(staged_path)
+            staged = timed(staged_reads, args.runs)
+        results.update(direct_reads_s=direct, staged_reads_s=staged)
+        print(f"{args.reads} reads of the file : direct {direct:.2f}s, staged (copy included) {staged:.2f}s")
+    finally:
+        os.remove(path)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare the S3 upload throughput of the previous path (one new client per file, default transfer settings)
+with the shared client and the resumable multipart upload of the app, with the part size (--chunksize-mb)
+and the parts sent at the same time (--concurrency) of an event, against a local moto S3 server.
+
+    python benchmarks/s3_transfer.py --files 4 --size-mb 256
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from definitions import Event, Inputs
+import s3
+from standins.s3_server import S3StandIn
+
+
+BUCKET = "timeframe-archivist-benchmark"
+
+
+def create_sample_files(folder: str, files: int, size_mb: int) -> list:
+    paths = []
+    block = os.urandom(s3.MB)
+    for i in range(files):
+        path = os.path.join(folder, f"video_{i}.mp4")
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+        paths.append(path)
+    return paths
+
+
+def previous_path(inputs: Inputs, paths: list) -> None:
+    for path in paths:
+        s3.create_s3_client().upload_file(path, BUCKET, f"previous/{os.path.basename(path)}", ExtraArgs={"StorageClass": inputs.event.S3_storage_class})
+
+
+def shared_client_path(inputs: Inputs, paths: list) -> None:
+    for path in paths:
+        s3.upload_file_to_s3(inputs, os.path.basename(path), path)
+
+
+def measure(name: str, function, inputs: Inputs, paths: list, total_mb: int) -> None:
+    start = time.perf_counter()
+    function(inputs, paths)
+    duration = time.perf_counter() - start
+    print(f"{name:<16} {duration:8.2f} s {total_mb / duration:10.1f} MB/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--chunksize-mb", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    event = Event(event_start="19:45", event_stop="22:30", complex_naming=False, video_title="Benchmark", complex_name_format_helper=None,
+                  title_end_with_date=False, event_timezone="UTC", delete_videos_from_iphone=False, validation_videos_found=False,
+                  S3_upload=True, S3_storage_class="DEEP_ARCHIVE", S3_bucket=BUCKET, S3_folder="shared",
+                  S3_multipart_threshold_mb=args.chunksize_mb, S3_multipart_chunksize_mb=args.chunksize_mb, S3_max_concurrency=args.concurrency,
+                  nextcloud_upload=False, nextcloud_folder=None, nextcloud_public_share=None, nextcloud_telegram_notification=None)
+    inputs = Inputs(day="01/01/2024", complex_title_end=None, event=event)
+
+    with S3StandIn() as s3_server, tempfile.TemporaryDirectory() as folder:
+        os.environ.update(s3_server.env())
+        s3.create_s3_client().create_bucket(Bucket=BUCKET)
+        paths = create_sample_files(folder, args.files, args.size_mb)
+        total_mb = args.files * args.size_mb
+        print(f"{args.files} file(s) of {args.size_mb} MB")
+        measure("previous", previous_path, inputs, paths, total_mb)
+        measure("shared client", shared_client_path, inputs, paths, total_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Stand-in for `powershell.exe -File timeframe_archivist.ps1 -command session`, replaying a recorded output
+of the script (recordings/powershell_session.ndjson by default, or FAKE_POWERSHELL_RECORDING).
+The lines up to "listing_done" are written at start, then the lines up to the next "done" for each request read on stdin.
+The copied videos are created in -files_destination_path with their recorded size, so the whole archive flow can run:
+
+    POWERSHELL_EXECUTABLE=benchmarks/standins/fake_powershell.py python app/main.py
+
+With FAKE_POWERSHELL_DEVICE_FOLDER, it runs the session on the videos of this folder instead (one sub folder per month,
+the modification time used as creation date), really copying and deleting them. The phone is then plugged in
+for -command check_device while the folder is not empty.
+"""
+from datetime import datetime, timezone
+import json
+import os
+import shutil
+import sys
+import time
+
+DEFAULT_RECORDING = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings", "powershell_session.ndjson")
+
+
+def replay_until(lines, last_event: str, destination_folder: str | None) -> None:
+    for line in lines:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if message.get("event") == "copied" and destination_folder:
+            os.makedirs(destination_folder, exist_ok=True)
+            with open(os.path.join(destination_folder, message["id"].split("/")[-1]), "wb") as file:
+                file.truncate(message["size_bytes"])
+            time.sleep(float(os.getenv("FAKE_POWERSHELL_DELAY", "0")))
+        if message.get("event") == last_event:
+            return
+
+
+def write_event(**event) -> None:
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+def run_device_session(device_folder: str, destination_folder: str) -> None:
+    manifest = {}
+    for root, _, file_names in os.walk(device_folder):
+        for file_name in sorted(file_names):
+            if not file_name.lower().endswith((".mp4", ".mov")):
+                continue
+            path = os.path.join(root, file_name)
+            stat = os.stat(path)
+            video_id = os.path.relpath(path, device_folder).replace(os.sep, "/")
+            manifest[video_id] = path
+            write_event(event="listed", video={"id": video_id, "original_name": file_name, "size_bytes": stat.st_size,
+                                               "creation_date_utc": datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")})
+    write_event(event="listing_done")
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request["command"] == "exit":
+            break
+        for video_id in request["ids"]:
+            if video_id not in manifest:
+                write_event(event="error", id=video_id, message=f"Videos not found in the device manifest : {video_id}")
+                break
+            if request["command"] == "copy_files":
+                size_bytes = os.path.getsize(manifest[video_id])
+                write_event(event="copy_started", id=video_id, size_bytes=size_bytes)
+                start = time.perf_counter()
+                os.makedirs(destination_folder, exist_ok=True)
+                shutil.copyfile(manifest[video_id], os.path.join(destination_folder, os.path.basename(video_id)))
+                write_event(event="copied", id=video_id, size_bytes=size_bytes, seconds=time.perf_counter() - start)
+            elif request["command"] == "delete_files":
+                os.remove(manifest[video_id])
+                write_event(event="deleted", id=video_id)
+        write_event(event="done")
+
+
+def check_device() -> None:
+    """
+    Answer like the check_device command : the phone is found when the device folder exists and is not empty,
+    always when a recording is replayed.
+    """
+    device_folder = os.getenv("FAKE_POWERSHELL_DEVICE_FOLDER")
+    if device_folder and not (os.path.isdir(device_folder) and os.listdir(device_folder)):
+        write_event(event="error", message="Iphone not found. Check that it is correctly plugged in your machine.")
+    else:
+        write_event(event="done")
+
+
+def main() -> None:
+    arguments = sys.argv[1:]
+    if "-command" in arguments and arguments[arguments.index("-command") + 1] == "check_device":
+        check_device()
+        return
+    destination_folder = arguments[arguments.index("-files_destination_path") + 1] if "-files_destination_path" in arguments else None
+    if os.getenv("FAKE_POWERSHELL_DEVICE_FOLDER"):
+        run_device_session(os.getenv("FAKE_POWERSHELL_DEVICE_FOLDER"), destination_folder)
+        return
+    with open(os.getenv("FAKE_POWERSHELL_RECORDING") or DEFAULT_RECORDING) as recording:
+        lines = iter(recording.readlines())
+    replay_until(lines, "listing_done", destination_folder)
+    for request in sys.stdin:
+        if json.loads(request)["command"] == "exit":
+            break
+        replay_until(lines, "done", destination_folder)
+
+
+if __name__ == "__main__":
+    main()
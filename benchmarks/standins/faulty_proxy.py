@@ -0,0 +1,125 @@
+"""
+HTTP proxy put in front of another stand-in to simulate a flaky uplink : a share of the requests get a server error (503),
+have their connection closed without any answer, or stall longer than the read timeout of the app before being forwarded.
+The faults are drawn from a seeded random generator, so two runs with the same seed and the same requests fail the same way.
+
+    with NextcloudStandIn(folder) as nextcloud_server, FaultyProxy(nextcloud_server.base_url, error_rate=0.05) as proxy:
+        os.environ.update({**nextcloud_server.env(), "NEXTCLOUD_BASE_URL": proxy.base_url})
+"""
+from collections import Counter
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+# Headers of one connection, not forwarded
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade"}
+METHODS = ["GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS", "PROPFIND", "MKCOL", "MOVE"]
+
+
+class FaultyProxy:
+
+    def __init__(self, target_url: str, error_rate: float = 0, reset_rate: float = 0, stall_rate: float = 0, stall_s: float = 5, seed: int = 0):
+        self.target = urlparse(target_url)
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.stall_rate = stall_rate
+        self.stall_s = stall_s
+        self.random = random.Random(seed)
+        self.faults = Counter() # Faults injected, by kind
+        self.forwarded = 0 # Requests forwarded to the target
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        """
+        URL of the proxy, with the path of the target URL.
+        """
+        return f"http://127.0.0.1:{self.server.server_address[1]}{self.target.path}"
+
+    def __enter__(self) -> "FaultyProxy":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def draw_fault(self) -> str | None:
+        with self.lock:
+            draw = self.random.random()
+            for fault, rate in (("error", self.error_rate), ("reset", self.reset_rate), ("stall", self.stall_rate)):
+                if draw < rate:
+                    self.faults[fault] += 1
+                    return fault
+                draw -= rate
+            self.forwarded += 1
+            return None
+
+    def _handler_class(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = b""
+                    while (size := int(self.rfile.readline().split(b";")[0], 16)) > 0:
+                        body += self.rfile.read(size)
+                        self.rfile.readline()
+                    # Trailers, up to the empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return body
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _proxy(self) -> None:
+                body = self._read_body()
+                fault = proxy.draw_fault()
+                if fault == "reset":
+                    self.close_connection = True
+                    return
+                if fault == "error":
+                    payload = b"Service Unavailable (injected)"
+                    self.send_response(503)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                if fault == "stall":
+                    time.sleep(proxy.stall_s)
+                connection = http.client.HTTPConnection(proxy.target.hostname, proxy.target.port, timeout=60)
+                try:
+                    # The body is already read, the client got its 100 Continue from the proxy
+                    headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS | {"expect"}}
+                    connection.request(self.command, self.path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    payload = response.read()
+                finally:
+                    connection.close()
+                try:
+                    self.send_response(response.status, response.reason)
+                    for name, value in response.getheaders():
+                        # The length is set again, the date and server are sent by send_response
+                        if name.lower() not in HOP_BY_HOP_HEADERS | {"content-length", "date", "server"}:
+                            self.send_header(name, value)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    if self.command != "HEAD":
+                        self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up during a stall
+                    self.close_connection = True
+
+        for method in METHODS:
+            setattr(Handler, f"do_{method}", Handler._proxy)
+        return Handler
@@ -0,0 +1,197 @@
+"""
+Local stand-in for a Nextcloud server, storing the files in a local folder.
+It implements the WebDAV calls used by app/nextcloud.py : PROPFIND, MKCOL, PUT and the chunked upload API (v2),
+and the OCS shares API (JSON format).
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import secrets
+import shutil
+import threading
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+
+class NextcloudStandIn:
+
+    def __init__(self, root: str, user: str = "benchmark"):
+        self.root = root
+        self.user = user
+        self.files_root = os.path.join(root, "files")
+        self.uploads_root = os.path.join(root, "uploads")
+        os.makedirs(self.files_root, exist_ok=True)
+        os.makedirs(self.uploads_root, exist_ok=True)
+        self.requests = Counter() # Number of requests received, by method
+        self.shares = {} # Public shares tokens, by path
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self) -> "NextcloudStandIn":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def env(self) -> dict:
+        """
+        Environment variables pointing app/nextcloud.py to this server.
+        """
+        return {"NEXTCLOUD_BASE_URL": self.base_url, "NEXTCLOUD_USER": self.user, "NEXTCLOUD_PASSWORD": "benchmark"}
+
+    def local_path(self, url_path: str) -> str | None:
+        """
+        Return the local path of a WebDAV url path, None if it is not a files or uploads url of the user.
+        """
+        path = unquote(urlparse(url_path).path)
+        for prefix, root in [(f"/remote.php/dav/files/{self.user}", self.files_root), (f"/remote.php/dav/uploads/{self.user}", self.uploads_root)]:
+            if path == prefix or path.startswith(prefix + "/"):
+                return os.path.join(root, path[len(prefix):].strip("/"))
+        return None
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _reply(self, status: int, body: bytes = b"", content_type: str = "text/plain") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def _count(self) -> str | None:
+                with stand_in.lock:
+                    stand_in.requests[self.command] += 1
+                return stand_in.local_path(self.path)
+
+            def _reply_ocs(self, status_code: int, data, message: str = "") -> None:
+                meta = {"status": "ok" if status_code == 200 else "failure", "statuscode": status_code, "message": message}
+                body = json.dumps({"ocs": {"meta": meta, "data": data}}).encode()
+                self._reply(200 if status_code == 200 else status_code, body, "application/json")
+
+            def _share(self, path: str, token: str) -> dict:
+                return {"share_type": 3, "permissions": 1, "path": path, "token": token, "url": f"{stand_in.base_url}/s/{token}"}
+
+            def do_GET(self) -> None:
+                self._count()
+                url = urlparse(self.path)
+                if not url.path.endswith("/shares"):
+                    return self._reply(404)
+                query = parse_qs(url.query)
+                path = "/" + query.get("path", [""])[0].lstrip("/")
+                if not os.path.exists(os.path.join(stand_in.files_root, path.lstrip("/"))):
+                    return self._reply_ocs(404, [], "Wrong path, file/folder doesn't exist")
+                with stand_in.lock:
+                    if query.get("subfiles", ["false"])[0] == "true":
+                        shares = [(share_path, token) for share_path, token in stand_in.shares.items() if os.path.dirname(share_path) == path]
+                    else:
+                        shares = [(path, stand_in.shares[path])] if path in stand_in.shares else []
+                self._reply_ocs(200, [self._share(share_path, token) for share_path, token in shares])
+
+            def do_POST(self) -> None:
+                self._count()
+                if not urlparse(self.path).path.endswith("/shares"):
+                    return self._reply(404)
+                form = parse_qs(self._read_body().decode())
+                path = "/" + form.get("path", [""])[0].lstrip("/")
+                if not os.path.exists(os.path.join(stand_in.files_root, path.lstrip("/"))):
+                    return self._reply_ocs(404, [], "Wrong path, file/folder doesn't exist")
+                token = secrets.token_urlsafe(10)
+                with stand_in.lock:
+                    stand_in.shares[path] = token
+                self._reply_ocs(200, self._share(path, token))
+
+            def do_PROPFIND(self) -> None:
+                path = self._count()
+                self._read_body()
+                if path is None or not os.path.exists(path):
+                    return self._reply(404)
+                entries = [path]
+                if os.path.isdir(path) and self.headers.get("Depth", "1") != "0":
+                    entries += [os.path.join(path, name) for name in sorted(os.listdir(path))]
+                url_path = urlparse(self.path).path.rstrip("/")
+                responses = []
+                for entry in entries:
+                    href = url_path if entry == path else f"{url_path}/{os.path.basename(entry)}"
+                    if os.path.isdir(entry):
+                        props = "<d:resourcetype><d:collection/></d:resourcetype>"
+                    else:
+                        props = f"<d:resourcetype/><d:getcontentlength>{os.path.getsize(entry)}</d:getcontentlength>"
+                    responses.append(f"<d:response><d:href>{escape(href)}</d:href><d:propstat><d:prop>{props}</d:prop>"
+                                     f"<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>")
+                body = f'<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">{"".join(responses)}</d:multistatus>'
+                self._reply(207, body.encode(), "application/xml; charset=utf-8")
+
+            def do_MKCOL(self) -> None:
+                path = self._count()
+                self._read_body()
+                if path is None:
+                    return self._reply(404)
+                if os.path.exists(path):
+                    return self._reply(405)
+                if not os.path.isdir(os.path.dirname(path)):
+                    return self._reply(409)
+                os.mkdir(path)
+                self._reply(201)
+
+            def do_PUT(self) -> None:
+                path = self._count()
+                data = self._read_body()
+                if path is None or not os.path.isdir(os.path.dirname(path)):
+                    return self._reply(409)
+                # Nextcloud needs the size of the whole file with each chunk (required by its object storages)
+                if path.startswith(stand_in.uploads_root + os.sep) and not self.headers.get("OC-Total-Length"):
+                    return self._reply(400)
+                existed = os.path.exists(path)
+                with open(path, "wb") as file:
+                    file.write(data)
+                self._reply(204 if existed else 201)
+
+            def do_DELETE(self) -> None:
+                path = self._count()
+                if path is None or not os.path.exists(path):
+                    return self._reply(404)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+                self._reply(204)
+
+            def do_MOVE(self) -> None:
+                path = self._count()
+                destination = stand_in.local_path(self.headers.get("Destination", ""))
+                if path is None or destination is None:
+                    return self._reply(404)
+                if not os.path.exists(os.path.dirname(path) if os.path.basename(path) == ".file" else path):
+                    return self._reply(404)
+                if not os.path.isdir(os.path.dirname(destination)):
+                    return self._reply(409)
+                existed = os.path.exists(destination)
+                if os.path.basename(path) == ".file":
+                    # Chunked upload : assemble the chunks in numerical order
+                    upload_folder = os.path.dirname(path)
+                    chunks = sorted((name for name in os.listdir(upload_folder) if name.isdigit()), key=int)
+                    with open(destination, "wb") as destination_file:
+                        for chunk in chunks:
+                            with open(os.path.join(upload_folder, chunk), "rb") as chunk_file:
+                                shutil.copyfileobj(chunk_file, destination_file)
+                    shutil.rmtree(upload_folder)
+                else:
+                    os.replace(path, destination)
+                self._reply(204 if existed else 201)
+
+        return Handler
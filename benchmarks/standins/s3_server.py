@@ -0,0 +1,41 @@
+"""
+Local S3 server for the benchmarks : moto, started in its own process so it does not share the GIL with the uploads.
+"""
+import socket
+import subprocess
+import sys
+import time
+
+
+class S3StandIn:
+
+    def __init__(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def endpoint_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "S3StandIn":
+        self.process = subprocess.Popen([sys.executable, "-m", "moto.server", "-p", str(self.port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.process.kill()
+        raise RuntimeError("moto server did not start")
+
+    def __exit__(self, *exc_info) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+    def env(self) -> dict:
+        """
+        Environment variables pointing app/s3.py to this server.
+        """
+        return {"AWS_ENDPOINT_URL": self.endpoint_url, "AWS_KEY_ID": "benchmark", "AWS_SECRET_KEY": "benchmark", "AWS_REGION": "us-east-1"}
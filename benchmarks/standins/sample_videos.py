@@ -0,0 +1,68 @@
+"""
+Writes MP4/MOV files laid out like the videos of a phone : a ftyp box, a mdat box of the requested size (sparse, so
+gigabytes of media take no room on disk) and a moov box with the movie header, one video and one audio track,
+and the QuickTime creation date. The moov box is written after the media like the phones do, or before it (faststart).
+
+    write_sample_video("IMG_0001.MOV", 4 * 1024 ** 3, datetime(2024, 5, 12, 16, 3, 21, tzinfo=timezone.utc), duration_s=754)
+"""
+from datetime import datetime, timedelta, timezone
+import struct
+
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+# Matrix of a track turned by 90 degrees (portrait videos), and of a track displayed as recorded
+ROTATED_MATRIX = (0, 0x10000, 0, -0x10000, 0, 0, 0, 0, 0x40000000)
+IDENTITY_MATRIX = (0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+TIMESCALE = 600
+
+
+def box(box_type: bytes, *contents: bytes) -> bytes:
+    content = b"".join(contents)
+    return struct.pack(">I4s", 8 + len(content), box_type) + content
+
+
+def full_box(box_type: bytes, version: int, content: bytes) -> bytes:
+    return box(box_type, struct.pack(">I", version << 24), content)
+
+
+def track(handler: bytes, codec: bytes, duration: int, width: int, height: int, rotated: bool) -> bytes:
+    matrix = ROTATED_MATRIX if rotated else IDENTITY_MATRIX
+    tkhd = full_box(b"tkhd", 0, struct.pack(">IIIII", 0, 0, 1, 0, duration) + bytes(16) + struct.pack(">9i", *matrix)
+                    + struct.pack(">II", width << 16, height << 16))
+    hdlr = full_box(b"hdlr", 0, struct.pack(">I4s", 0, handler) + bytes(12) + b"\x00")
+    # A sample entry of the codec, its fields are not read
+    stsd = full_box(b"stsd", 0, struct.pack(">I", 1) + box(codec, bytes(78)))
+    # The sample tables of a real video index every frame, they make most of the size of the moov box
+    stsz = full_box(b"stsz", 0, struct.pack(">II", 0, duration // 20) + bytes(4 * (duration // 20)))
+    return box(b"trak", tkhd, box(b"mdia", hdlr, box(b"minf", box(b"stbl", stsd, stsz))))
+
+
+def quicktime_meta(creation_date: datetime) -> bytes:
+    key = b"com.apple.quicktime.creationdate"
+    keys = full_box(b"keys", 0, struct.pack(">I", 1) + box(b"mdta", key))
+    # Local time of the phone with its offset, as written by iOS
+    value = creation_date.astimezone(timezone(timedelta(hours=2))).strftime("%Y-%m-%dT%H:%M:%S%z").encode()
+    items = box(b"ilst", box(struct.pack(">I", 1), box(b"data", struct.pack(">II", 1, 0), value)))
+    hdlr = full_box(b"hdlr", 0, struct.pack(">I4s", 0, b"mdta") + bytes(12) + b"\x00")
+    return box(b"meta", hdlr, keys, items)
+
+
+def write_sample_video(path: str, size_bytes: int, creation_date: datetime, duration_s: float = 60, width: int = 3840,
+                       height: int = 2160, codec: bytes = b"hvc1", rotated: bool = False, faststart: bool = False) -> None:
+    duration = round(duration_s * TIMESCALE)
+    creation_time = int((creation_date - MP4_EPOCH).total_seconds())
+    mvhd = full_box(b"mvhd", 0, struct.pack(">IIII", creation_time, creation_time, TIMESCALE, duration) + bytes(80))
+    moov = box(b"moov", mvhd, track(b"vide", codec, duration, width, height, rotated),
+               track(b"soun", b"mp4a", duration, 0, 0, False), quicktime_meta(creation_date))
+    ftyp = box(b"ftyp", b"qt  ", struct.pack(">I", 0), b"qt  ")
+    with open(path, "wb") as file:
+        file.write(ftyp)
+        if faststart:
+            file.write(moov)
+        media_size = max(size_bytes - len(ftyp) - len(moov) - 16, 0)
+        # 64 bits size, as the media of a long video is above 4 Gb
+        file.write(struct.pack(">I4sQ", 1, b"mdat", 16 + media_size))
+        file.seek(media_size, 1)
+        if faststart:
+            file.truncate()
+        else:
+            file.write(moov)
@@ -0,0 +1,88 @@
+"""
+Local stand-in for the Telegram Bot API, answering the sendMessage calls of app/telegram_bot.py
+and keeping the messages received. With flood_messages, the first sendMessage calls are refused like Telegram
+does when a bot sends too many messages (429 with a retry_after).
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+
+
+class TelegramStandIn:
+
+    def __init__(self, token: str = "123456:benchmark", chat_id: str = "1", flood_messages: int = 0, retry_after: int = 1):
+        self.token = token
+        self.chat_id = chat_id
+        self.flood_messages = flood_messages
+        self.retry_after = retry_after
+        self.messages = [] # Text of the messages sent, in order
+        self.message_times = [] # time.monotonic() of each message sent
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/bot"
+
+    def __enter__(self) -> "TelegramStandIn":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def env(self) -> dict:
+        """
+        Environment variables pointing app/telegram_bot.py to this server.
+        """
+        return {"TELEGRAM_API_URL": self.base_url, "TELEGRAM_BOT_TOKEN": self.token, "TELEGRAM_CHAT_ID": self.chat_id}
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _reply(self, status: int, payload: dict) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _parameters(self) -> dict:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    return json.loads(body or "{}")
+                return {key: values[0] for key, values in parse_qs(body).items()}
+
+            def do_POST(self) -> None:
+                parameters = self._parameters()
+                prefix = f"/bot{stand_in.token}/"
+                if not self.path.startswith(prefix):
+                    self._reply(401, {"ok": False, "error_code": 401, "description": "Unauthorized"})
+                    return
+                method = self.path[len(prefix):]
+                if method == "getMe":
+                    self._reply(200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "benchmark", "username": "benchmark_bot"}})
+                elif method == "sendMessage" and stand_in.flood_messages > 0:
+                    stand_in.flood_messages -= 1
+                    self._reply(429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {stand_in.retry_after}",
+                                      "parameters": {"retry_after": stand_in.retry_after}})
+                elif method == "sendMessage":
+                    stand_in.messages.append(parameters.get("text"))
+                    stand_in.message_times.append(time.monotonic())
+                    self._reply(200, {"ok": True, "result": {"message_id": len(stand_in.messages), "date": int(time.time()),
+                                                             "chat": {"id": int(parameters.get("chat_id", stand_in.chat_id)), "type": "private"},
+                                                             "text": parameters.get("text")}})
+                else:
+                    self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+        return Handler
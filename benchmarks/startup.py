@@ -0,0 +1,70 @@
+"""
+Measure the cold start of main.py with `python -X importtime`: total import time of main, the slowest
+imported packages, and the cost of each plugin, which is only paid when an event enables it.
+
+    python benchmarks/startup.py --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import typing as ty
+
+APP_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_FOLDER)
+
+from plugins import PLUGINS
+
+
+def import_times(statement: str) -> ty.Dict[str, int]:
+    """
+    Run the statement in a new interpreter and return the cumulative import time (us) of every module it imported.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=APP_FOLDER,
+                               capture_output=True, text=True, check=True)
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def median_import_times(statement: str, runs: int) -> ty.Dict[str, float]:
+    samples = [import_times(statement) for _ in range(runs)]
+    modules = set().union(*samples)
+    return {module: statistics.median(sample.get(module, 0) for sample in samples) for module in modules}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Interpreters started for each measure, the median is kept")
+    parser.add_argument("--top", type=int, default=15, help="Slowest top level packages displayed")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    main_times = median_import_times("import main", args.runs)
+    top_level_packages = {module: time for module, time in main_times.items() if "." not in module}
+    print(f"import main : {main_times['main'] / 1000:.1f} ms (median of {args.runs} runs)")
+    for module, time in sorted(top_level_packages.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"  {module:<30} {time / 1000:8.1f} ms")
+
+    print("Plugins, imported only when the event enables them :")
+    plugin_times = {}
+    for name, (module_name, event_setting) in PLUGINS.items():
+        times = median_import_times(f"import main; import {module_name}", args.runs)
+        plugin_times[name] = times[module_name]
+        print(f"  {name:<30} {times[module_name] / 1000:8.1f} ms  ({event_setting})")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"main_ms": main_times["main"] / 1000,
+                       "packages_ms": {module: time / 1000 for module, time in top_level_packages.items()},
+                       "plugins_ms": {name: time / 1000 for name, time in plugin_times.items()}}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
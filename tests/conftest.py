@@ -0,0 +1,54 @@
+import os
+import sys
+import typing as ty
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+
+from definitions import Event, VideoBasicInfos
+from standins.nextcloud_server import NextcloudStandIn
+
+
+EVENT_SETTINGS = dict(event_start="19:45", event_stop="22:30", complex_naming=False, video_title="Test", complex_name_format_helper=None,
+                      title_end_with_date=True, event_timezone="Romance Standard Time", delete_videos_from_iphone=False,
+                      validation_videos_found=False, S3_upload=False, S3_storage_class=None, S3_bucket=None, S3_folder=None,
+                      nextcloud_upload=False, nextcloud_folder=None, nextcloud_public_share=None, nextcloud_telegram_notification=None)
+NEXTCLOUD_FOLDER = "Events/Test"
+
+
+@pytest.fixture
+def make_event() -> ty.Callable[..., Event]:
+    """
+    Return a factory of events without any destination, the given settings replacing the default ones.
+    """
+    def make_event(**settings) -> Event:
+        return Event(**{**EVENT_SETTINGS, **settings})
+    return make_event
+
+
+@pytest.fixture
+def make_video() -> ty.Callable[..., VideoBasicInfos]:
+    """
+    Return a factory of listed videos, created at the given UTC date (YYYY-MM-DD HH:MM:SS).
+    """
+    def make_video(name: str, creation_date_utc: str, size_bytes: int = 1024) -> VideoBasicInfos:
+        return VideoBasicInfos(size_mb=0, creation_date="", original_name=name, device_id=f"202405__/{name}",
+                               size_bytes=size_bytes, creation_date_utc=creation_date_utc)
+    return make_video
+
+
+@pytest.fixture
+def nextcloud_server(tmp_path, monkeypatch) -> ty.Iterator[NextcloudStandIn]:
+    """
+    Return a local stand-in of Nextcloud used by nextcloud.py, with the NEXTCLOUD_FOLDER already created.
+    """
+    import nextcloud
+    with NextcloudStandIn(str(tmp_path / "nextcloud")) as server:
+        for name, value in server.env().items():
+            monkeypatch.setenv(name, value)
+        nextcloud.get_nextcloud_client.cache_clear()
+        nextcloud.get_nextcloud_client().create_folders_if_they_do_not_exist(NEXTCLOUD_FOLDER)
+        yield server
+    nextcloud.get_nextcloud_client.cache_clear()
@@ -0,0 +1,84 @@
+import calendar
+from datetime import datetime
+import os
+
+import pytest
+
+from definitions import Inputs
+from device import LocalDirectoryDeviceSession
+
+
+def write_video(folder, name: str, creation_date_utc: str, size_bytes: int = 4096) -> None:
+    """
+    Write a video which is not a MP4 file : the listing uses its modification time as creation date.
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    with open(path, "wb") as file:
+        file.write(os.urandom(size_bytes))
+    timestamp = calendar.timegm(datetime.strptime(creation_date_utc, "%Y-%m-%d %H:%M:%S").timetuple())
+    os.utime(path, (timestamp, timestamp))
+
+
+@pytest.fixture
+def device_folder(tmp_path):
+    write_video(tmp_path / "device" / "202405__", "IMG_0002.MOV", "2024-05-12 18:30:00")
+    write_video(tmp_path / "device" / "202405__", "IMG_0001.mp4", "2024-05-12 18:00:00", size_bytes=8192)
+    write_video(tmp_path / "device" / "202405__", "IMG_0003.MOV", "2024-05-20 18:00:00")
+    write_video(tmp_path / "device" / "202405__", "notes.txt", "2024-05-12 18:00:00")
+    # The month folders outside of the range are not walked
+    write_video(tmp_path / "device" / "202401__", "IMG_0000.MOV", "2024-05-12 18:00:00")
+    return tmp_path / "device"
+
+
+def test_list_videos_of_a_date_range(device_folder, tmp_path):
+    session = LocalDirectoryDeviceSession(None, str(device_folder), str(tmp_path / "destination"), date_range=("12/05/2024", "12/05/2024"))
+    videos = session.list_videos()
+    assert [(video.device_id, video.creation_date_utc, video.size_bytes) for video in videos] == [
+        ("202405__/IMG_0001.mp4", "2024-05-12 18:00:00", 8192), ("202405__/IMG_0002.MOV", "2024-05-12 18:30:00", 4096)]
+
+
+def test_list_videos_of_the_event_window(device_folder, tmp_path, make_event):
+    inputs_result = Inputs(day="12/05/2024", event=make_event(event_start="20:15", event_stop="22:00"), complex_title_end=None)
+    session = LocalDirectoryDeviceSession(inputs_result, str(device_folder), str(tmp_path / "destination"))
+    assert [(video.original_name, video.creation_date) for video in session.list_videos()] == [("IMG_0002.MOV", "12/05/2024 20:30")]
+
+
+def test_missing_device_folder_raises_value_error(tmp_path):
+    session = LocalDirectoryDeviceSession(None, str(tmp_path / "unplugged"), str(tmp_path / "destination"), date_range=("12/05/2024", "12/05/2024"))
+    with pytest.raises(ValueError, match="not found"):
+        session.list_videos()
+
+
+def test_copy_and_delete_videos(device_folder, tmp_path):
+    destination_folder = tmp_path / "destination"
+    with LocalDirectoryDeviceSession(None, str(device_folder), str(destination_folder), date_range=("12/05/2024", "12/05/2024")) as session:
+        videos = session.list_videos()
+        assert session.source_path(videos[0]) == os.path.join(str(device_folder), "202405__/IMG_0001.mp4")
+        copied_videos = list(session.copy_videos(videos))
+        assert sorted(video.original_name for video in copied_videos) == ["IMG_0001.mp4", "IMG_0002.MOV"]
+        # No partial copy left
+        assert sorted(os.listdir(destination_folder)) == ["IMG_0001.mp4", "IMG_0002.MOV"]
+        for video in videos:
+            assert (destination_folder / video.original_name).read_bytes() == (device_folder / video.device_id).read_bytes()
+        session.delete_videos(videos)
+    assert sorted(os.listdir(device_folder / "202405__")) == ["IMG_0003.MOV", "notes.txt"]
+
+
+def test_copy_refuses_to_overwrite_a_file(device_folder, tmp_path):
+    destination_folder = tmp_path / "destination"
+    destination_folder.mkdir()
+    (destination_folder / "IMG_0002.MOV").write_bytes(b"previous")
+    session = LocalDirectoryDeviceSession(None, str(device_folder), str(destination_folder), date_range=("12/05/2024", "12/05/2024"))
+    with pytest.raises(ValueError, match="Destination file exists"):
+        list(session.copy_videos(session.list_videos()))
+    assert (destination_folder / "IMG_0002.MOV").read_bytes() == b"previous"
+
+
+def test_videos_outside_of_the_manifest_are_refused(device_folder, tmp_path, make_video):
+    session = LocalDirectoryDeviceSession(None, str(device_folder), str(tmp_path / "destination"), date_range=("12/05/2024", "12/05/2024"))
+    with pytest.raises(ValueError, match="listed before"):
+        session.delete_videos([make_video("IMG_0001.mp4", "2024-05-12 18:00:00")])
+    session.list_videos()
+    with pytest.raises(ValueError, match="not part of the device manifest"):
+        session.delete_videos([make_video("IMG_0003.MOV", "2024-05-20 18:00:00")])
@@ -0,0 +1,75 @@
+import calendar
+from datetime import datetime
+import os
+
+import pytest
+
+from definitions import DeviceEventType
+from device_protocol import parse_device_event, read_device_events, video_from_listing
+from powershell_calls import PowershellDeviceSession
+
+STANDINS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "standins")
+RECORDING_PATH = os.path.join(STANDINS_FOLDER, "recordings", "powershell_session.ndjson")
+
+
+def test_read_device_events_of_a_recorded_session():
+    with open(RECORDING_PATH) as recording:
+        events = list(read_device_events(recording))
+    # The warning line of the recording is not an event
+    assert [event.event for event in events] == [DeviceEventType.LISTED] * 3 + [DeviceEventType.LISTING_DONE] + [
+        DeviceEventType.COPY_STARTED, DeviceEventType.COPIED] * 2 + [DeviceEventType.DONE, DeviceEventType.DELETED, DeviceEventType.DELETED, DeviceEventType.DONE]
+    copied = events[5]
+    assert (copied.id, copied.size_bytes, copied.seconds) == ("202405__/IMG_0001.MOV", 3145728, 0.41)
+
+
+def test_video_from_listing_keeps_the_utc_creation_date():
+    with open(RECORDING_PATH) as recording:
+        listed = next(read_device_events(recording))
+    video = video_from_listing(listed.video)
+    assert (video.device_id, video.original_name, video.size_bytes, video.size_mb) == ("202405__/IMG_0001.MOV", "IMG_0001.MOV", 3145728, 3)
+    assert (video.creation_date_utc, video.creation_date) == ("2024-05-12 17:02:11", "12/05/2024 17:02")
+
+
+@pytest.mark.parametrize("line", ["", "WARNING: something", "[1, 2]", '{"video": {}}'])
+def test_lines_which_are_not_events_are_ignored(line):
+    assert parse_device_event(line) is None
+
+
+def test_malformed_event_raises_value_error():
+    with pytest.raises(ValueError, match="Malformed event"):
+        parse_device_event('{"event": "exploded"}')
+
+
+def test_powershell_session_lists_copies_and_deletes(tmp_path, monkeypatch):
+    device_folder = tmp_path / "device" / "202405__"
+    device_folder.mkdir(parents=True)
+    for name, date in [("IMG_0001.MOV", "2024-05-12 17:02:11"), ("IMG_0002.MOV", "2024-05-12 17:31:40")]:
+        (device_folder / name).write_bytes(os.urandom(2048))
+        timestamp = calendar.timegm(datetime.strptime(date, "%Y-%m-%d %H:%M:%S").timetuple())
+        os.utime(device_folder / name, (timestamp, timestamp))
+    destination_folder = tmp_path / "destination"
+    monkeypatch.setenv("POWERSHELL_EXECUTABLE", os.path.join(STANDINS_FOLDER, "fake_powershell.py"))
+    monkeypatch.setenv("FAKE_POWERSHELL_DEVICE_FOLDER", str(tmp_path / "device"))
+    monkeypatch.setenv("WINDOWS_DESTINATION_FOLDER", str(destination_folder))
+
+    with PowershellDeviceSession(None, ("12/05/2024", "12/05/2024")) as session:
+        videos = session.list_videos()
+        assert [(video.device_id, video.creation_date_utc) for video in videos] == [
+            ("202405__/IMG_0001.MOV", "2024-05-12 17:02:11"), ("202405__/IMG_0002.MOV", "2024-05-12 17:31:40")]
+        copied_videos = list(session.copy_videos(videos))
+        assert [video.original_name for video in copied_videos] == ["IMG_0001.MOV", "IMG_0002.MOV"]
+        assert sorted(os.listdir(destination_folder)) == ["IMG_0001.MOV", "IMG_0002.MOV"]
+        session.delete_videos(videos[:1])
+    assert os.listdir(device_folder) == ["IMG_0002.MOV"]
+
+
+def test_powershell_session_raises_the_errors_of_the_script(tmp_path, monkeypatch):
+    (tmp_path / "device" / "202405__").mkdir(parents=True)
+    monkeypatch.setenv("POWERSHELL_EXECUTABLE", os.path.join(STANDINS_FOLDER, "fake_powershell.py"))
+    monkeypatch.setenv("FAKE_POWERSHELL_DEVICE_FOLDER", str(tmp_path / "device"))
+    monkeypatch.setenv("WINDOWS_DESTINATION_FOLDER", str(tmp_path / "destination"))
+
+    with PowershellDeviceSession(None, ("12/05/2024", "12/05/2024")) as session:
+        assert session.list_videos() == []
+        with pytest.raises(ValueError, match="not found in the device manifest"):
+            list(session._copy_items(["202405__/IMG_0404.MOV"]))
@@ -0,0 +1,90 @@
+from datetime import datetime, timezone
+
+from event_windows import EventWindowIndex, assign_videos_to_events, build_event_window, build_event_windows, select_videos_in_window
+
+
+def test_window_is_converted_to_utc(make_event):
+    window = build_event_window(make_event(event_start="19:45", event_stop="22:30"), "12/05/2024")
+    assert window.start_utc == datetime(2024, 5, 12, 17, 45, tzinfo=timezone.utc)
+    assert window.stop_utc == datetime(2024, 5, 12, 20, 30, tzinfo=timezone.utc)
+
+
+def test_window_stopping_before_it_starts_ends_the_next_day(make_event):
+    window = build_event_window(make_event(event_start="23:00", event_stop="01:00"), "12/05/2024")
+    assert window.start_utc == datetime(2024, 5, 12, 21, 0, tzinfo=timezone.utc)
+    assert window.stop_utc == datetime(2024, 5, 12, 23, 0, tzinfo=timezone.utc)
+
+
+def test_select_videos_in_window(make_event, make_video):
+    window = build_event_window(make_event(), "12/05/2024")
+    videos = [
+        make_video("late.MOV", "2024-05-12 20:30:00"), # Last second of the window
+        make_video("first.MOV", "2024-05-12 17:45:00"), # First second of the window
+        make_video("middle.MOV", "2024-05-12 19:00:30"),
+        make_video("before.MOV", "2024-05-12 17:44:59"),
+        make_video("after.MOV", "2024-05-12 20:30:01"),
+        make_video("other_day.MOV", "2024-05-13 18:00:00"),
+    ]
+    selected_videos = select_videos_in_window(videos, window)
+    assert [video.original_name for video in selected_videos] == ["first.MOV", "middle.MOV", "late.MOV"]
+    # Displayed in the timezone of the event
+    assert [video.creation_date for video in selected_videos] == ["12/05/2024 19:45", "12/05/2024 21:00", "12/05/2024 22:30"]
+
+
+def test_select_videos_in_window_of_another_timezone(make_event, make_video):
+    window = build_event_window(make_event(event_start="10:00", event_stop="12:00", event_timezone="Eastern Standard Time"), "12/05/2024")
+    selected_videos = select_videos_in_window([make_video("a.MOV", "2024-05-12 14:30:00"), make_video("b.MOV", "2024-05-12 10:30:00")], window)
+    assert [(video.original_name, video.creation_date) for video in selected_videos] == [("a.MOV", "12/05/2024 10:30")]
+
+
+def test_index_finds_the_window_of_a_moment(make_event):
+    windows = build_event_windows([make_event(video_title="Evening"), make_event(video_title="Night", event_start="23:00", event_stop="01:00")],
+                                  "11/05/2024", "13/05/2024")
+    index = EventWindowIndex(windows)
+    assert [window.event.video_title for window in index.find_all(datetime(2024, 5, 12, 18, 0, tzinfo=timezone.utc))] == ["Evening"]
+    night_window, = index.find_all(datetime(2024, 5, 12, 22, 30, tzinfo=timezone.utc))
+    assert (night_window.event.video_title, night_window.day) == ("Night", "12/05/2024")
+    assert index.find_all(datetime(2024, 5, 12, 12, 0, tzinfo=timezone.utc)) == []
+
+
+def test_index_finds_the_overlapping_windows_of_a_moment(make_event):
+    windows = build_event_windows([make_event(video_title="Wolves", event_start="19:30", event_stop="22:05"),
+                                   make_event(video_title="Football", event_start="18:15", event_stop="20:05")], "12/05/2024", "12/05/2024")
+    index = EventWindowIndex(windows)
+    assert [window.event.video_title for window in index.find_all(datetime(2024, 5, 12, 17, 45, tzinfo=timezone.utc))] == ["Football", "Wolves"]
+    assert [window.event.video_title for window in index.find_all(datetime(2024, 5, 12, 18, 30, tzinfo=timezone.utc))] == ["Wolves"]
+
+
+def test_assign_videos_to_events_over_a_date_range(make_event, make_video):
+    events = [make_event(video_title="Evening"), make_event(video_title="Night", event_start="23:00", event_stop="01:00")]
+    videos = [
+        make_video("IMG_3.MOV", "2024-05-13 18:00:00"),
+        make_video("IMG_2.MOV", "2024-05-12 22:30:00"),
+        make_video("IMG_1.MOV", "2024-05-12 18:10:00"),
+        make_video("IMG_0.MOV", "2024-05-12 18:00:00"),
+        make_video("IMG_9.MOV", "2024-05-12 12:00:00"), # Outside of every window
+    ]
+    groups = assign_videos_to_events(videos, events, "12/05/2024", "13/05/2024")
+    assert [(window.event.video_title, window.day, [video.original_name for video in group]) for window, group in groups] == [
+        ("Evening", "12/05/2024", ["IMG_0.MOV", "IMG_1.MOV"]),
+        ("Night", "12/05/2024", ["IMG_2.MOV"]),
+        ("Evening", "13/05/2024", ["IMG_3.MOV"]),
+    ]
+
+
+def test_videos_of_overlapping_windows_are_left_on_the_device(make_event, make_video, capsys):
+    events = [make_event(video_title="Wolves", event_start="19:30", event_stop="22:05"),
+              make_event(video_title="Football", event_start="18:15", event_stop="20:05")]
+    videos = [
+        make_video("IMG_1.MOV", "2024-05-12 16:30:00"), # Football only
+        make_video("IMG_2.MOV", "2024-05-12 17:45:00"), # Both events
+        make_video("IMG_3.MOV", "2024-05-12 19:00:00"), # Wolves only
+    ]
+    groups = assign_videos_to_events(videos, events, "12/05/2024", "12/05/2024")
+    assert [(window.event.video_title, [video.original_name for video in group]) for window, group in groups] == [
+        ("Football", ["IMG_1.MOV"]),
+        ("Wolves", ["IMG_3.MOV"]),
+    ]
+    output = capsys.readouterr().out
+    assert "1 video(s) created during the windows of several events" in output
+    assert "IMG_2.MOV (12/05/2024 19:45) : Football on 12/05/2024, Wolves on 12/05/2024" in output
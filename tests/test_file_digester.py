@@ -0,0 +1,41 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from checksums import FileDigester
+
+PART_SIZE = 1000
+
+
+def feed(digester: FileDigester, data: bytes, block_size: int = 300) -> None:
+    for position in range(0, len(data), block_size):
+        digester.update(data[position:position + block_size])
+
+
+def test_part_md5s_are_given_to_the_threads_waiting_for_them():
+    data = os.urandom(2 * PART_SIZE + 500)
+    digester = FileDigester(PART_SIZE)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        # The last part is only known with the digests of the whole file
+        futures = [executor.submit(digester.wait_part_md5, part_number) for part_number in (1, 2, 3)]
+        feed(digester, data)
+        digester.digests()
+        part_md5s = [future.result(timeout=5) for future in futures]
+    assert part_md5s == [hashlib.md5(data[position:position + PART_SIZE]).hexdigest() for position in range(0, len(data), PART_SIZE)]
+    assert digester.wait_digests().md5 == hashlib.md5(data).hexdigest()
+
+
+def test_abort_stops_the_waits():
+    digester = FileDigester(PART_SIZE)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        part_future = executor.submit(digester.wait_part_md5, 2)
+        digests_future = executor.submit(digester.wait_digests)
+        feed(digester, os.urandom(PART_SIZE + 100))
+        digester.abort()
+        with pytest.raises(ValueError, match="part 2"):
+            part_future.result(timeout=5)
+        with pytest.raises(ValueError, match="could not be computed"):
+            digests_future.result(timeout=5)
+    assert digester.wait_part_md5(1) == digester.part_md5s[0]
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+import struct
+
+import pytest
+
+from mp4_metadata import parse_moov, read_container_metadata
+from standins.sample_videos import MP4_EPOCH, TIMESCALE, full_box, quicktime_meta, track, write_sample_video
+
+CREATION_DATE = datetime(2024, 5, 12, 18, 3, 21, tzinfo=timezone.utc)
+CREATION_TIME = int((CREATION_DATE - MP4_EPOCH).total_seconds())
+
+
+def movie_header(version: int, creation_time: int = CREATION_TIME, duration_s: float = 754) -> bytes:
+    if version == 1:
+        return full_box(b"mvhd", 1, struct.pack(">QQIQ", creation_time, creation_time, TIMESCALE, round(duration_s * TIMESCALE)) + bytes(80))
+    return full_box(b"mvhd", 0, struct.pack(">IIII", creation_time, creation_time, TIMESCALE, round(duration_s * TIMESCALE)) + bytes(80))
+
+
+def moov_content(*boxes: bytes) -> memoryview:
+    return memoryview(b"".join(boxes))
+
+
+def test_movie_header_version_0():
+    metadata = parse_moov(moov_content(movie_header(0), track(b"vide", b"hvc1", 600, 3840, 2160, False)))
+    assert metadata.creation_date_utc == "2024-05-12 18:03:21"
+    assert metadata.duration_s == 754
+    assert (metadata.width, metadata.height, metadata.codec) == (3840, 2160, "hvc1")
+
+
+def test_movie_header_version_1():
+    # 64 bits times, past 2040 for a 32 bits count of seconds from 1904
+    creation_time = int((datetime(2041, 1, 1, tzinfo=timezone.utc) - MP4_EPOCH).total_seconds())
+    metadata = parse_moov(moov_content(movie_header(1, creation_time, duration_s=12.5)))
+    assert metadata.creation_date_utc == "2041-01-01 00:00:00"
+    assert metadata.duration_s == 12.5
+    assert metadata.codec is None
+
+
+def test_unset_creation_time():
+    metadata = parse_moov(moov_content(movie_header(0, creation_time=0)))
+    assert metadata.creation_date_utc is None
+    assert metadata.duration_s == 754
+
+
+def test_rotated_track_size_is_turned():
+    metadata = parse_moov(moov_content(movie_header(0), track(b"vide", b"avc1", 600, 1920, 1080, True)))
+    assert (metadata.width, metadata.height, metadata.codec) == (1080, 1920, "avc1")
+
+
+def test_size_and_codec_of_the_video_track():
+    metadata = parse_moov(moov_content(movie_header(0), track(b"soun", b"mp4a", 600, 0, 0, False),
+                                       track(b"vide", b"hvc1", 600, 3840, 2160, False)))
+    assert (metadata.width, metadata.height, metadata.codec) == (3840, 2160, "hvc1")
+
+
+def test_quicktime_creation_date_is_preferred_to_the_movie_header():
+    # The camera wrote its local time in mvhd, the QuickTime key holds the time with its UTC offset
+    local_time = int((datetime(2024, 5, 12, 20, 3, 21, tzinfo=timezone.utc) - MP4_EPOCH).total_seconds())
+    metadata = parse_moov(moov_content(movie_header(0, local_time), quicktime_meta(CREATION_DATE)))
+    assert metadata.creation_date_utc == "2024-05-12 18:03:21"
+
+
+def test_quicktime_creation_date_in_a_meta_box_with_version():
+    # The same boxes after the version and flags of an ISO meta box
+    metadata = parse_moov(moov_content(full_box(b"meta", 0, quicktime_meta(CREATION_DATE)[8:])))
+    assert metadata.creation_date_utc == "2024-05-12 18:03:21"
+
+
+def test_truncated_box_raises_an_error():
+    content = movie_header(0) + track(b"vide", b"hvc1", 600, 3840, 2160, False)
+    with pytest.raises(ValueError, match="overflows its parent"):
+        parse_moov(moov_content(content[:-10]))
+
+
+@pytest.mark.parametrize("faststart", [False, True])
+def test_read_container_metadata_of_a_video(tmp_path, faststart):
+    path = str(tmp_path / "IMG_0001.MOV")
+    write_sample_video(path, 64 * 1024 * 1024, CREATION_DATE, duration_s=754, rotated=True, faststart=faststart)
+    metadata = read_container_metadata(path)
+    assert metadata.creation_date_utc == "2024-05-12 18:03:21"
+    assert metadata.duration_s == 754
+    assert (metadata.width, metadata.height, metadata.codec) == (2160, 3840, "hvc1")
+
+
+def test_read_container_metadata_of_other_files(tmp_path):
+    path = tmp_path / "notes.MOV"
+    path.write_bytes(b"not a video" * 10)
+    assert read_container_metadata(str(path)) is None
+
+
+def test_read_container_metadata_of_a_truncated_video(tmp_path):
+    path = str(tmp_path / "IMG_0001.MOV")
+    write_sample_video(path, 1024 * 1024, CREATION_DATE)
+    with open(path, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 100)
+    with pytest.raises(ValueError, match="Malformed video container"):
+        read_container_metadata(path)
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from definitions import VideoInfosWrapper
+import nextcloud
+
+MB = 1024 * 1024
+FOLDER = "Events/Test" # Created by the nextcloud_server fixture
+
+
+@pytest.fixture
+def video(tmp_path, make_video) -> VideoInfosWrapper:
+    path = tmp_path / "Test 1.MOV"
+    path.write_bytes(os.urandom(3 * MB + 1000))
+    return VideoInfosWrapper(video_basic_infos=make_video("IMG_0001.MOV", "2024-05-12 18:00:00"), new_name="Test 1.MOV", wsl_full_path=str(path))
+
+
+def interrupt_before_assembling(video: VideoInfosWrapper, event, monkeypatch) -> None:
+    """
+    Send the chunks of the video, and stop before their assembly like an interrupted run.
+    """
+    def assemble_chunks(*args) -> None:
+        raise ValueError("Interrupted")
+    with monkeypatch.context() as patch:
+        patch.setattr(nextcloud.NextcloudClient, "assemble_chunks", assemble_chunks)
+        with pytest.raises(ValueError, match="Interrupted"):
+            nextcloud.get_nextcloud_client().upload_video_in_chunks(video, FOLDER, event)
+
+
+def uploaded_file(nextcloud_server) -> bytes:
+    with open(os.path.join(nextcloud_server.files_root, FOLDER, "Test 1.MOV"), "rb") as file:
+        return file.read()
+
+
+def test_interrupted_upload_is_resumed(nextcloud_server, video, make_event, monkeypatch):
+    event = make_event(nextcloud_chunked_upload=True, nextcloud_chunk_size_mb=1)
+    interrupt_before_assembling(video, event, monkeypatch)
+    puts = nextcloud_server.requests["PUT"]
+    nextcloud.get_nextcloud_client().upload_video_in_chunks(video, FOLDER, event)
+    assert nextcloud_server.requests["PUT"] == puts
+    with open(video.wsl_full_path, "rb") as file:
+        assert uploaded_file(nextcloud_server) == file.read()
+
+
+def test_chunks_beyond_the_end_of_the_file_are_removed(nextcloud_server, video, make_event, monkeypatch):
+    event = make_event(nextcloud_chunked_upload=True, nextcloud_chunk_size_mb=1)
+    interrupt_before_assembling(video, event, monkeypatch)
+    upload_folder, = os.listdir(nextcloud_server.uploads_root)
+    with open(os.path.join(nextcloud_server.uploads_root, upload_folder, "7"), "wb") as file:
+        file.write(b"left by an older upload")
+    nextcloud.get_nextcloud_client().upload_video_in_chunks(video, FOLDER, event)
+    with open(video.wsl_full_path, "rb") as file:
+        assert uploaded_file(nextcloud_server) == file.read()
+
+
+def test_chunks_of_another_size_are_not_resumed(nextcloud_server, video, make_event, monkeypatch):
+    interrupt_before_assembling(video, make_event(nextcloud_chunked_upload=True, nextcloud_chunk_size_mb=1), monkeypatch)
+    nextcloud.get_nextcloud_client().upload_video_in_chunks(video, FOLDER, make_event(nextcloud_chunked_upload=True, nextcloud_chunk_size_mb=2))
+    with open(video.wsl_full_path, "rb") as file:
+        assert uploaded_file(nextcloud_server) == file.read()
+    # The upload folder of the first chunk size is left for the expiry of Nextcloud
+    assert len(os.listdir(nextcloud_server.uploads_root)) == 1
@@ -0,0 +1,52 @@
+import os
+import shutil
+
+import pytest
+
+from definitions import VideoInfosWrapper
+from nextcloud import NextcloudStreamSink
+
+MB = 1024 * 1024
+FOLDER = "Events/Test" # Created by the nextcloud_server fixture
+
+
+def stream(sink: NextcloudStreamSink, data: bytes, block_size: int = 256 * 1024) -> str:
+    for position in range(0, len(data), block_size):
+        sink.write(data[position:position + block_size])
+    return sink.close()
+
+
+def open_sink(make_event, make_video, size_bytes: int) -> NextcloudStreamSink:
+    video = VideoInfosWrapper(video_basic_infos=make_video("IMG_0001.MOV", "2024-05-12 18:00:00"), new_name="Test 1.MOV", wsl_full_path="unused")
+    return NextcloudStreamSink(video, size_bytes, FOLDER, make_event(nextcloud_chunk_size_mb=1, nextcloud_chunk_workers=2))
+
+
+def test_streamed_chunks_are_assembled(nextcloud_server, make_event, make_video):
+    data = os.urandom(2 * MB + 1000)
+    location = stream(open_sink(make_event, make_video, len(data)), data)
+    assert location == f"{FOLDER}/Test 1.MOV"
+    with open(os.path.join(nextcloud_server.files_root, FOLDER, "Test 1.MOV"), "rb") as file:
+        assert file.read() == data
+    # Every chunk was accepted, with the total length of the file
+    assert nextcloud_server.requests["PUT"] == 3
+    assert os.listdir(nextcloud_server.uploads_root) == []
+
+
+def test_missing_folder_is_created_before_assembling_again(nextcloud_server, make_event, make_video):
+    data = os.urandom(MB + 1000)
+    sink = open_sink(make_event, make_video, len(data))
+    sink.write(data)
+    # The event folder was removed on the server meanwhile, the folder cache of the client still has it
+    shutil.rmtree(os.path.join(nextcloud_server.files_root, "Events"))
+    assert sink.close() == f"{FOLDER}/Test 1.MOV"
+    with open(os.path.join(nextcloud_server.files_root, FOLDER, "Test 1.MOV"), "rb") as file:
+        assert file.read() == data
+    assert nextcloud_server.requests["MOVE"] == 2
+
+
+def test_short_read_aborts_the_upload(nextcloud_server, make_event, make_video):
+    data = os.urandom(MB + 1000)
+    with pytest.raises(ValueError, match="instead of"):
+        stream(open_sink(make_event, make_video, len(data) + 1), data)
+    assert os.listdir(nextcloud_server.uploads_root) == []
+    assert not os.path.exists(os.path.join(nextcloud_server.files_root, FOLDER, "Test 1.MOV"))
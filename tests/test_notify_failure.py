@@ -0,0 +1,35 @@
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import pytest
+import requests
+
+from definitions import Inputs
+import main
+
+
+class FailingDispatcher:
+    """
+    Dispatcher whose notifications fail with the given error.
+    """
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def notify(self, notification_type, text: str) -> Future:
+        future = Future()
+        future.set_exception(self.error)
+        return future
+
+
+# No answer from Telegram in time (not the built-in TimeoutError before Python 3.11), and a network error
+@pytest.mark.parametrize("error", [FutureTimeoutError(), requests.ConnectionError("Connection reset")])
+def test_failed_notification_does_not_hide_the_archive_error(error, make_event, monkeypatch, capsys):
+    monkeypatch.setattr(main, "get_notification_dispatcher", lambda event: FailingDispatcher(error))
+
+    def archive_event_videos(*args) -> None:
+        raise ValueError("Copy failed")
+    monkeypatch.setattr(main, "archive_event_videos", archive_event_videos)
+    inputs_result = Inputs(event=make_event(telegram_failure_notification=True), day="12/05/2024", complex_title_end=None)
+    with pytest.raises(ValueError, match="Copy failed"):
+        main.archive_videos(None, inputs_result, [])
+    assert "Failed to notify the failure on Telegram" in capsys.readouterr().out
@@ -0,0 +1,191 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import threading
+import time
+import typing as ty
+
+import pytest
+import requests
+
+from metrics import METRICS
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, send_request
+from standins.faulty_proxy import FaultyProxy
+
+# Short timeouts and no wait between the attempts
+POLICY = RetryPolicy(connect_timeout_s=1, read_timeout_s=0.5, max_attempts=4, backoff_base_s=0.001, backoff_max_s=0.001)
+
+
+class EchoServer:
+    """
+    Server answering 200 to every request, and keeping the bodies it received.
+    """
+
+    def __init__(self):
+        self.bodies: ty.List[bytes] = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _answer(self) -> None:
+                server.bodies.append(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            do_GET = do_PUT = do_POST = _answer
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def echo_server() -> ty.Iterator[EchoServer]:
+    server = EchoServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def reset_network_state():
+    METRICS.reset()
+    resilience.CIRCUIT_BREAKERS.clear()
+    yield
+    resilience.CIRCUIT_BREAKERS.clear()
+
+
+def test_server_errors_are_retried_until_success(echo_server):
+    with FaultyProxy(echo_server.base_url, error_rate=0.5, seed=3) as proxy, requests.Session() as session:
+        responses = [send_request(session, "GET", f"{proxy.base_url}video", "test", POLICY) for _ in range(10)]
+    assert [response.status_code for response in responses] == [200] * 10
+    assert proxy.faults["error"] > 0
+    assert METRICS.counters[("retry", "test")] == proxy.faults["error"]
+
+
+def test_last_answer_is_returned_after_the_last_attempt(echo_server):
+    with FaultyProxy(echo_server.base_url, error_rate=1) as proxy, requests.Session() as session:
+        response = send_request(session, "GET", proxy.base_url, "test", POLICY)
+    assert response.status_code == 503
+    assert proxy.faults["error"] == POLICY.max_attempts
+    assert echo_server.bodies == []
+
+
+def test_stalled_requests_time_out_and_are_retried(echo_server):
+    with FaultyProxy(echo_server.base_url, stall_rate=0.5, stall_s=1, seed=1) as proxy, requests.Session() as session:
+        responses = [send_request(session, "GET", proxy.base_url, "test", POLICY) for _ in range(4)]
+    assert [response.status_code for response in responses] == [200] * 4
+    assert proxy.faults["stall"] > 0
+    assert METRICS.counters[("retry", "test")] == proxy.faults["stall"]
+
+
+def test_request_which_is_not_idempotent_is_not_sent_again_after_a_lost_answer(echo_server):
+    with FaultyProxy(echo_server.base_url, reset_rate=1) as proxy, requests.Session() as session:
+        with pytest.raises(ValueError, match="failed after 1 attempt"):
+            send_request(session, "POST", proxy.base_url, "test", POLICY, data=b"share")
+    assert proxy.faults["reset"] == 1
+
+
+def test_file_body_is_sent_again_from_its_start(echo_server):
+    body = io.BytesIO(b"header" + b"chunk" * 1000)
+    body.seek(6)
+    with FaultyProxy(echo_server.base_url, reset_rate=0.5, seed=3) as proxy, requests.Session() as session:
+        response = send_request(session, "PUT", proxy.base_url, "test", POLICY, data=body)
+    assert response.status_code == 200
+    assert proxy.faults["reset"] > 0
+    assert echo_server.bodies == [b"chunk" * 1000]
+
+
+def test_circuit_breaker_opens_after_failures_in_a_row_then_probes_the_host():
+    circuit_breaker = CircuitBreaker("host", failure_threshold=3, reset_s=0.2)
+    for _ in range(2):
+        circuit_breaker.check()
+        circuit_breaker.record_failure("test")
+    circuit_breaker.record_success()
+    # The failures have to be in a row
+    for _ in range(2):
+        circuit_breaker.record_failure("test")
+    circuit_breaker.check()
+    circuit_breaker.record_failure("test")
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.check()
+    assert METRICS.counters[("circuit_opened", "test")] == 1
+
+    time.sleep(0.25)
+    # One request probes the host, the others still fail at once
+    circuit_breaker.check()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.check()
+    circuit_breaker.record_success()
+    circuit_breaker.check()
+
+
+def test_failed_probe_opens_the_circuit_again():
+    circuit_breaker = CircuitBreaker("host", failure_threshold=1, reset_s=0.1)
+    circuit_breaker.record_failure()
+    time.sleep(0.15)
+    circuit_breaker.check()
+    circuit_breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.check()
+
+
+def test_open_circuit_fails_the_requests_without_sending_them(echo_server, monkeypatch):
+    monkeypatch.setenv("CIRCUIT_BREAKER_FAILURES", "2")
+    monkeypatch.setenv("CIRCUIT_BREAKER_RESET_S", "60")
+    with FaultyProxy(echo_server.base_url, error_rate=1) as proxy, requests.Session() as session:
+        # The circuit opens during the retries of the first request
+        with pytest.raises(CircuitOpenError):
+            send_request(session, "GET", proxy.base_url, "test", POLICY)
+        assert proxy.faults["error"] == 2
+        start = time.perf_counter()
+        with pytest.raises(CircuitOpenError):
+            send_request(session, "GET", proxy.base_url, "test", POLICY)
+        assert time.perf_counter() - start < 0.1
+    assert proxy.faults["error"] == 2
+
+
+class BrokenAnswerSession(requests.Session):
+    """
+    Session whose requests fail with the given error after reaching the host.
+    """
+
+    def __init__(self, error: Exception):
+        super().__init__()
+        self.error = error
+        self.sent = 0
+
+    def request(self, *args, **kwargs):
+        self.sent += 1
+        raise self.error
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError("Connection broken"), requests.TooManyRedirects("Exceeded 30 redirects"),
+                                   OSError("Failed to read the body")])
+def test_probe_failing_with_another_error_lets_the_next_probe_through(error, monkeypatch):
+    monkeypatch.setenv("CIRCUIT_BREAKER_FAILURES", "1")
+    monkeypatch.setenv("CIRCUIT_BREAKER_RESET_S", "0.1")
+    url = "http://host/video"
+    resilience.get_circuit_breaker(url).record_failure()
+    time.sleep(0.15)
+    with BrokenAnswerSession(error) as session, pytest.raises(ValueError if isinstance(error, requests.RequestException) else OSError):
+        send_request(session, "GET", url, "test", POLICY)
+    assert session.sent == 1
+    time.sleep(0.15)
+    # The circuit is not stuck open : a new probe reaches the host
+    with BrokenAnswerSession(requests.ConnectionError("refused")) as session, pytest.raises(ValueError):
+        send_request(session, "GET", url, "test", POLICY)
+    assert session.sent == 1
@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from timezones import WINDOWS_TO_IANA_TIMEZONES, format_local_date, get_zoneinfo, local_to_utc, parse_utc_date
+
+
+def test_every_windows_timezone_maps_to_a_known_iana_timezone():
+    unknown = [windows_id for windows_id, iana_name in WINDOWS_TO_IANA_TIMEZONES.items() if get_zoneinfo(windows_id) != ZoneInfo(iana_name)]
+    assert unknown == []
+
+
+def test_windows_and_iana_names_give_the_same_timezone():
+    assert get_zoneinfo("Romance Standard Time") == ZoneInfo("Europe/Paris")
+    assert get_zoneinfo("Europe/Paris") == ZoneInfo("Europe/Paris")
+    # UTC is also a Windows id
+    assert get_zoneinfo("UTC") == ZoneInfo("Etc/UTC")
+
+
+def test_unknown_timezone_raises_value_error():
+    with pytest.raises(ValueError, match="Unknown timezone"):
+        get_zoneinfo("Middle Earth Standard Time")
+
+
+@pytest.mark.parametrize("day, expected_utc", [
+    ("12/05/2024", datetime(2024, 5, 12, 17, 45, tzinfo=timezone.utc)), # Summer time, UTC+2
+    ("12/01/2024", datetime(2024, 1, 12, 18, 45, tzinfo=timezone.utc)), # Winter time, UTC+1
+])
+def test_local_to_utc_follows_daylight_saving_time(day, expected_utc):
+    assert local_to_utc(day, "19:45", "Romance Standard Time") == expected_utc
+
+
+def test_utc_date_of_the_listing_is_displayed_in_the_event_timezone():
+    creation_date_utc = parse_utc_date("2024-05-12 22:30:15")
+    assert creation_date_utc == datetime(2024, 5, 12, 22, 30, 15, tzinfo=timezone.utc)
+    assert format_local_date(creation_date_utc, "Romance Standard Time") == "13/05/2024 00:30"
+    assert format_local_date(creation_date_utc, "Eastern Standard Time") == "12/05/2024 18:30"
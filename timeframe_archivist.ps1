@@ -1,59 +1,131 @@
 
 param(
-    [string]$day, # Expected format: YYYY-MM-DD
-    [string]$event_start, # Expected format: HH:mm
-    [string]$event_stop, # Expected format: HH:mm
-    [string]$event_timezone, # Timezone of the event times
-    [string]$command, # Command to be executed - can be list_videos, copy_files or delete_files
+    [string]$range_start, # Expected format: DD/MM/YYYY - every video from this day to range_stop is listed
+    [string]$range_stop, # Expected format: DD/MM/YYYY
+    [string]$command, # Command to be executed - can be list_videos, session or check_device
     [string]$files_destination_path # Copy files to the given directory
 )
 
-function List-Videos {
+# List every video created between two days : each month folder of the range is walked only once.
+# The event windows are applied by the python side, on the UTC creation dates.
+function List-VideosInRange {
     param(
-        [string]$day,
-        [string]$event_start,
-        [string]$event_stop,
-        [object]$SourceFolder,
-        [string]$EventTimezone
+        [string]$RangeStart,
+        [string]$RangeStop,
+        [object]$SourceFolder
     )
 
     $filteredFiles = @()
+    # One more day on each side, so the videos of the events late or early in the day in any timezone are kept
+    $startDateTimeUTC = [DateTime]::ParseExact($RangeStart, "dd/MM/yyyy", $null).AddDays(-1)
+    $endDateTimeUTC = [DateTime]::ParseExact($RangeStop, "dd/MM/yyyy", $null).AddDays(2)
 
-    # Create DateTime objects in the event timezone and convert to local timezone
-    $eventTimeZoneInfo = [TimeZoneInfo]::FindSystemTimeZoneById($event_timezone)
-    $localTimeZoneInfo = [TimeZoneInfo]::Local
+    $yearMonths = @()
+    for ($month = $startDateTimeUTC.AddDays(1 - $startDateTimeUTC.Day); $month -le $endDateTimeUTC; $month = $month.AddMonths(1)) {
+        $yearMonths += $month.ToString("yyyyMM")
+    }
+    $folders = $SourceFolder.Items() | Where-Object { $_.IsFolder -and $yearMonths -contains $_.Name.Substring(0, [math]::Min(6, $_.Name.Length)) }
+
+    foreach ($folder in $folders) {
+        $items = $folder.GetFolder.Items() | Where-Object { ($_.Name -like "*.mp4" -or $_.Name -like "*.MOV") }
+        foreach ($item in $items) {
+            $itemCreationTimeUTC = $item.ExtendedProperty("System.DateCreated")
+            if ($itemCreationTimeUTC -ge $startDateTimeUTC -and $itemCreationTimeUTC -lt $endDateTimeUTC) {
+                $filteredFiles += [PSCustomObject]@{
+                    Id = "$($folder.Name)/$($item.Name)"
+                    Item = $item
+                    CreationTimeUTC = [DateTime]$itemCreationTimeUTC
+                }
+            }
+        }
+    }
 
-    $startDateTimeUTC = [TimeZoneInfo]::ConvertTimeToUtc(
-        [DateTime]::ParseExact("$day $event_start", "dd/MM/yyyy HH:mm", $null), 
-        $eventTimeZoneInfo
+    return $filteredFiles
+}
+
+# Each ExtendedProperty call is a round trip to the phone : the creation date read by the listing is reused.
+# The duration, resolution and codec are not read here, Shell COM gives no file path to read the container of a video
+# on the phone (see app/mp4_metadata.py, used by the local device backend)
+function Get-VideoInfos {
+    param(
+        [object]$Video
     )
 
-    $endDateTimeUTC = [TimeZoneInfo]::ConvertTimeToUtc(
-        [DateTime]::ParseExact("$day $event_stop", "dd/MM/yyyy HH:mm", $null), 
-        $eventTimeZoneInfo
+    $sizeBytes = [int64]$Video.Item.ExtendedProperty("System.Size")
+    $creationDateTime = $Video.CreationTimeUTC
+    return [PSCustomObject]@{
+        id = $Video.Id
+        original_name = $Video.Item.Name
+        size_bytes = $sizeBytes
+        creation_date_utc = $creationDateTime.ToString("yyyy-MM-dd HH:mm:ss")
+    }
+}
+
+# Every step is reported with one event on stdout (see app/device_protocol.py), the request ends with a "done" event
+function Copy-Videos {
+    param(
+        [object[]]$Videos,
+        [string]$DestinationPath
     )
 
+    # If destination path doesn't exist, create it only if we have some items to move
+    if (-not (test-path $DestinationPath) )
+    {
+        $created = new-item -itemtype directory -path $DestinationPath
+    }
 
+    $destinationFolder = $shell.Namespace($DestinationPath).self
+    foreach ($video in $Videos)
+    {
+        $item = $video.Item
+        $fileName = $item.Name
+        $sizeBytes = [int64]$item.ExtendedProperty("System.Size")
 
-    $yearMonth = $day.Substring(5,5).Replace("/","") + $day.Substring(2,4).Replace("/","") # Extract YYYYMM format
-    # Filter folders that start with YYYYMM
-    $folders = $SourceFolder.Items() | Where-Object { $_.IsFolder -and $_.Name.StartsWith($yearMonth) }
+        # Check the target file doesn't exist:
+        $targetFilePath = join-path -path $DestinationPath -childPath $fileName
+        if (test-path -path $targetFilePath)
+        {
+            Write-Message @{ event = "error"; id = $video.Id; message = "Destination file exists - file $($item.Name) not moved to :`n`t$targetFilePath" }
+            return
+        }
+        Write-Message @{ event = "copy_started"; id = $video.Id; size_bytes = $sizeBytes }
+        $stopwatch = [System.Diagnostics.Stopwatch]::StartNew()
+        $destinationFolder.GetFolder.CopyHere($item)
+        if (-not (test-path -path $targetFilePath))
+        {
+            Write-Message @{ event = "error"; id = $video.Id; message = "Failed to move file $($item.Name) to destination:`n`t$targetFilePath" }
+            return
+        }
+        Write-Message @{ event = "copied"; id = $video.Id; size_bytes = (Get-Item $targetFilePath).Length; seconds = $stopwatch.Elapsed.TotalSeconds }
+    }
+}
 
-    foreach ($folder in $folders) {
-        Write-Host $folder.GetFolder.Name
-		#$a = $folder.Name
-        $items = $folder.GetFolder.Items() | Where-Object { ($_.Name -like "*.mp4" -or $_.Name -like "*.MOV") }
-        foreach ($item in $items) {
-            $itemCreationTimeUTC = $item.ExtendedProperty("System.DateCreated")
-			$modifieddate = $itemCreationTime
-            
-            if ($itemCreationTimeUTC -ge $startDateTimeUTC -and $itemCreationTimeUTC -le $endDateTimeUTC) {
-                $filteredFiles += $item
-            }
+function Remove-Videos {
+    param(
+        [object[]]$Videos
+    )
+
+    foreach ($video in $Videos) {
+        $file = $video.Item
+        try {
+            # Use the InvokeVerb method on the COM object to delete the file
+            $file.InvokeVerb("delete")
+            Write-Message @{ event = "deleted"; id = $video.Id }
+        } catch {
+            Write-Message @{ event = "error"; id = $video.Id; message = "Failed to delete $($file.Name): $_" }
+            return
         }
     }
+}
 
-    return $filteredFiles
+# Write one JSON object on a single line of stdout (used by the session command)
+function Write-Message {
+    param(
+        [object]$Message
+    )
+
+    [Console]::Out.WriteLine(($Message | ConvertTo-Json -Compress -Depth 5))
+    [Console]::Out.Flush()
 }
 
 $phoneRelativePath = 'Internal Storage'
@@ -62,7 +134,14 @@ $PhoneFolder = ($shell.NameSpace("shell:MyComputerFolder").Items() | where Type
 
 # Check if the iphone is connected
 if ($null -eq $PhoneFolder) {
-    return '{"Error" : "Iphone not found. Check that it is correctly plugged in your machine."}' | ConvertTo-Json
+    Write-Message @{ event = "error"; message = "Iphone not found. Check that it is correctly plugged in your machine." }
+    return
+}
+
+# Only tells that the phone is plugged in, used by the watch mode
+if ($command -eq "check_device") {
+    Write-Message @{ event = "done" }
+    return
 }
 
 # After being connected, the Iphone can takes time to be available. We check every two seconds until we can access the folders.
@@ -75,116 +154,57 @@ while ($null -eq $SourceFolder) {
         }
 }
 
-$filteredVideos = List-Videos -day $day -event_start $event_start -event_stop $event_stop -SourceFolder $SourceFolder -EventTimezone $event_timezone
+$filteredVideos = List-VideosInRange -RangeStart $range_start -RangeStop $range_stop -SourceFolder $SourceFolder
 
 
-if ($command -eq "list_videos") {
-    $videoList = @()
-    foreach ($video in $filteredVideos) {
-        $sizeMB = [math]::round($video.ExtendedProperty("System.Size") / 1MB, 0)
-        $creationDate = $video.ExtendedProperty("System.DateCreated")
-        $creationDateTime = [DateTime]$creationDate
-        #$formattedCreationDate = $creationDate.ToString("dd/MM/yyyy HH:mm")
-        # Define the target timezone
-        $targetTimeZone = [TimeZoneInfo]::FindSystemTimeZoneById($event_timezone)
-        
-        # Convert local DateTime to the target timezone
-        $creationDateTargetTZ = [TimeZoneInfo]::ConvertTime($creationDateTime, [TimeZoneInfo]::UTC, $targetTimeZone)
-        
-        # Format the DateTime to string in the target timezone
-        $formattedCreationDateTargetTZ = $creationDateTargetTZ.ToString("dd/MM/yyyy HH:mm")
-        $videoObject = [PSCustomObject]@{
-            original_name = $video.Name
-            size_mb = "$sizeMB"
-            creation_date = $formattedCreationDateTargetTZ
-        }
-        $videoList += $videoObject
-    }
+# The videos are listed as soon as their infos are read
+$manifest = @{}
+foreach ($video in $filteredVideos) {
+    $manifest[$video.Id] = $video
+    Write-Message @{ event = "listed"; video = (Get-VideoInfos -Video $video) }
+}
+Write-Message @{ event = "listing_done" }
 
-    if ($videoList.Count -eq 0) {
-        return "[]" | ConvertTo-Json
-    } elseif ($videoList.Count -eq 1) {
-        $json_videoList = $videoList | ConvertTo-Json 
-        return "[" + $json_videoList + "]"
-    }
-    else{
-        return $videoList | ConvertTo-Json
-    }
-    
-    
+if ($command -eq "list_videos") {
+    return
 }
 
-elseif ($command -eq "copy_files") {
-    
-    if (($filteredVideos | Measure-Object).Count -gt 0)
-    {
-        # If destination path doesn't exist, create it only if we have some items to move
-        if (-not (test-path $files_destination_path) )
-        {
-            $created = new-item -itemtype directory -path $files_destination_path
+# Then copies and deletions are requested on stdin using the manifest ids
+elseif ($command -eq "session") {
+    while ($true) {
+        $line = [Console]::In.ReadLine()
+        if ($null -eq $line) {
+            break
         }
- 
-        $destinationFolder = $shell.Namespace($files_destination_path).self
-        foreach ($item in $filteredVideos)
-        {
-            $fileName = $item.Name
- 
-            # Check the target file doesn't exist:
-            $targetFilePath = join-path -path $files_destination_path -childPath $fileName
-            if (test-path -path $targetFilePath)
-            {
-                    $errorMessage = "Destination file exists - file $($item.Name) not moved to :`n`t$targetFilePath"
-                    $errorObject = @{ Error = $errorMessage }
-                    return $errorObject | ConvertTo-Json
-            }
-            else
-            {
-                $destinationFolder.GetFolder.CopyHere($item)
-                if (test-path -path $targetFilePath)
-                {
-                    
-                }
-                else
-                {
-                    $errorMessage = "Failed to move file $($item.Name) to destination:`n`t$targetFilePath"
-                    $errorObject = @{ Error = $errorMessage }
-                    return $errorObject | ConvertTo-Json
-                }
-            }
+        $request = $line | ConvertFrom-Json
+        if ($request.command -eq "exit") {
+            break
         }
-        return '{"Result" : "Success"}' | ConvertTo-Json
-    }
-    return '{"Error" : "No video to copy"}' | ConvertTo-Json
-}
 
-elseif ($command -eq "delete_files") {
-    $deleteResults = @()
-
-    foreach ($file in $filteredVideos) {
-        try {
-            # Use the InvokeVerb method on the COM object to delete the file
-            $file.InvokeVerb("delete")
-            $result = [PSCustomObject]@{
-                FileName = $file.Name
-                Status = "Deleted Successfully"
+        $videos = @()
+        $unknownIds = @($request.ids | Where-Object { -not $manifest.ContainsKey($_) })
+        if ($unknownIds.Count -gt 0) {
+            Write-Message @{ event = "error"; message = "Videos not found in the device manifest : $($unknownIds -join ', ')" }
+        }
+        else {
+            foreach ($id in $request.ids) {
+                $videos += $manifest[$id]
             }
-        } catch {
-            $result = [PSCustomObject]@{
-                FileName = $file.Name
-                Status = "Failed to Delete: $_"
+            if ($request.command -eq "copy_files") {
+                Copy-Videos -Videos $videos -DestinationPath $files_destination_path
+            }
+            elseif ($request.command -eq "delete_files") {
+                Remove-Videos -Videos $videos
+            }
+            else {
+                Write-Message @{ event = "error"; message = "Session command is incorrect. It has to be choosen from : 'copy_files, delete_files, exit'" }
             }
         }
-        $deleteResults += $result
-    }
-
-    if ($deleteResults.Count -eq 0) {
-        return '{"Error" : "No video to delete"}' | ConvertTo-Json
-    } else {
-        return $deleteResults | ConvertTo-Json
+        Write-Message @{ event = "done" }
     }
 }
 # Case 
 else {
-    Write-Error "Command parameter is incorrect. It has to be choosen from : 'list_videos, copy_files, delete_files'"
+    Write-Error "Command parameter is incorrect. It has to be choosen from : 'list_videos, session, check_device'"
     return $false
-}
\ No newline at end of file
+}